@@ -1,5 +1,6 @@
 from __future__ import annotations
 import os
+import re
 from logging.config import fileConfig
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, pool
@@ -15,6 +16,13 @@ from app.models import Base
 
 target_metadata = Base.metadata
 
+# monthly search_events partitions (and detached ones) are managed by app.partitions, not by migrations
+SEARCH_EVENT_PARTITION = re.compile(r"search_events_(\d{4}_\d{2}|default)$")
+
+def include_object(object, name, type_, reflected, compare_to):
+    table_name = object.table.name if type_ == "index" else name
+    return not (type_ in ("table", "index") and reflected and SEARCH_EVENT_PARTITION.match(table_name or ""))
+
 def get_url() -> str:
     url = os.getenv("DATABASE_URL") or config.get_main_option("sqlalchemy.url")
     if not url:
@@ -29,6 +37,7 @@ def run_migrations_offline() -> None:
         literal_binds=True,
         compare_type=True,
         compare_server_default=True,
+        include_object=include_object,
     )
     with context.begin_transaction():
         context.run_migrations()
@@ -42,6 +51,7 @@ def run_migrations_online() -> None:
             target_metadata=target_metadata,
             compare_type=True,
             compare_server_default=True,
+            include_object=include_object,
         )
         with context.begin_transaction():
             context.run_migrations()
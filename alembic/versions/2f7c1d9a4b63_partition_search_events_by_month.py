@@ -0,0 +1,106 @@
+"""partition search_events by month
+
+Revision ID: 2f7c1d9a4b63
+Revises: d8b3e5f1a4c9
+Create Date: 2026-10-17 23:12:40.118274
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f7c1d9a4b63'
+down_revision: Union[str, Sequence[str], None] = 'd8b3e5f1a4c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = "id, user_id, genre_id, author_id, query_text, created_at"
+# months created ahead of the current one, app.partitions keeps extending this
+MONTHS_AHEAD = 2
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _search_events_columns(id_column: sa.Column) -> list:
+    return [
+        id_column,
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=True),
+        sa.Column('author_id', sa.Integer(), nullable=True),
+        sa.Column('query_text', sa.String(length=511), nullable=True),
+        sa.Column('created_at', sa.Date(), server_default=sa.text("TIMEZONE('utc', now())"), nullable=False),
+        sa.ForeignKeyConstraint(['author_id'], ['authors.id'], name=op.f('fk_search_events_author_id_authors'), ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['genre_id'], ['genres.id'], name=op.f('fk_search_events_genre_id_genres'), ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], name=op.f('fk_search_events_user_id_users'), ondelete='CASCADE'),
+    ]
+
+
+def upgrade() -> None:
+    """Range-partition search_events by month and add the search_event_days compaction table"""
+    # the old table keeps its data until the copy below; its sequence carries over to the new one
+    op.execute("ALTER SEQUENCE search_events_id_seq OWNED BY NONE")
+    op.rename_table('search_events', 'search_events_unpartitioned')
+    op.execute("ALTER TABLE search_events_unpartitioned RENAME CONSTRAINT pk_search_events TO pk_search_events_unpartitioned")
+
+    op.create_table('search_events',
+    *_search_events_columns(
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('search_events_id_seq')"), autoincrement=False, nullable=False)
+    ),
+    # the partition key has to be part of every unique constraint
+    sa.PrimaryKeyConstraint('id', 'created_at', name=op.f('pk_search_events')),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    op.execute("ALTER SEQUENCE search_events_id_seq OWNED BY search_events.id")
+    op.create_index('ix_search_events_user_id_created_at', 'search_events', ['user_id', 'created_at'])
+    op.execute("CREATE TABLE search_events_default PARTITION OF search_events DEFAULT")
+
+    bind = op.get_bind()
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM search_events_unpartitioned")).scalar()
+    current = date.today().replace(day=1)
+    month = min(oldest.replace(day=1), current) if oldest else current
+    while month <= _add_months(current, MONTHS_AHEAD):
+        following = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE search_events_{month:%Y_%m} PARTITION OF search_events "
+            f"FOR VALUES FROM ('{month}') TO ('{following}')"
+        )
+        month = following
+
+    op.execute(f"INSERT INTO search_events ({COLUMNS}) SELECT {COLUMNS} FROM search_events_unpartitioned")
+    op.drop_table('search_events_unpartitioned')
+    op.execute("ANALYZE search_events")
+
+    op.create_table('search_event_days',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('queries', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name=op.f('fk_search_event_days_user_id_users'), ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'day', name=op.f('pk_search_event_days'))
+    )
+
+
+def downgrade() -> None:
+    """Back to a plain search_events table; compacted days and detached partitions are not restored"""
+    op.drop_table('search_event_days')
+
+    op.execute("ALTER SEQUENCE search_events_id_seq OWNED BY NONE")
+    op.rename_table('search_events', 'search_events_partitioned')
+    op.execute("ALTER TABLE search_events_partitioned RENAME CONSTRAINT pk_search_events TO pk_search_events_partitioned")
+
+    op.create_table('search_events',
+    *_search_events_columns(
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('search_events_id_seq')"), autoincrement=False, nullable=False)
+    ),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_search_events'))
+    )
+    op.execute("ALTER SEQUENCE search_events_id_seq OWNED BY search_events.id")
+    op.execute(f"INSERT INTO search_events ({COLUMNS}) SELECT {COLUMNS} FROM search_events_partitioned")
+    # partitions go with their parent
+    op.drop_table('search_events_partitioned')
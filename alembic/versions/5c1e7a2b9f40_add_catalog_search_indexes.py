@@ -0,0 +1,47 @@
+"""add catalog search indexes
+
+Revision ID: 5c1e7a2b9f40
+Revises: 9039df349c31
+Create Date: 2026-10-17 10:12:03.118402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e7a2b9f40'
+down_revision: Union[str, Sequence[str], None] = '9039df349c31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Full-text and trigram indexes used by app.search.PostgresSearch"""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # expressions must stay identical to app.search (to_tsvector('simple'::regconfig, ...))
+    op.execute("""
+        CREATE INDEX ix_books_title_tsv
+        ON books USING gin (to_tsvector('simple'::regconfig, title))
+    """)
+    op.execute("""
+        CREATE INDEX ix_books_title_trgm
+        ON books USING gin (title gin_trgm_ops)
+    """)
+    op.execute("""
+        CREATE INDEX ix_authors_name_tsv
+        ON authors USING gin (to_tsvector('simple'::regconfig, name))
+    """)
+    op.execute("""
+        CREATE INDEX ix_authors_name_trgm
+        ON authors USING gin (name gin_trgm_ops)
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_authors_name_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_authors_name_tsv")
+    op.execute("DROP INDEX IF EXISTS ix_books_title_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_books_title_tsv")
@@ -0,0 +1,39 @@
+"""composite indexes for crud queries
+
+Revision ID: 6a1e4c8b2d57
+Revises: 2f7c1d9a4b63
+Create Date: 2026-10-17 23:58:06.402915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6a1e4c8b2d57'
+down_revision: Union[str, Sequence[str], None] = '2f7c1d9a4b63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Indexes for the catalog title sort/paging, reservation history and stats, active loans and the overdue sweep"""
+    op.create_index('ix_books_title_id', 'books', ['title', 'id'], unique=False)
+    op.create_index('ix_books_genre_id_title_id', 'books', ['genre_id', 'title', 'id'], unique=False)
+    op.create_index('ix_books_author_id_title_id', 'books', ['author_id', 'title', 'id'], unique=False)
+    op.create_index('ix_reservations_user_id_reserve_date', 'reservations', ['user_id', 'reserve_date'], unique=False)
+    op.create_index('ix_reservations_open_user_id_return_date', 'reservations', ['user_id', 'return_date'], unique=False, postgresql_where=sa.text("status IN ('active', 'overdue')"))
+    op.create_index('ix_reservations_active_return_date', 'reservations', ['return_date'], unique=False, postgresql_where=sa.text("status = 'active'"))
+    op.execute("ANALYZE books, reservations")
+
+
+def downgrade() -> None:
+    """Drop the indexes"""
+    op.drop_index('ix_reservations_active_return_date', table_name='reservations', postgresql_where=sa.text("status = 'active'"))
+    op.drop_index('ix_reservations_open_user_id_return_date', table_name='reservations', postgresql_where=sa.text("status IN ('active', 'overdue')"))
+    op.drop_index('ix_reservations_user_id_reserve_date', table_name='reservations')
+    op.drop_index('ix_books_author_id_title_id', table_name='books')
+    op.drop_index('ix_books_genre_id_title_id', table_name='books')
+    op.drop_index('ix_books_title_id', table_name='books')
@@ -0,0 +1,73 @@
+"""add user_stats rollups
+
+Revision ID: b7d24e0c6a13
+Revises: 5c1e7a2b9f40
+Create Date: 2026-10-17 14:02:47.530116
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d24e0c6a13'
+down_revision: Union[str, Sequence[str], None] = '5c1e7a2b9f40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create the analytics rollup tables and backfill them from existing history"""
+    op.create_table('user_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('total_queries', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('total_read', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('on_hand', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name=op.f('fk_user_stats_user_id_users'), ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', name=op.f('pk_user_stats'))
+    )
+    op.create_table('user_stat_buckets',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('kind', sa.Enum('search_genre', 'search_author', 'read_genre', name='statkind', native_enum=False), nullable=False),
+    sa.Column('ref_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name=op.f('fk_user_stat_buckets_user_id_users'), ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'day', 'kind', 'ref_id', name=op.f('pk_user_stat_buckets'))
+    )
+
+    op.execute("""
+        INSERT INTO user_stats (user_id, total_queries, total_read, on_hand)
+        SELECT u.id,
+               (SELECT count(*) FROM search_events e WHERE e.user_id = u.id),
+               (SELECT count(*) FROM reservations r WHERE r.user_id = u.id AND r.status = 'returned'),
+               (SELECT count(*) FROM reservations r WHERE r.user_id = u.id AND r.status IN ('active', 'overdue'))
+        FROM users u
+    """)
+    op.execute("""
+        INSERT INTO user_stat_buckets (user_id, day, kind, ref_id, count)
+        SELECT user_id, created_at, 'search_genre', genre_id, count(*)
+        FROM search_events WHERE genre_id IS NOT NULL
+        GROUP BY user_id, created_at, genre_id
+    """)
+    op.execute("""
+        INSERT INTO user_stat_buckets (user_id, day, kind, ref_id, count)
+        SELECT user_id, created_at, 'search_author', author_id, count(*)
+        FROM search_events WHERE author_id IS NOT NULL
+        GROUP BY user_id, created_at, author_id
+    """)
+    # the actual return day is not stored, the due date is the closest we have
+    op.execute("""
+        INSERT INTO user_stat_buckets (user_id, day, kind, ref_id, count)
+        SELECT r.user_id, COALESCE(r.return_date, r.reserve_date), 'read_genre', b.genre_id, count(*)
+        FROM reservations r JOIN books b ON b.id = r.book_id
+        WHERE r.status = 'returned' AND b.genre_id IS NOT NULL
+        GROUP BY r.user_id, COALESCE(r.return_date, r.reserve_date), b.genre_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('user_stat_buckets')
+    op.drop_table('user_stats')
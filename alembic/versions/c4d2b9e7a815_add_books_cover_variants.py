@@ -0,0 +1,29 @@
+"""add books cover_variants
+
+Revision ID: c4d2b9e7a815
+Revises: f1a6c3d8e072
+Create Date: 2026-10-17 20:12:44.571093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d2b9e7a815'
+down_revision: Union[str, Sequence[str], None] = 'f1a6c3d8e072'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add cover_variants column to books table"""
+    op.add_column('books', sa.Column('cover_variants', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    """Remove cover_variants column from books table"""
+    op.drop_column('books', 'cover_variants')
@@ -0,0 +1,27 @@
+"""add catalog_version sequence
+
+Revision ID: d8b3e5f1a4c9
+Revises: c4d2b9e7a815
+Create Date: 2026-10-17 21:48:09.336517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8b3e5f1a4c9'
+down_revision: Union[str, Sequence[str], None] = 'c4d2b9e7a815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Sequence bumped by catalog writers outside the API to invalidate its caches"""
+    op.execute("CREATE SEQUENCE IF NOT EXISTS catalog_version")
+
+
+def downgrade() -> None:
+    """Drop catalog_version sequence"""
+    op.execute("DROP SEQUENCE IF EXISTS catalog_version")
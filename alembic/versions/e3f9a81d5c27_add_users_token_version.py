@@ -0,0 +1,28 @@
+"""add users token_version
+
+Revision ID: e3f9a81d5c27
+Revises: b7d24e0c6a13
+Create Date: 2026-10-17 16:40:12.904385
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3f9a81d5c27'
+down_revision: Union[str, Sequence[str], None] = 'b7d24e0c6a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add token_version column to users table"""
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Remove token_version column from users table"""
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,32 @@
+"""add open reservation unique index
+
+Revision ID: f1a6c3d8e072
+Revises: e3f9a81d5c27
+Create Date: 2026-10-17 18:05:31.118904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1a6c3d8e072'
+down_revision: Union[str, Sequence[str], None] = 'e3f9a81d5c27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """One open (active or overdue) reservation per user and book"""
+    op.execute("DROP INDEX IF EXISTS uq_reservations_active_user_book")
+    op.create_index(
+        'uq_reservations_open_user_book', 'reservations', ['user_id', 'book_id'],
+        unique=True, postgresql_where=sa.text("status <> 'returned'")
+    )
+
+
+def downgrade() -> None:
+    """Drop the open reservation unique index"""
+    op.drop_index('uq_reservations_open_user_book', table_name='reservations')
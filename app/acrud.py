@@ -0,0 +1,100 @@
+"""
+Awaitable versions of the app.crud functions used by the endpoints.
+
+Each function accepts either session type:
+
+- AsyncSession (DB_ASYNC=1): the crud function runs through AsyncSession.run_sync, i.e. the
+  same statements executed on the async driver inside a greenlet, without a thread per request.
+- Session: the crud function runs on Starlette's threadpool, which is where the former
+  sync `def` endpoints ran it.
+
+crud functions that return ORM objects eager-load everything the response schemas read
+(joinedload), so nothing lazy-loads once the object leaves the session.
+"""
+import asyncio
+import functools
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud
+from .cache import CachedBody, VersionedCache
+from .hashing import hasher
+
+
+def _awaitable(fn):
+    @functools.wraps(fn)
+    async def wrapper(db, *args, **kwargs):
+        if isinstance(db, AsyncSession):
+            return await db.run_sync(fn, *args, **kwargs)
+        return await run_in_threadpool(fn, db, *args, **kwargs)
+    return wrapper
+
+
+get_books = _awaitable(crud.get_books)
+get_facets = _awaitable(crud.get_facets)
+get_user = _awaitable(crud.get_user)
+get_user_by_email = _awaitable(crud.get_user_by_email)
+get_user_reservations = _awaitable(crud.get_user_reservations)
+get_user_history = _awaitable(crud.get_user_history)
+get_user_stats = _awaitable(crud.get_user_stats)
+get_reservation = _awaitable(crud.get_reservation)
+create_reservation = _awaitable(crud.create_reservation)
+return_reservation = _awaitable(crud.return_reservation)
+get_book_counts = _awaitable(crud.get_book_counts)
+create_reservations = _awaitable(crud.create_reservations)
+return_reservations = _awaitable(crud.return_reservations)
+revoke_user_tokens = _awaitable(crud.revoke_user_tokens)
+
+_get_token_version = _awaitable(crud.get_token_version)
+_build_book_page = _awaitable(crud.build_book_page)
+_insert_user = _awaitable(crud.create_user)
+
+
+async def get_token_version(db, user_id: int) -> int | None:
+    version = crud.token_versions.get(user_id)
+    if version is not None:
+        return version
+    return await _get_token_version(db, user_id)
+
+
+_load_locks: dict[int, asyncio.Lock] = {}
+
+
+async def get_cached(cache: VersionedCache, db) -> CachedBody:
+    """Fresh cache entries are returned without leaving the event loop"""
+    entry = cache.peek()
+    if entry is not None:
+        return entry
+    if isinstance(db, AsyncSession):
+        # cache.get loads under a thread lock, and through run_sync the load yields to the
+        # event loop; a second loader on the loop thread would then block it for good
+        async with _load_locks.setdefault(id(cache), asyncio.Lock()):
+            return await db.run_sync(cache.get)
+    return await run_in_threadpool(cache.get, db)
+
+
+async def get_book_page(db, **params) -> CachedBody:
+    """Cached catalog pages are returned without leaving the event loop"""
+    key = crud.catalog_page_key(**params)
+    entry = crud.catalog_pages.get(key)
+    if entry is not None:
+        return entry
+    return await _build_book_page(db, key)
+
+
+async def authenticate_user(db, login: str, password: str):
+    user = await get_user_by_email(db, login)
+
+    if not user:
+        print(f"User not found: {login}")
+        return False
+    if not await hasher.verify(password, user.password_hash):
+        print(f"Password mismatch for: {login}")
+        return False
+    return user
+
+
+async def create_user(db, user_data):
+    hashed_password = await hasher.hash(user_data.password)
+    return await _insert_user(db, user_data, hashed_password)
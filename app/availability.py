@@ -0,0 +1,118 @@
+"""
+Live book availability for the catalog.
+
+crud publishes the stock count of every book a reservation or return changed, after the
+commit; each /api/books/availability/stream connection subscribes to the book ids on screen
+and receives their changes. A subscriber buffers at most one pending change per book: a newer
+count replaces the pending one and the deltas add up, so a slow client catches up with the
+latest counts instead of an ever-growing backlog.
+
+The hub is per process: with several API workers a client only hears about changes made
+through its own worker, and counts published by two concurrent commits can arrive in either
+order. Both settle with the next change or the snapshot sent on (re)connect.
+"""
+import os
+import asyncio
+import threading
+
+# book ids per stream
+AVAILABILITY_MAX_BOOKS = int(os.getenv("AVAILABILITY_MAX_BOOKS", "100"))
+# open streams per process, more are refused with 503
+AVAILABILITY_MAX_SUBSCRIBERS = int(os.getenv("AVAILABILITY_MAX_SUBSCRIBERS", "1000"))
+# seconds between keep-alive comments on a quiet stream, keeps proxies from closing it
+AVAILABILITY_HEARTBEAT = float(os.getenv("AVAILABILITY_HEARTBEAT", "15"))
+
+
+class Subscription:
+    def __init__(self, book_ids: frozenset[int], loop: asyncio.AbstractEventLoop):
+        self.book_ids = book_ids
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self._pending: dict[int, dict] = {}
+        self._lock = threading.Lock()
+
+    def push(self, book_id: int, count: int, delta: int) -> bool:
+        """Called from any thread; True if the change was merged into a pending one"""
+        with self._lock:
+            pending = self._pending.get(book_id)
+            if pending is not None:
+                delta += pending["delta"]
+            self._pending[book_id] = {"book_id": book_id, "count": count, "delta": delta}
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # the loop is closed, so is the stream
+            pass
+        return pending is not None
+
+    async def changes(self, timeout: float) -> list[dict]:
+        """The pending changes, waiting up to timeout for the first one; [] on timeout"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        with self._lock:
+            self._ready.clear()
+            changes, self._pending = list(self._pending.values()), {}
+        return changes
+
+
+class AvailabilityHub:
+    def __init__(self, max_subscribers: int = AVAILABILITY_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._by_book: dict[int, set[Subscription]] = {}
+        self._subscriptions: set[Subscription] = set()
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "subscribed": 0,
+            "rejected": 0,
+            "published": 0,
+            "delivered": 0,
+            "merged": 0,
+        }
+
+    def subscribe(self, book_ids) -> Subscription | None:
+        """From the event loop of the stream; None when max_subscribers streams are open"""
+        subscription = Subscription(frozenset(book_ids), asyncio.get_running_loop())
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                self.stats["rejected"] += 1
+                return None
+            self._subscriptions.add(subscription)
+            for book_id in subscription.book_ids:
+                self._by_book.setdefault(book_id, set()).add(subscription)
+            self.stats["subscribed"] += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            for book_id in subscription.book_ids:
+                subscribers = self._by_book.get(book_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_book[book_id]
+
+    def publish(self, changes: dict[int, tuple[int, int]]):
+        """book_id -> (count, delta) after a commit, from any thread"""
+        if not self._by_book:
+            return
+        with self._lock:
+            targets = [
+                (subscription, book_id, count, delta)
+                for book_id, (count, delta) in changes.items()
+                for subscription in self._by_book.get(book_id, ())
+            ]
+            self.stats["published"] += len(changes)
+        merged = sum(subscription.push(book_id, count, delta) for subscription, book_id, count, delta in targets)
+        with self._lock:
+            self.stats["delivered"] += len(targets)
+            self.stats["merged"] += merged
+
+    def subscribers(self) -> int:
+        return len(self._subscriptions)
+
+
+hub = AvailabilityHub()
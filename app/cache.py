@@ -0,0 +1,174 @@
+"""
+In-process caches.
+
+VersionedCache holds one pre-serialized response body (plus its ETag) that is rebuilt on
+the first request after invalidate() or after `ttl` seconds. The TTL bounds staleness for
+writers that live in another process, such as scripts/dataset.py.
+
+TTLCache is a bounded LRU mapping whose entries also expire after `ttl` seconds.
+
+PageCache is a TTLCache of serialized responses that is emptied as a whole by invalidate(),
+for data where any write can change many cached pages.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass(frozen=True)
+class CachedBody:
+    body: bytes
+    etag: str
+    version: int
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+class VersionedCache:
+    def __init__(self, loader: Callable[..., bytes], ttl: float):
+        self.loader = loader
+        self.ttl = ttl
+        self.version = 0
+
+        self._entry: CachedBody | None = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def peek(self) -> CachedBody | None:
+        """The cached body if it is still fresh, without loading"""
+        entry = self._entry
+        if entry is not None and entry.version == self.version and time.monotonic() - self._loaded_at < self.ttl:
+            self.stats["hits"] += 1
+            return entry
+        return None
+
+    def get(self, *args) -> CachedBody:
+        """Returns the cached body, calling loader(*args) if it is missing or expired"""
+        entry = self._entry
+        if entry is not None and entry.version == self.version and time.monotonic() - self._loaded_at < self.ttl:
+            self.stats["hits"] += 1
+            return entry
+
+        with self._lock:
+            entry = self._entry
+            if entry is not None and entry.version == self.version and time.monotonic() - self._loaded_at < self.ttl:
+                self.stats["hits"] += 1
+                return entry
+
+            self.stats["misses"] += 1
+            version = self.version
+            body = self.loader(*args)
+            entry = CachedBody(body=body, etag=make_etag(body), version=version)
+            # an invalidate() that raced with the load wins, the next call reloads
+            if version == self.version:
+                self._entry = entry
+                self._loaded_at = time.monotonic()
+            return entry
+
+    def invalidate(self):
+        self.version += 1
+        self.stats["invalidations"] += 1
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[1] < time.monotonic():
+                if item is not _MISSING:
+                    del self._data[key]
+                self.stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class PageCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.version = 0
+        self.invalidated_at = float("-inf")
+        self._pages = TTLCache(maxsize, ttl)
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "uncached_builds": 0}
+
+    def get(self, key) -> CachedBody | None:
+        entry = self._pages.get(key)
+        if entry is None or entry.version != self.version:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return entry
+
+    def put(self, key, body: bytes, version: int, store: bool = True) -> CachedBody:
+        """
+        Stores a page built from data read at `version`. Pages that raced with an
+        invalidate(), or built with store=False, are returned but not stored.
+        """
+        entry = CachedBody(body=body, etag=make_etag(body), version=version)
+        if not store:
+            self.stats["uncached_builds"] += 1
+        elif version == self.version:
+            self._pages.set(key, entry)
+        return entry
+
+    def seconds_since_invalidation(self) -> float:
+        return time.monotonic() - self.invalidated_at
+
+    def invalidate(self):
+        self.version += 1
+        self.invalidated_at = time.monotonic()
+        self.stats["invalidations"] += 1
+        self._pages.clear()
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._pages)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match comparison (weak comparison, as RFC 9110 requires for this header)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
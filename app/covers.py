@@ -0,0 +1,135 @@
+"""
+Resized cover variants.
+
+scripts/covers.py renders every original cover into a few sizes and formats and stores the
+file names in Book.cover_variants as {size: {format: name}}. Names are content hashes, so a
+file never changes once published and is served with an immutable, year-long cache policy
+by CoverFiles, mounted at COVER_URL_PREFIX (point it at a CDN in front of the same files).
+"""
+import os
+import re
+import stat
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response, FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope, Receive, Send
+
+COVER_VARIANTS_DIR = os.getenv("COVER_VARIANTS_DIR", "media/covers")
+COVER_URL_PREFIX = os.getenv("COVER_URL_PREFIX", "/covers").rstrip("/")
+
+# name -> bounding box; thumbnails for the catalog grid (2x the card size), detail for larger views
+COVER_SIZES = {"thumb": (320, 480), "detail": (800, 1200)}
+# preferred first, the frontend lists them in this order in <picture>
+COVER_FORMATS = ("avif", "webp")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+HASHED_NAME = re.compile(r"(?:^|/)[0-9a-f]{2}/([0-9a-f]{16,})\.\w+$")
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def variant_urls(variants: dict | None) -> dict[str, dict[str, str]] | None:
+    """Book.cover_variants -> {size: {format: url}}"""
+    if not variants:
+        return None
+    return {
+        size: {fmt: f"{COVER_URL_PREFIX}/{name}" for fmt, name in formats.items()}
+        for size, formats in variants.items()
+    }
+
+
+def parse_range(value: str, size: int) -> tuple[int, int] | None:
+    """
+    First byte and last byte (inclusive) of a single `bytes=` range, None if it cannot be
+    satisfied. Raises ValueError for anything that is not a single byte range, the caller
+    then serves the whole file as RFC 9110 allows.
+    """
+    match = BYTE_RANGE.match(value.strip())
+    if match is None or match.groups() == ("", ""):
+        raise ValueError(value)
+    first, last = match.groups()
+    if first == "":
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = size - 1 if last == "" else min(int(last), size - 1)
+    if start >= size or start > end:
+        return None
+    return start, end
+
+
+class PartialFileResponse(Response):
+    chunk_size = 64 * 1024
+
+    def __init__(self, path, start: int, end: int, size: int, headers: Headers):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.status_code = 206
+        self.background = None
+        self.init_headers({
+            key: value for key, value in headers.items() if key not in ("content-length", "content-type")
+        })
+        self.headers["content-type"] = headers.get("content-type", "application/octet-stream")
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # the file shrank under us, close the response instead of hanging the client
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class CoverFiles(StaticFiles):
+    """
+    StaticFiles for content-hashed files: immutable caching, the content hash as a strong
+    ETag (stable across hosts, unlike the mtime-based default) and single byte-range requests.
+    """
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        hashed = HASHED_NAME.search(str(full_path).replace(os.sep, "/"))
+        if hashed:
+            response.headers["etag"] = f'"{hashed.group(1)}"'
+        response.headers["cache-control"] = IMMUTABLE
+        response.headers["accept-ranges"] = "bytes"
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        if status_code != 200 or "range" not in request_headers or not stat.S_ISREG(stat_result.st_mode):
+            return response
+
+        # If-Range: only honour the range if the client still has this exact representation
+        if_range = request_headers.get("if-range")
+        if if_range is not None and if_range.strip() != response.headers["etag"]:
+            return response
+
+        size = stat_result.st_size
+        try:
+            byte_range = parse_range(request_headers["range"], size)
+        except ValueError:
+            return response
+        if byte_range is None:
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}", "cache-control": IMMUTABLE})
+        return PartialFileResponse(full_path, *byte_range, size, response.headers)
@@ -1,19 +1,91 @@
 from datetime import timedelta, timezone, datetime, date
+from collections import Counter
 from dotenv import load_dotenv
 
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import or_, text, select, exists, case, func, desc
-from . import models
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy import and_, text, select, exists, case, func, desc, tuple_, insert, update, literal, Date
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from sqlalchemy.ext.compiler import compiles
+from pydantic import TypeAdapter
+from . import models, schemas
+from . import search as search_backends
+from . import serializers
+from .cache import VersionedCache, TTLCache, PageCache, CachedBody
+from .db import reads_from_replica, READ_AFTER_WRITE_SECONDS
+from .availability import hub as availability
+from .suggest import suggestions
 
 import jwt
-from pwdlib import PasswordHash
 import os
+import json
+import base64
+import functools
 
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "secret")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 
-password_hash = PasswordHash.recommended()
+# "rollup" reads user_stats/user_stat_buckets, "live" aggregates raw history in one query
+USER_STATS_SOURCE = os.getenv("USER_STATS_SOURCE", "rollup")
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "600"))
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# how long a revocation done by another process can go unnoticed
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+token_versions = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "512"))
+# how long stock counts changed by another API process can stay stale in this one
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "30"))
+
+catalog_pages = PageCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+CATALOG_COUNT_CACHE_SIZE = int(os.getenv("CATALOG_COUNT_CACHE_SIZE", "4096"))
+# book counts per filter only change with imports, which also clear them via catalog_version
+CATALOG_COUNT_CACHE_TTL = float(os.getenv("CATALOG_COUNT_CACHE_TTL", "300"))
+
+catalog_counts = TTLCache(CATALOG_COUNT_CACHE_SIZE, CATALOG_COUNT_CACHE_TTL)
+
+# largest top-N per facet a catalog request may ask for
+CATALOG_FACETS_MAX = int(os.getenv("CATALOG_FACETS_MAX", "50"))
+# facet counts only change with imports too, same lifetime and invalidation as catalog_counts
+catalog_facets = TTLCache(CATALOG_COUNT_CACHE_SIZE, CATALOG_COUNT_CACHE_TTL)
+
+GENRE_LIST = TypeAdapter(list[schemas.Genre])
+AUTHOR_LIST = TypeAdapter(list[schemas.Author])
+BOOK_PAGE = TypeAdapter(schemas.BookPage)
+
+def encode_cursor(sort: str | None, book) -> str:
+    """Opaque keyset cursor pointing just past `book` for the given sort."""
+    key = [book.id] if sort is None else [book.title, book.id]
+    payload = json.dumps({"s": sort, "k": key}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str | None) -> list:
+    """Returns the keyset values stored in `cursor`, raises ValueError if it is malformed or was issued for another sort"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        key = payload["k"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Malformed cursor") from e
+
+    if not isinstance(payload, dict) or not isinstance(key, list):
+        raise ValueError("Malformed cursor")
+    if payload.get("s") != sort or len(key) != (1 if sort is None else 2):
+        raise ValueError("Cursor does not match sort order")
+    # [id] or [title, id]; anything else would only fail in SQL
+    *title, book_id = key
+    if (
+        type(book_id) is not int or not -2**31 <= book_id < 2**31
+        or any(not isinstance(value, str) for value in title)
+    ):
+        raise ValueError("Malformed cursor")
+    return key
 
 def get_books(
         db: Session,
@@ -21,13 +93,24 @@ def get_books(
         sort: str | None = None, 
         genre_id: int | None = None,
         author_id: int | None = None,
-        search: str | None = None
+        search: str | None = None,
+        cursor: str | None = None,
+        paging: str = "offset",
+        total: str = "exact",
+        projection: bool = False
         ):
-    
-    query = db.query(models.Book).options(
-        joinedload(models.Book.author),
-        joinedload(models.Book.genre)
-    )
+    """
+    Returns (books, total_items, total_exact, next_cursor).
+
+    paging="offset" keeps the classic skip/limit behaviour. paging="cursor" pages on
+    (title, id) when sorted or on id otherwise, so every page costs the same index range
+    scan; `skip` is ignored and `next_cursor` is None on the last page.
+    total="none" skips the COUNT query and returns total_items=None. total="estimate" may
+    answer from counters or the planner instead of counting, see count_books.
+    projection=True selects only the columns schemas.Book exposes and returns the books as
+    plain dicts (app.serializers) instead of ORM objects.
+    """
+    query = db.query(models.Book)
 
     if genre_id is not None:
         query = query.filter(models.Book.genre_id == genre_id)
@@ -36,77 +119,387 @@ def get_books(
         query = query.filter(models.Book.author_id == author_id)
     
     if search:
-        search_pattern = f"%{search}%"
-        query = query.filter(
-            or_(
-                models.Book.title.ilike(search_pattern),
-                models.Book.author.has(models.Author.name.ilike(search_pattern))
-            )
+        # relevance order only when the caller did not ask for a sort and pages by offset;
+        # cursor mode needs a stable (title, id) / id key
+        ranked = sort is None and paging == "offset"
+        query = search_backends.get_backend(db).apply(db, query, search, ranked=ranked)
+
+    total_items, total_exact = count_books(db, query, genre_id, author_id, search, total)
+    if projection:
+        query = serializers.join_book_refs(query).with_entities(*serializers.BOOK_COLUMNS)
+    else:
+        query = query.options(
+            joinedload(models.Book.author),
+            joinedload(models.Book.genre)
         )
 
+    if paging == "cursor":
+        if sort == "desc":
+            key_cols = (models.Book.title, models.Book.id)
+            query = query.order_by(models.Book.title.desc(), models.Book.id.desc())
+        elif sort == "asc":
+            key_cols = (models.Book.title, models.Book.id)
+            query = query.order_by(models.Book.title.asc(), models.Book.id.asc())
+        else:
+            sort = None
+            key_cols = (models.Book.id,)
+            query = query.order_by(models.Book.id.asc())
+
+        if cursor:
+            key = decode_cursor(cursor, sort)
+            after = tuple_(*key_cols) < tuple_(*key) if sort == "desc" else tuple_(*key_cols) > tuple_(*key)
+            query = query.filter(after)
+
+        books = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(books) > limit:
+            books = books[:limit]
+            next_cursor = encode_cursor(sort, books[-1])
+        if projection:
+            books = [serializers.book_row(row) for row in books]
+        return books, total_items, total_exact, next_cursor
+
     if sort is not None:
         if sort == "asc":
             query = query.order_by(models.Book.title.asc())
         elif sort == "desc":
             query = query.order_by(models.Book.title.desc())   
 
-    total_items = query.count()
     books = query.offset(skip).limit(limit).all()
+    if projection:
+        books = [serializers.book_row(row) for row in books]
+
+    return books, total_items, total_exact, None
+
+def normalize_search(search: str | None) -> str | None:
+    # both search backends are case-insensitive and tokenize on whitespace
+    if search is None:
+        return None
+    return " ".join(search.lower().split()) or None
+
+def count_books(db: Session, query, genre_id: int | None, author_id: int | None, search: str | None, total: str):
+    """
+    (total_items, exact) for the filtered catalog `query`.
+
+    Exact counts are kept in catalog_counts per filter signature, so paging through one filter
+    counts once. total="estimate" avoids the COUNT for uncached filters: the unfiltered and
+    genre-only counts come from one grouped scan that fills the cache for every genre, other
+    filters use the planner's row estimate (exact=False).
+    """
+    if total == "none":
+        return None, None
+
+    key = (genre_id, author_id, normalize_search(search))
+    count = catalog_counts.get(key)
+    if count is not None:
+        return count, True
+
+    if total == "estimate":
+        if author_id is None and key[2] is None:
+            return load_genre_counts(db).get(genre_id, 0), True
+        return estimate_rows(db, query), False
+
+    count = query.order_by(None).count()
+    catalog_counts.set(key, count)
+    return count, True
+
+def load_genre_counts(db: Session) -> dict[int | None, int]:
+    """Book count per genre_id plus the total under None, also stored in catalog_counts"""
+    rows = db.execute(
+        select(models.Book.genre_id, func.grouping(models.Book.genre_id), func.count())
+        .group_by(func.grouping_sets(models.Book.genre_id, tuple_()))
+    ).all()
+    counts = {}
+    for genre_id, is_total, count in rows:
+        if is_total:
+            counts[None] = count
+        elif genre_id is not None:
+            counts[genre_id] = count
+    counts.setdefault(None, 0)
+    for genre_id, count in counts.items():
+        catalog_counts.set((genre_id, None, None), count)
+    return counts
+
+def get_facets(db: Session, genre_id: int | None, author_id: int | None, search: str | None, top: int) -> dict:
+    """
+    The `top` genres and authors by matching books, {"genres": [{id, name, count}], "authors": [...]}.
+
+    Each facet is counted under the other filters but not its own, so with a genre selected
+    the genre facet still tells how many books picking another genre would give. One
+    statement: grouping sets over genre_id and author_id, the other facet's filter as an
+    aggregate FILTER, a window for the top N per set and the names of those rows only.
+    Cached per filter like catalog_counts; stock changes do not touch it.
+    """
+    key = (genre_id, author_id, normalize_search(search), top)
+    facets = catalog_facets.get(key)
+    if facets is not None:
+        return facets
+
+    query = db.query(models.Book)
+    if search:
+        query = search_backends.get_backend(db).apply(db, query, search, ranked=False)
+    per_genre = func.count()
+    if author_id is not None:
+        per_genre = per_genre.filter(models.Book.author_id == author_id)
+    per_author = func.count()
+    if genre_id is not None:
+        per_author = per_author.filter(models.Book.genre_id == genre_id)
+
+    # 0 on the genre rows, 1 on the author rows
+    is_author = func.grouping(models.Book.genre_id)
+    grouped = query.with_entities(
+        is_author.label("is_author"),
+        case((is_author == 0, models.Book.genre_id), else_=models.Book.author_id).label("ref_id"),
+        case((is_author == 0, per_genre), else_=per_author).label("books")
+    ).group_by(func.grouping_sets(models.Book.genre_id, models.Book.author_id)).subquery()
+
+    rank = func.row_number().over(
+        partition_by=grouped.c.is_author, order_by=(grouped.c.books.desc(), grouped.c.ref_id)
+    )
+    ranked = (
+        select(grouped, rank.label("rank"))
+        # books without a genre are no option to filter by
+        .where(grouped.c.ref_id.isnot(None), grouped.c.books > 0)
+        .subquery()
+    )
+    # looked up per returned row; a join would hash the whole authors table for a few names
+    name = case(
+        (ranked.c.is_author == 0, select(models.Genre.name).where(models.Genre.id == ranked.c.ref_id).scalar_subquery()),
+        else_=select(models.Author.name).where(models.Author.id == ranked.c.ref_id).scalar_subquery()
+    )
+    rows = db.execute(
+        select(ranked.c.is_author, ranked.c.ref_id, name, ranked.c.books)
+        .where(ranked.c.rank <= top)
+        .order_by(ranked.c.is_author, ranked.c.rank)
+    ).all()
+
+    facets = {"genres": [], "authors": []}
+    for row_is_author, ref_id, name, books in rows:
+        facets["authors" if row_is_author else "genres"].append({"id": ref_id, "name": name, "count": books})
+    catalog_facets.set(key, facets)
+    return facets
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) <statement>, executed with the statement's own parameters"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+def estimate_rows(db: Session, query) -> int:
+    """The planner's row estimate for `query`, no rows are read"""
+    plan = db.execute(Explain(query.order_by(None).with_entities(models.Book.id).statement)).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def catalog_page_key(
+        skip: int, limit: int,
+        genre_id: int | None, author_id: int | None,
+        search: str | None, sort: str | None,
+        total: str = "exact", facets: int = 0
+        ) -> tuple:
+    """Cache key of an offset-paged catalog request; spellings that return the same page share a key"""
+    search = normalize_search(search)
+    if sort not in ("asc", "desc"):
+        sort = None
+    return (skip, limit, genre_id, author_id, search, sort, total, facets)
 
-    return books, total_items
+def build_book_page(db: Session, key: tuple) -> CachedBody:
+    """Runs the catalog query for a catalog_page_key and stores the serialized BookPage"""
+    version = catalog_pages.version
+    skip, limit, genre_id, author_id, search, sort, total, facets = key
+    books, total_items, total_exact, _ = get_books(
+        db, skip=skip, limit=limit, genre_id=genre_id, author_id=author_id,
+        search=search, sort=sort, total=total, projection=serializers.PROJECTION
+    )
+    page = {
+        "items": books, "total_items": total_items, "total_exact": total_exact, "skip": skip, "limit": limit,
+        "next_cursor": None, "facets": get_facets(db, genre_id, author_id, search, facets) if facets else None
+    }
+    if serializers.PROJECTION:
+        # same keys and order as schemas.BookPage
+        body = serializers.to_json(page)
+    else:
+        body = BOOK_PAGE.dump_json(BOOK_PAGE.validate_python(page, from_attributes=True))
+    # right after a reservation or return the replica may not have replayed it yet; a page read
+    # there is served but not cached, or it would keep the stale counts under the new version
+    lagging = reads_from_replica(db) and catalog_pages.seconds_since_invalidation() < READ_AFTER_WRITE_SECONDS
+    return catalog_pages.put(key, body, version, store=not lagging)
+
+def warm_catalog_pages(db: Session, limit: int) -> int:
+    """Loads the first page of the unfiltered catalog in every sort order and of every genre"""
+    keys = [catalog_page_key(0, limit, None, None, None, sort) for sort in (None, "asc", "desc")]
+    keys += [
+        catalog_page_key(0, limit, genre_id, None, None, None)
+        for genre_id in db.execute(select(models.Genre.id).order_by(models.Genre.id)).scalars()
+    ]
+    for key in keys:
+        build_book_page(db, key)
+    return len(keys)
+
+def get_catalog_version(db: Session) -> int:
+    last_value, is_called = db.execute(text("SELECT last_value, is_called FROM catalog_version")).one()
+    return last_value if is_called else 0
+
+_seen_catalog_version: int | None = None
+
+def sync_catalog_version(db: Session) -> int:
+    """
+    Drops cached catalog pages and reference lists if catalog_version moved since the last call,
+    rebuilds the in-memory search index and adds the newly imported books and authors to the
+    suggestion index
+    """
+    global _seen_catalog_version
+    version = get_catalog_version(db)
+    changed = _seen_catalog_version is not None and version != _seen_catalog_version
+    _seen_catalog_version = version
+    if changed:
+        catalog_pages.invalidate()
+        catalog_counts.clear()
+        catalog_facets.clear()
+        invalidate_reference_data()
+        search_backends.build_memory_index(db)
+        suggestions.catch_up(db)
+    return int(changed)
 
 def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return db.query(models.User).options(
+        joinedload(models.User.role)
+    ).filter(models.User.id == user_id).first()
 
-def get_user_reservations(db: Session, user_id: int, skip: int = 0, limit: int = 5):
-    stmt = select(models.Reservation).where(
-        models.Reservation.return_date < date.today(),
-        models.Reservation.status == 'active'
+def get_token_version(db: Session, user_id: int) -> int | None:
+    """Current token_version of a user (None if the user is gone), served from a TTL cache"""
+    version = token_versions.get(user_id)
+    if version is None:
+        version = db.execute(
+            select(models.User.token_version).where(models.User.id == user_id)
+        ).scalar()
+        if version is not None:
+            token_versions.set(user_id, version)
+    return version
+
+def revoke_user_tokens(db: Session, user_id: int):
+    """
+    Invalidates all access tokens issued to the user (POST /api/logout). Other API workers
+    keep accepting them until their cached version expires, USER_CACHE_TTL at most.
+    """
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(token_version=models.User.token_version + 1)
     )
+    db.commit()
+    token_versions.pop(user_id)
 
-    overdue_reservations = db.execute(stmt).scalars().all()
+def user_claims(user: models.User) -> dict:
+    """JWT claims that let get_current_user build schemas.User without a query"""
+    return {
+        "sub": user.id,
+        "name": user.name,
+        "email": user.email,
+        "role": user.role.name,
+        "ver": user.token_version,
+    }
 
-    for res in overdue_reservations:
-        res.status = 'overdue'
+def effective_status():
+    """
+    Reservation status as of today: an active loan past its return_date reads as overdue
+    even if the sweeper has not flagged it yet
+    """
+    return case(
+        (
+            and_(
+                models.Reservation.status == models.ReservationStatus.active,
+                models.Reservation.return_date < date.today()
+            ),
+            models.ReservationStatus.overdue.value
+        ),
+        else_=models.Reservation.status
+    )
 
-    db.commit()    
+def _with_effective_status(rows) -> list[models.Reservation]:
+    """Copies the derived status onto the loaded objects without marking them dirty"""
+    reservations = []
+    for reservation, current_status in rows:
+        set_committed_value(reservation, "status", models.ReservationStatus(current_status))
+        reservations.append(reservation)
+    return reservations
 
-    return db.query(models.Reservation).options(
+def _reservation_query(db: Session, current_status, projection: bool):
+    """Reservations with their book; ORM objects or, with projection, serializers.reservation_row columns"""
+    if projection:
+        query = db.query(
+            *serializers.RESERVATION_COLUMNS, current_status, *serializers.BOOK_COLUMNS
+        ).select_from(models.Reservation).join(models.Book, models.Reservation.book_id == models.Book.id)
+        return serializers.join_book_refs(query)
+    return db.query(models.Reservation, current_status).options(
         joinedload(models.Reservation.book).joinedload(models.Book.author),
         joinedload(models.Reservation.book).joinedload(models.Book.genre)
-        ).filter(
+    )
+
+def _reservation_results(rows, projection: bool) -> list:
+    if projection:
+        return [serializers.reservation_row(row) for row in rows]
+    return _with_effective_status(rows)
+
+def get_user_reservations(db: Session, user_id: int, skip: int = 0, limit: int = 5, projection: bool = False):
+    rows = _reservation_query(db, effective_status(), projection).filter(
             models.Reservation.user_id == user_id,
             models.Reservation.status.in_(['active', 'overdue'])
         ).order_by(models.Reservation.return_date.asc()).offset(skip).limit(limit).all()
 
+    return _reservation_results(rows, projection)
+
+def mark_overdue_reservations(db: Session) -> int:
+    """Flags every active reservation past its return_date as overdue in one UPDATE, returns the row count"""
+    result = db.execute(
+        update(models.Reservation)
+        .where(
+            models.Reservation.status == models.ReservationStatus.active,
+            models.Reservation.return_date < date.today()
+        )
+        .values(status=models.ReservationStatus.overdue)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
 def get_genres(db: Session):
     return db.query(models.Genre).all()
 
 def get_authors(db: Session):
     return db.query(models.Author).all()
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+genres_cache = VersionedCache(
+    lambda db: GENRE_LIST.dump_json(GENRE_LIST.validate_python(get_genres(db), from_attributes=True)),
+    REFERENCE_CACHE_TTL
+)
+authors_cache = VersionedCache(
+    lambda db: AUTHOR_LIST.dump_json(AUTHOR_LIST.validate_python(get_authors(db), from_attributes=True)),
+    REFERENCE_CACHE_TTL
+)
 
-def authenticate_user(db: Session, login: str, password: str):
-    user = get_user_by_email(db, login)
+def invalidate_reference_data():
+    """Call after genres or authors change so the next request reloads them"""
+    genres_cache.invalidate()
+    authors_cache.invalidate()
 
-    if not user:
-        print(f"User not found: {login}")
-        return False
-    if not password_hash.verify(password, user.password_hash):
-        print(f"Password mismatch for: {login}")
-        return False
-    return user
+def get_user_by_email(db: Session, email: str):
+    return db.query(models.User).options(
+        joinedload(models.User.role)
+    ).filter(models.User.email == email).first()
 
-def create_user(db: Session, user_data):
+def create_user(db: Session, user_data, hashed_password: str):
+    """Inserts a user with an already computed hash (see app.hashing / acrud.create_user)"""
     print(f"Creating user: {user_data.name}, {user_data.email}")
     role = db.query(models.Role).filter(models.Role.name == 'user').first()
     if not role:
         role = models.Role(name='user')
         db.add(role)
         db.flush()
-    hashed_password = password_hash.hash(user_data.password)
     db_user = models.User(
         name=user_data.name,
         email=user_data.email,
@@ -114,9 +507,10 @@ def create_user(db: Session, user_data):
         role_id=role.id
     )
     db.add(db_user)
+    db.flush()
+    user_id = db_user.id
     db.commit()
-    db.refresh(db_user)
-    return db_user
+    return get_user(db, user_id)
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -133,133 +527,440 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
+def get_reservation(db: Session, reservation_id: int):
+    """Reservation with its book, author and genre loaded, ready to serialize"""
+    return db.query(models.Reservation).options(
+        joinedload(models.Reservation.book).joinedload(models.Book.author),
+        joinedload(models.Reservation.book).joinedload(models.Book.genre)
+    ).filter(models.Reservation.id == reservation_id).populate_existing().first()
+
 def create_reservation(db: Session, reservation_data):
-    stmt_available = select(
-        exists().where(
+    """
+    Takes one copy of the book and inserts the reservation in a single statement.
+
+    The UPDATE only matches while copies are left and the user has never reserved this book,
+    so concurrent callers cannot oversell: Postgres re-checks `count > 0` on the locked row.
+    Two concurrent requests of the same user both pass the NOT EXISTS check, the second one
+    then hits uq_reservations_open_user_book and rolls back, decrement included.
+    """
+    claimed = (
+        update(models.Book)
+        .where(
             models.Book.id == reservation_data.book_id,
-            models.Book.count > 0
+            models.Book.count > 0,
+            ~exists().where(
+                models.Reservation.book_id == reservation_data.book_id,
+                models.Reservation.user_id == reservation_data.user_id
+            )
         )
-    ) 
-    
-    available = db.execute(stmt_available).scalar()
-    if not available:
-        return False
-    
-    stmt_same_reservation = select(
-        exists().where(
-            models.Reservation.book_id == reservation_data.book_id,
-            models.Reservation.user_id == reservation_data.user_id
+        .values(count=models.Book.count - 1)
+        .returning(models.Book.id)
+        .cte("claimed")
+    )
+    stmt = (
+        insert(models.Reservation)
+        .from_select(
+            ["book_id", "user_id", "return_date", "status"],
+            select(
+                claimed.c.id,
+                literal(reservation_data.user_id),
+                literal(reservation_data.return_date, Date),
+                literal(models.ReservationStatus.active, models.Reservation.status.type)
+            )
         )
+        .returning(models.Reservation.id)
     )
 
-    same = db.execute(stmt_same_reservation).scalar()
-    if same:
+    try:
+        reservation_id = db.execute(stmt).scalar()
+        if reservation_id is None:
+            db.rollback()
+            return False
+        _bump_user_stats(db, {reservation_data.user_id: {"on_hand": 1}})
+        db.commit()
+    except IntegrityError:
+        db.rollback()
         return False
-
-    new_reservation = models.Reservation(
-        book_id=reservation_data.book_id,
-        user_id=reservation_data.user_id,
-        return_date=reservation_data.return_date
-    )
-    db.add(new_reservation)
-    book = db.query(models.Book).filter(models.Book.id == reservation_data.book_id).first()
-    if book:
-        book.count -= 1
-    db.commit()
-    db.refresh(new_reservation)
-    return new_reservation
+    catalog_pages.invalidate()
+    reservation = get_reservation(db, reservation_id)
+    _publish_availability([reservation], -1)
+    return reservation
 
 
 def return_reservation(db: Session, reservation_id: int):
-    reservation = db.query(models.Reservation).filter(
-        models.Reservation.id == reservation_id,
-        models.Reservation.status != "returned"
-    ).first()
-    
-    if not reservation:
+    """Marks the reservation returned and puts the copy back in a single statement, None if it was already returned"""
+    returned = (
+        update(models.Reservation)
+        .where(
+            models.Reservation.id == reservation_id,
+            models.Reservation.status != models.ReservationStatus.returned
+        )
+        .values(status=models.ReservationStatus.returned)
+        .returning(models.Reservation.book_id, models.Reservation.user_id)
+        .cte("returned")
+    )
+    stmt = (
+        update(models.Book)
+        .where(models.Book.id == returned.c.book_id)
+        .values(count=models.Book.count + 1)
+        .returning(returned.c.user_id, models.Book.genre_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    row = db.execute(stmt).first()
+    if row is None:
+        db.rollback()
         return None
-    
-    reservation.status = "returned"
-    
-    book = db.query(models.Book).filter(models.Book.id == reservation.book_id).first()
-    if book:
-        book.count += 1
-    
+
+    _bump_user_stats(db, {row.user_id: {"on_hand": -1, "total_read": 1}})
+    if row.genre_id is not None:
+        _bump_stat_buckets(db, Counter({
+            (row.user_id, date.today(), models.StatKind.read_genre, row.genre_id): 1
+        }))
     db.commit()
-    db.refresh(reservation)
+    catalog_pages.invalidate()
+    reservation = get_reservation(db, reservation_id)
+    _publish_availability([reservation], +1)
     return reservation
 
-def get_user_history(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    status_order = case(
-    (models.Reservation.status == "overdue", 1),
-    (models.Reservation.status == "active", 2),
-    (models.Reservation.status == "returned", 3),
-    else_=4  
-    )
+def _publish_availability(reservations, delta: int):
+    """The counts of the reservations' books, read after the commit, to the availability streams"""
+    availability.publish({reservation.book_id: (reservation.book.count, delta) for reservation in reservations})
 
-    return db.query(models.Reservation).options(
+
+def get_book_counts(db: Session, book_ids: list[int]) -> dict[int, int]:
+    """Current stock of the books; ends the transaction, a stream holds the session open"""
+    counts = dict(db.execute(select(models.Book.id, models.Book.count).where(models.Book.id.in_(book_ids))).all())
+    db.rollback()
+    return counts
+
+
+def get_reservations(db: Session, reservation_ids: list[int]) -> dict[int, models.Reservation]:
+    """get_reservation for several ids in one query, keyed by id"""
+    if not reservation_ids:
+        return {}
+    rows = db.query(models.Reservation).options(
         joinedload(models.Reservation.book).joinedload(models.Book.author),
         joinedload(models.Reservation.book).joinedload(models.Book.genre)
-    ).filter(
-        models.Reservation.user_id == user_id
-    ).order_by(status_order, models.Reservation.reserve_date.desc()).offset(skip).limit(limit).all()
+    ).filter(models.Reservation.id.in_(reservation_ids)).populate_existing().all()
+    return {reservation.id: reservation for reservation in rows}
 
-def get_user_stats(db, user_id: int, period_days: int = 30):
-    cutoff = date.today() - timedelta(days=period_days)
 
-    stmt_top_genre = (
-        select(models.Genre.name)
-        .select_from(models.SearchEvents)
-        .join(models.Genre, models.SearchEvents.genre_id == models.Genre.id)
+def _batch_results(
+        key: str, requested: list[int], done: dict[int, int], errors: dict[int, str], delta: int, db: Session
+) -> list[dict]:
+    """Per requested id, in request order: the reservation or the reason it failed"""
+    loaded = get_reservations(db, list(done.values()))
+    _publish_availability(loaded.values(), delta)
+    return [
+        {key: item_id, "ok": True, "reservation": loaded[done[item_id]]} if item_id in done
+        else {key: item_id, "ok": False, "error": errors.get(item_id, "Failed")}
+        for item_id in requested
+    ]
+
+
+# a batch that still deadlocks (e.g. with the overdue sweeper's set-based UPDATE) is rerun
+BATCH_DEADLOCK_RETRIES = 3
+
+
+def _is_deadlock(error: OperationalError) -> bool:
+    return getattr(error.orig, "sqlstate", None) == "40P01"
+
+
+def _retry_deadlocks(batch):
+    """Reruns the batch function when Postgres aborts its transaction as a deadlock victim"""
+    @functools.wraps(batch)
+    def run(db: Session, *args):
+        for attempt in range(BATCH_DEADLOCK_RETRIES):
+            try:
+                return batch(db, *args)
+            except OperationalError as e:
+                db.rollback()
+                if not _is_deadlock(e) or attempt == BATCH_DEADLOCK_RETRIES - 1:
+                    raise
+    return run
+
+
+def _lock_books(db: Session, book_ids) -> None:
+    """
+    Row locks on the books in id order. A batch UPDATE locks rows in the order of its plan,
+    index order for one plan and physical order for a bitmap scan, so two overlapping batches
+    could take them in opposite orders; taken up front in id order, they queue instead.
+    """
+    db.execute(
+        select(models.Book.id).where(models.Book.id.in_(book_ids)).order_by(models.Book.id).with_for_update()
+    ).all()
+
+
+@_retry_deadlocks
+def create_reservations(db: Session, user_id: int, book_ids: list[int], return_date: date) -> list[dict]:
+    """
+    create_reservation for several books in one transaction: a single UPDATE claims a copy of
+    every requested book that has one left and that the user never reserved, and the INSERT
+    fed by it adds their reservations. Books that could not be claimed are reported per item
+    ("Book not found", "No copies left", "Already reserved"); the others are reserved.
+    """
+    requested = list(dict.fromkeys(book_ids))
+    _lock_books(db, requested)
+    claimed = (
+        update(models.Book)
         .where(
-            models.SearchEvents.user_id == user_id,
-            models.SearchEvents.created_at >= cutoff,
-            models.SearchEvents.genre_id.isnot(None),
+            models.Book.id.in_(requested),
+            models.Book.count > 0,
+            ~exists().where(
+                models.Reservation.book_id == models.Book.id,
+                models.Reservation.user_id == user_id
+            )
         )
-        .group_by(models.Genre.name)
-        .order_by(func.count().desc())
-        .limit(1)
+        .values(count=models.Book.count - 1)
+        .returning(models.Book.id)
+        .cte("claimed")
     )
-    top_genre = db.execute(stmt_top_genre).scalar()
-
-    stmt_top_author = (
-        select(models.Author.name)
-        .select_from(models.SearchEvents)
-        .join(models.Author, models.SearchEvents.author_id == models.Author.id)
-        .where(
-            models.SearchEvents.user_id == user_id,
-            models.SearchEvents.created_at >= cutoff,
-            models.SearchEvents.author_id.isnot(None),
+    stmt = (
+        insert(models.Reservation)
+        .from_select(
+            ["book_id", "user_id", "return_date", "status"],
+            select(
+                claimed.c.id,
+                literal(user_id),
+                literal(return_date, Date),
+                literal(models.ReservationStatus.active, models.Reservation.status.type)
+            )
         )
-        .group_by(models.Author.name)
-        .order_by(func.count().desc())
-        .limit(1)
+        .returning(models.Reservation.book_id, models.Reservation.id)
     )
-    top_author = db.execute(stmt_top_author).scalar()
 
-    total_queries = db.execute(
-        select(func.count()).select_from(models.SearchEvents).where(models.SearchEvents.user_id == user_id)
-    ).scalar() or 0
+    try:
+        done = dict(db.execute(stmt).all())
+    except IntegrityError:
+        # a concurrent reservation of the same user and book (see create_reservation) or a
+        # return_date before today; the batch is rolled back as a whole
+        db.rollback()
+        return [{"book_id": book_id, "ok": False, "error": "Cannot create reservation"} for book_id in requested]
 
-    total_read = db.execute(
-        select(func.count())
-        .select_from(models.Reservation)
+    errors = {}
+    missed = [book_id for book_id in requested if book_id not in done]
+    if missed:
+        reserved = exists().where(
+            models.Reservation.book_id == models.Book.id,
+            models.Reservation.user_id == user_id
+        )
+        for book_id, already in db.execute(select(models.Book.id, reserved).where(models.Book.id.in_(missed))):
+            errors[book_id] = "Already reserved" if already else "No copies left"
+        for book_id in missed:
+            errors.setdefault(book_id, "Book not found")
+
+    if done:
+        _bump_user_stats(db, {user_id: {"on_hand": len(done)}})
+        db.commit()
+        catalog_pages.invalidate()
+    else:
+        db.rollback()
+    return _batch_results("book_id", requested, done, errors, -1, db)
+
+
+@_retry_deadlocks
+def return_reservations(db: Session, user_id: int, reservation_ids: list[int]) -> list[dict]:
+    """
+    return_reservation for several of the user's reservations in one transaction: one UPDATE
+    marks them returned and puts their copies back. A user has at most one open reservation
+    per book, so no book is incremented twice by the same batch. The others are reported per
+    item ("Reservation not found", "Cannot return another user's reservation", "Already returned").
+
+    The reservations and then their books are locked in id order first, like in create_reservations.
+    """
+    requested = list(dict.fromkeys(reservation_ids))
+    book_ids = db.execute(
+        select(models.Reservation.book_id)
         .where(
+            models.Reservation.id.in_(requested),
             models.Reservation.user_id == user_id,
-            models.Reservation.status == models.ReservationStatus.returned,
+            models.Reservation.status != models.ReservationStatus.returned
         )
-    ).scalar() or 0
-
-    on_hand = db.execute(
-        select(func.count())
-        .select_from(models.Reservation)
+        .order_by(models.Reservation.id)
+        .with_for_update()
+    ).scalars().all()
+    _lock_books(db, book_ids)
+    returned = (
+        update(models.Reservation)
         .where(
+            models.Reservation.id.in_(requested),
             models.Reservation.user_id == user_id,
-            models.Reservation.status.in_(['active', 'overdue']),
+            models.Reservation.status != models.ReservationStatus.returned
         )
-    ).scalar() or 0
+        .values(status=models.ReservationStatus.returned)
+        .returning(models.Reservation.id, models.Reservation.book_id)
+        .cte("returned")
+    )
+    stmt = (
+        update(models.Book)
+        .where(models.Book.id == returned.c.book_id)
+        .values(count=models.Book.count + 1)
+        .returning(returned.c.id, models.Book.genre_id)
+        .execution_options(synchronize_session=False)
+    )
+    rows = db.execute(stmt).all()
+    done = {row.id: row.id for row in rows}
+
+    errors = {}
+    missed = [reservation_id for reservation_id in requested if reservation_id not in done]
+    if missed:
+        for reservation_id, owner_id in db.execute(
+            select(models.Reservation.id, models.Reservation.user_id).where(models.Reservation.id.in_(missed))
+        ):
+            errors[reservation_id] = (
+                "Already returned" if owner_id == user_id else "Cannot return another user's reservation"
+            )
+        for reservation_id in missed:
+            errors.setdefault(reservation_id, "Reservation not found")
+
+    if done:
+        _bump_user_stats(db, {user_id: {"on_hand": -len(done), "total_read": len(done)}})
+        today = date.today()
+        _bump_stat_buckets(db, Counter(
+            (user_id, today, models.StatKind.read_genre, row.genre_id) for row in rows if row.genre_id is not None
+        ))
+        db.commit()
+        catalog_pages.invalidate()
+    else:
+        db.rollback()
+    return _batch_results("reservation_id", requested, done, errors, +1, db)
 
-    stmt_fav_genre = (
+def get_user_history(db: Session, user_id: int, skip: int = 0, limit: int = 100, projection: bool = False):
+    current_status = effective_status()
+    status_order = case(
+    (current_status == "overdue", 1),
+    (current_status == "active", 2),
+    (current_status == "returned", 3),
+    else_=4  
+    )
+
+    rows = _reservation_query(db, current_status, projection).filter(
+        models.Reservation.user_id == user_id
+    ).order_by(status_order, models.Reservation.reserve_date.desc()).offset(skip).limit(limit).all()
+
+    return _reservation_results(rows, projection)
+
+def _existing_ids(db: Session, model, ids: set[int]) -> set[int]:
+    if not ids:
+        return set()
+    return set(db.execute(select(model.id).where(model.id.in_(ids))).scalars())
+
+def record_search_events(db: Session, events: list[dict]) -> int:
+    """
+    Bulk insert of buffered search events (see app.events), returns how many were written.
+    read_books takes genre_id/author_id unchecked, so events pointing at a missing genre,
+    author or user are skipped here; otherwise their foreign key violation would fail the
+    whole batch, everyone else's events included.
+    """
+    genre_ids = _existing_ids(db, models.Genre, {e["genre_id"] for e in events if e["genre_id"] is not None})
+    author_ids = _existing_ids(db, models.Author, {e["author_id"] for e in events if e["author_id"] is not None})
+    user_ids = _existing_ids(db, models.User, {e["user_id"] for e in events})
+    events = [
+        event for event in events
+        if event["user_id"] in user_ids
+        and (event["genre_id"] is None or event["genre_id"] in genre_ids)
+        and (event["author_id"] is None or event["author_id"] in author_ids)
+    ]
+    if not events:
+        return 0
+    db.execute(insert(models.SearchEvents), events)
+
+    per_user: dict[int, dict[str, int]] = {}
+    buckets = Counter()
+    for event in events:
+        totals = per_user.setdefault(event["user_id"], {"total_queries": 0})
+        totals["total_queries"] += 1
+        if event["genre_id"] is not None:
+            buckets[(event["user_id"], event["created_at"], models.StatKind.search_genre, event["genre_id"])] += 1
+        if event["author_id"] is not None:
+            buckets[(event["user_id"], event["created_at"], models.StatKind.search_author, event["author_id"])] += 1
+
+    _bump_user_stats(db, per_user)
+    _bump_stat_buckets(db, buckets)
+    db.commit()
+    return len(events)
+
+def _bump_user_stats(db: Session, deltas: dict[int, dict[str, int]]):
+    """Adds per-user deltas to user_stats, creating missing rows"""
+    if not deltas:
+        return
+    columns = ("total_queries", "total_read", "on_hand")
+    # stable key order so concurrent writers lock rows in the same sequence
+    rows = [
+        {"user_id": user_id, **{col: delta.get(col, 0) for col in columns}}
+        for user_id, delta in sorted(deltas.items())
+    ]
+    stmt = pg_insert(models.UserStats).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.UserStats.user_id],
+        set_={col: getattr(models.UserStats, col) + stmt.excluded[col] for col in columns}
+    )
+    db.execute(stmt)
+
+def _bump_stat_buckets(db: Session, buckets: Counter):
+    """Adds counts to user_stat_buckets keyed by (user_id, day, kind, ref_id)"""
+    if not buckets:
+        return
+    rows = [
+        {"user_id": user_id, "day": day, "kind": kind, "ref_id": ref_id, "count": count}
+        for (user_id, day, kind, ref_id), count in sorted(
+            buckets.items(), key=lambda item: (item[0][0], item[0][1], item[0][2].value, item[0][3])
+        )
+    ]
+    stmt = pg_insert(models.UserStatBucket).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            models.UserStatBucket.user_id, models.UserStatBucket.day,
+            models.UserStatBucket.kind, models.UserStatBucket.ref_id
+        ],
+        set_={"count": models.UserStatBucket.count + stmt.excluded["count"]}
+    )
+    db.execute(stmt)
+
+def get_user_stats(db, user_id: int, period_days: int = 30):
+    if USER_STATS_SOURCE == "live":
+        return get_user_stats_live(db, user_id, period_days)
+    return get_user_stats_rollup(db, user_id, period_days)
+
+def get_user_stats_live(db, user_id: int, period_days: int = 30):
+    """Dashboard statistics straight from search_events/reservations in one round trip"""
+    cutoff = date.today() - timedelta(days=period_days)
+
+    # referenced twice, so Postgres materializes it; the created_at bound prunes search_events
+    # to the partitions of the window
+    events = (
+        select(models.SearchEvents.genre_id, models.SearchEvents.author_id)
+        .where(models.SearchEvents.user_id == user_id, models.SearchEvents.created_at >= cutoff)
+        .cte("events")
+    )
+    # raw events still partitioned plus the days compacted out of retired partitions
+    total_queries = (
+        select(func.count()).where(models.SearchEvents.user_id == user_id).scalar_subquery()
+        + select(func.coalesce(func.sum(models.SearchEventDay.queries), 0))
+        .where(models.SearchEventDay.user_id == user_id).scalar_subquery()
+    )
+    loans = (
+        select(
+            func.count().filter(models.Reservation.status == models.ReservationStatus.returned).label("total_read"),
+            func.count().filter(models.Reservation.status.in_(['active', 'overdue'])).label("on_hand"),
+        )
+        .where(models.Reservation.user_id == user_id)
+        .cte("loans")
+    )
+
+    def top_searched(name_col, ref_col):
+        return (
+            select(name_col)
+            .select_from(events)
+            .join(name_col.class_, name_col.class_.id == ref_col)
+            .group_by(name_col)
+            .order_by(func.count().desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    fav_genre = (
         select(models.Genre.name)
         .select_from(models.Reservation)
         .join(models.Book, models.Reservation.book_id == models.Book.id)
@@ -271,14 +972,67 @@ def get_user_stats(db, user_id: int, period_days: int = 30):
         .group_by(models.Genre.name)
         .order_by(func.count().desc())
         .limit(1)
+        .scalar_subquery()
     )
-    fav_genre = db.execute(stmt_fav_genre).scalar()
+
+    row = db.execute(
+        select(
+            top_searched(models.Author.name, events.c.author_id).label("top_author"),
+            top_searched(models.Genre.name, events.c.genre_id).label("top_genre"),
+            total_queries.label("total_queries"),
+            loans.c.total_read,
+            loans.c.on_hand,
+            fav_genre.label("fav_genre"),
+        ).select_from(loans)
+    ).one()
+
+    return {
+        "top_author": row.top_author or "N/A",
+        "top_genre": row.top_genre or "N/A",
+        "total_queries": int(row.total_queries or 0),
+        "total_read": int(row.total_read or 0),
+        "on_hand": int(row.on_hand or 0),
+        "fav_genre": row.fav_genre or "N/A",
+    }
+
+def get_user_stats_rollup(db, user_id: int, period_days: int = 30):
+    """Dashboard statistics from the user_stats / user_stat_buckets rollups in one statement"""
+    cutoff = date.today() - timedelta(days=period_days)
+    bucket = models.UserStatBucket
+
+    def top_name(name_col, kind, since=None):
+        stmt = (
+            select(name_col)
+            .select_from(bucket)
+            .join(name_col.class_, name_col.class_.id == bucket.ref_id)
+            .where(bucket.user_id == user_id, bucket.kind == kind)
+            .group_by(name_col)
+            .order_by(func.sum(bucket.count).desc())
+            .limit(1)
+        )
+        if since is not None:
+            stmt = stmt.where(bucket.day >= since)
+        return stmt.scalar_subquery()
+
+    def total(col):
+        return select(col).where(models.UserStats.user_id == user_id).scalar_subquery()
+
+    row = db.execute(
+        select(
+            top_name(models.Author.name, models.StatKind.search_author, cutoff).label("top_author"),
+            top_name(models.Genre.name, models.StatKind.search_genre, cutoff).label("top_genre"),
+            total(models.UserStats.total_queries).label("total_queries"),
+            total(models.UserStats.total_read).label("total_read"),
+            total(models.UserStats.on_hand).label("on_hand"),
+            top_name(models.Genre.name, models.StatKind.read_genre).label("fav_genre"),
+        )
+    ).one()
 
     return {
-        "top_author": top_author or "N/A",
-        "top_genre": top_genre or "N/A",
-        "total_queries": int(total_queries),
-        "total_read": int(total_read),
-        "on_hand": int(on_hand),
-        "fav_genre": fav_genre or "N/A",
-    }
\ No newline at end of file
+        "top_author": row.top_author or "N/A",
+        "top_genre": row.top_genre or "N/A",
+        "total_queries": int(row.total_queries or 0),
+        "total_read": int(row.total_read or 0),
+        "on_hand": int(row.on_hand or 0),
+        "fav_genre": row.fav_genre or "N/A",
+    }
@@ -1,7 +1,12 @@
 import os
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from .cache import TTLCache
+from .metrics import TimedQueuePool, TimedAsyncQueuePool, instrument_engine
 
 load_dotenv()
 
@@ -9,5 +14,129 @@ url = os.getenv("APP_DATABASE_URL") or os.getenv("DATABASE_URL")
 if not url:
     raise RuntimeError("DATABASE_URL / APP_DATABASE_URL not set")
 
-engine = create_engine(url=url, echo=False, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
\ No newline at end of file
+# optional streaming replica for the read-only endpoints, unset means everything uses the primary
+read_url = os.getenv("READ_DATABASE_URL") or None
+
+# serve requests through AsyncEngine/AsyncSession (needs an async driver, e.g. postgresql+psycopg)
+DB_ASYNC = os.getenv("DB_ASYNC", "0").lower() in ("1", "true", "yes")
+
+# per engine (primary, replica, sync and async each have their own pool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# seconds to wait for a pooled connection before TimeoutError
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# connections older than this are replaced on checkout, -1 keeps them forever; keep it below
+# the server's (or the serverless proxy's) idle timeout
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# how a checked out connection is tested before use:
+#   always - SELECT 1 on every checkout (one extra round trip per request and engine)
+#   idle   - only if it sat in the pool for DB_PRE_PING_IDLE seconds or more
+#   never  - rely on DB_POOL_RECYCLE, a dead connection fails the request that gets it
+DB_PRE_PING = os.getenv("DB_PRE_PING", "idle").lower()
+DB_PRE_PING_IDLE = float(os.getenv("DB_PRE_PING_IDLE", "60"))
+if DB_PRE_PING not in ("always", "idle", "never"):
+    raise RuntimeError("DB_PRE_PING must be always, idle or never")
+
+# after a write, the writer's reads stay on the primary this long so they see it despite
+# replication lag
+READ_AFTER_WRITE_SECONDS = float(os.getenv("READ_AFTER_WRITE_SECONDS", "10"))
+
+
+def _ping_idle_connections(engine):
+    """
+    Pessimistic disconnect handling for connections that were idle long enough to have been
+    closed server-side; raising DisconnectionError makes the pool retry with a new connection
+    """
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.get("checked_in_at")
+        if checked_in_at is None or time.monotonic() - checked_in_at < DB_PRE_PING_IDLE:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception as e:
+            raise exc.DisconnectionError() from e
+        finally:
+            cursor.close()
+
+
+def _pool_options() -> dict:
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_PRE_PING == "always",
+    }
+
+
+def make_engine(url: str, name: str):
+    engine = create_engine(url=url, echo=False, poolclass=TimedQueuePool, **_pool_options())
+    if DB_PRE_PING == "idle":
+        _ping_idle_connections(engine)
+    instrument_engine(engine, name)
+    return engine
+
+
+def make_async_engine(url: str, name: str):
+    engine = create_async_engine(url=url, echo=False, poolclass=TimedAsyncQueuePool, **_pool_options())
+    # pool events live on the sync engine; the checkout runs inside the greenlet, so the
+    # adapted cursor can still await
+    if DB_PRE_PING == "idle":
+        _ping_idle_connections(engine.sync_engine)
+    instrument_engine(engine.sync_engine, name)
+    return engine
+
+
+engine = make_engine(url, "sync")
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+read_engine = engine
+ReadSessionLocal = SessionLocal
+if read_url:
+    read_engine = make_engine(read_url, "sync-replica")
+    ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, autocommit=False)
+
+# background jobs (event flusher, sweepers, scripts) always use the sync engine above
+async_engine = None
+AsyncSessionLocal = None
+async_read_engine = None
+AsyncReadSessionLocal = None
+if DB_ASYNC:
+    async_engine = make_async_engine(url, "async")
+    # objects are serialized after the endpoint returns, expiring them on commit would
+    # force a lazy refresh outside the greenlet
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+    async_read_engine = async_engine
+    AsyncReadSessionLocal = AsyncSessionLocal
+    if read_url:
+        async_read_engine = make_async_engine(read_url, "async-replica")
+        AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False, expire_on_commit=False)
+
+
+# users who wrote in the last READ_AFTER_WRITE_SECONDS; per process, a user whose next request
+# lands on another worker can still read from the replica
+_recent_writers = TTLCache(maxsize=100_000, ttl=READ_AFTER_WRITE_SECONDS)
+
+
+def note_write(user_id: int):
+    if read_url and READ_AFTER_WRITE_SECONDS > 0:
+        _recent_writers.set(user_id, True)
+
+
+def reads_from_primary(user_id: int) -> bool:
+    return not read_url or _recent_writers.get(user_id, False)
+
+
+def reads_from_replica(db) -> bool:
+    """True for sessions bound to READ_DATABASE_URL, including the sync side of an AsyncSession"""
+    if not read_url:
+        return False
+    bind = db.get_bind()
+    return bind is read_engine or (async_read_engine is not None and bind is async_read_engine.sync_engine)
@@ -0,0 +1,194 @@
+"""
+Buffered SearchEvents ingestion.
+
+Catalog requests only enqueue an event; a background thread drains the queue and writes
+events in bulk once SEARCH_EVENTS_BATCH_SIZE rows are waiting or SEARCH_EVENTS_FLUSH_INTERVAL
+seconds have passed. The queue is bounded, so a slow database drops analytics instead of
+slowing down catalog browsing.
+"""
+import os
+import queue
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+
+from fastapi.concurrency import run_in_threadpool
+
+from .db import SessionLocal
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+SEARCH_EVENTS_QUEUE_SIZE = int(os.getenv("SEARCH_EVENTS_QUEUE_SIZE", "10000"))
+SEARCH_EVENTS_BATCH_SIZE = int(os.getenv("SEARCH_EVENTS_BATCH_SIZE", "500"))
+SEARCH_EVENTS_FLUSH_INTERVAL = float(os.getenv("SEARCH_EVENTS_FLUSH_INTERVAL", "2"))
+SEARCH_EVENTS_COALESCE_SECONDS = float(os.getenv("SEARCH_EVENTS_COALESCE_SECONDS", "300"))
+# how long a request may wait for queue space before its event is dropped, 0 = never wait
+SEARCH_EVENTS_ENQUEUE_TIMEOUT = float(os.getenv("SEARCH_EVENTS_ENQUEUE_TIMEOUT", "0"))
+
+
+class SearchEventBuffer:
+    def __init__(
+            self,
+            session_factory=SessionLocal,
+            max_size: int = SEARCH_EVENTS_QUEUE_SIZE,
+            batch_size: int = SEARCH_EVENTS_BATCH_SIZE,
+            flush_interval: float = SEARCH_EVENTS_FLUSH_INTERVAL,
+            coalesce_seconds: float = SEARCH_EVENTS_COALESCE_SECONDS,
+            enqueue_timeout: float = SEARCH_EVENTS_ENQUEUE_TIMEOUT
+            ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.coalesce_seconds = coalesce_seconds
+        self.enqueue_timeout = enqueue_timeout
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._last_event: dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self.stats = {
+            "enqueued": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "backpressure_waits": 0,
+            "flushed": 0,
+            # events naming a genre, author or user that does not exist
+            "rejected": 0,
+            "failed": 0,
+            "batches": 0,
+            "last_flush_seconds": 0.0,
+        }
+
+    def add(self, user_id: int, genre_id: int | None, author_id: int | None, query_text: str | None) -> bool:
+        """Queues one event, returns False if it was coalesced or dropped"""
+        event = self._event(user_id, genre_id, author_id, query_text)
+        if event is None:
+            return False
+        return self._put_nowait(event) or self._wait_for_space(event)
+
+    async def add_async(
+            self, user_id: int, genre_id: int | None, author_id: int | None, query_text: str | None
+            ) -> bool:
+        """add for coroutines: waiting for queue space happens in the threadpool, never on the event loop"""
+        event = self._event(user_id, genre_id, author_id, query_text)
+        if event is None:
+            return False
+        if self._put_nowait(event):
+            return True
+        if self.enqueue_timeout <= 0:
+            return self._drop()
+        return await run_in_threadpool(self._wait_for_space, event)
+
+    def _event(self, user_id: int, genre_id: int | None, author_id: int | None, query_text: str | None) -> dict | None:
+        """The event to queue, None if it repeats the user's last search"""
+        now = time.monotonic()
+        signature = (genre_id, author_id, query_text)
+
+        with self._lock:
+            last = self._last_event.get(user_id)
+            if last is not None and last[0] == signature and now - last[1] < self.coalesce_seconds:
+                # paging through the same filter is one search, not one per page
+                self._last_event[user_id] = (signature, now)
+                self.stats["coalesced"] += 1
+                return None
+            self._last_event[user_id] = (signature, now)
+
+        return {
+            "user_id": user_id,
+            "genre_id": genre_id,
+            "author_id": author_id,
+            "query_text": query_text,
+            "created_at": datetime.now(timezone.utc).date(),
+        }
+
+    def _put_nowait(self, event: dict) -> bool:
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            return False
+        self.stats["enqueued"] += 1
+        return True
+
+    def _wait_for_space(self, event: dict) -> bool:
+        """Blocks up to enqueue_timeout for a full queue to drain"""
+        if self.enqueue_timeout <= 0:
+            return self._drop()
+        self.stats["backpressure_waits"] += 1
+        try:
+            self._queue.put(event, timeout=self.enqueue_timeout)
+        except queue.Full:
+            return self._drop()
+        self.stats["enqueued"] += 1
+        return True
+
+    def _drop(self) -> bool:
+        self.stats["dropped"] += 1
+        return False
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="search-events-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stops the flusher after writing whatever is still queued"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._drain()
+            if batch:
+                self.flush(batch)
+            self._forget_idle_users()
+
+    def _drain(self) -> list[dict]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self, batch: list[dict]):
+        started = time.monotonic()
+        db = self.session_factory()
+        try:
+            written = crud.record_search_events(db, batch)
+            self.stats["flushed"] += written
+            self.stats["rejected"] += len(batch) - written
+        except Exception:
+            db.rollback()
+            self.stats["failed"] += len(batch)
+            logger.exception("Failed to write %d search events", len(batch))
+        finally:
+            db.close()
+        self.stats["batches"] += 1
+        self.stats["last_flush_seconds"] = time.monotonic() - started
+
+    def _forget_idle_users(self):
+        cutoff = time.monotonic() - self.coalesce_seconds
+        with self._lock:
+            idle = [user_id for user_id, (_, seen) in self._last_event.items() if seen < cutoff]
+            for user_id in idle:
+                del self._last_event[user_id]
+
+
+search_events = SearchEventBuffer()
@@ -0,0 +1,119 @@
+"""
+Password hashing on a dedicated worker pool.
+
+Argon2 is slow and memory-hard on purpose. Run inline it holds one of Starlette's shared
+threadpool workers for the whole request, so a burst of logins starves every other
+endpoint. Here hashing runs on its own bounded pool (threads by default, argon2 releases
+the GIL; PASSWORD_HASH_EXECUTOR=process for separate processes) and callers await it.
+Jobs beyond PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE are rejected with HashPoolBusy.
+"""
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+from pwdlib import PasswordHash
+
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "64"))
+
+password_hash = PasswordHash.recommended()
+
+
+class HashPoolBusy(Exception):
+    """Raised when too many hashing jobs are already waiting"""
+
+
+def _timed(fn, *args):
+    # wall clock, so the start time means the same thing inside a worker process
+    started = time.time()
+    return fn(*args), started
+
+
+def _hash(password: str) -> str:
+    return password_hash.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return password_hash.verify(password, hashed)
+
+
+class PasswordHasher:
+    def __init__(
+            self,
+            kind: str = PASSWORD_HASH_EXECUTOR,
+            workers: int = PASSWORD_HASH_WORKERS,
+            queue_size: int = PASSWORD_HASH_QUEUE
+            ):
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self.stats = {
+            "completed": 0,
+            "rejected": 0,
+            "queue_wait_seconds_total": 0.0,
+            "latency_seconds_total": 0.0,
+            "latency_seconds_max": 0.0,
+        }
+
+    def queue_depth(self) -> int:
+        """Jobs submitted but not started yet"""
+        return max(self._pending - self.workers, 0)
+
+    def in_flight(self) -> int:
+        return self._pending
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._submit(_verify, password, hashed)
+
+    async def _submit(self, fn, *args):
+        if self._executor is None:
+            self.start()
+
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                self.stats["rejected"] += 1
+                raise HashPoolBusy()
+            self._pending += 1
+
+        submitted = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started = await loop.run_in_executor(self._executor, _timed, fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+        latency = time.time() - submitted
+        self.stats["completed"] += 1
+        self.stats["queue_wait_seconds_total"] += max(started - submitted, 0.0)
+        self.stats["latency_seconds_total"] += latency
+        self.stats["latency_seconds_max"] = max(self.stats["latency_seconds_max"], latency)
+        return result
+
+
+hasher = PasswordHasher()
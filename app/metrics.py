@@ -0,0 +1,319 @@
+"""
+Request and SQL metrics, exposed in Prometheus text format at /metrics.
+
+- MetricsMiddleware times every HTTP request and labels it with the matched route template
+  (`/api/users/{user_id}/history/`, not the concrete path), so ids do not multiply series.
+- SQLAlchemy cursor events count the statements each request executes and the time spent
+  in them. A context variable ties them to the request; Starlette's threadpool and
+  AsyncSession's greenlets both inherit it. Statements slower than SLOW_QUERY_MS are
+  logged to "app.sql.slow" with their parameters and the request that issued them.
+- TimedQueuePool / TimedAsyncQueuePool measure how long a checkout waits for a pooled
+  connection, opening a new one included.
+- Component stats (caches, hash pool, search event buffer, periodic tasks) registered with
+  register_component are read at scrape time.
+
+Nothing here imports the rest of the app, app.db builds its engines with these pools.
+"""
+import os
+import time
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+# statements at least this slow are logged with their parameters, 0 disables the log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_PARAMS_CHARS = 500
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+slow_query_logger = logging.getLogger("app.sql.slow")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...], labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.labelnames = labelnames
+        # labels -> [per-bucket counts..., sum, count]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+ROUTE_LABELS = ("method", "route")
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", LATENCY_BUCKETS, ROUTE_LABELS)
+http_request_queries = Histogram(
+    "http_request_queries", "SQL statements executed per request", QUERY_COUNT_BUCKETS, ROUTE_LABELS)
+http_request_db_time = Histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per request", LATENCY_BUCKETS, ROUTE_LABELS)
+http_request_pool_wait = Histogram(
+    "http_request_pool_wait_seconds", "Time a request waited for pooled connections", LATENCY_BUCKETS, ROUTE_LABELS)
+db_query_duration = Histogram(
+    "db_query_duration_seconds", "SQL statement latency", LATENCY_BUCKETS, ("engine",))
+db_slow_queries = Counter(
+    "db_slow_queries_total", f"SQL statements slower than SLOW_QUERY_MS ({SLOW_QUERY_MS:g} ms)", ("engine",))
+db_pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds", "Wait for a pooled connection, connecting included", LATENCY_BUCKETS, ("engine",))
+
+METRICS = [
+    http_requests, http_request_duration, http_request_queries, http_request_db_time, http_request_pool_wait,
+    db_query_duration, db_slow_queries, db_pool_checkout_wait,
+]
+
+
+class RequestStats:
+    __slots__ = ("request", "queries", "db_seconds", "pool_wait_seconds")
+
+    def __init__(self, request: str):
+        # "GET /api/books/", for the slow query log
+        self.request = request
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+
+_request: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+def current_request() -> RequestStats | None:
+    return _request.get()
+
+
+# pools
+
+class _TimedCheckout:
+    metrics_name = "default"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            db_pool_checkout_wait.observe(waited, self.metrics_name)
+            stats = _request.get()
+            if stats is not None:
+                stats.pool_wait_seconds += waited
+
+    def recreate(self):
+        # engine.dispose() replaces the pool, keep its label
+        pool = super().recreate()
+        pool.metrics_name = self.metrics_name
+        return pool
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+# engines
+
+_engines: dict[str, object] = {}
+
+
+def instrument_engine(engine, name: str):
+    """
+    Times the statements of `engine` (a sync Engine, for AsyncEngine its .sync_engine) and
+    labels its pool `name`
+    """
+    _engines[name] = engine
+    if isinstance(engine.pool, _TimedCheckout):
+        engine.pool.metrics_name = name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        db_query_duration.observe(elapsed, name)
+
+        stats = _request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            db_slow_queries.inc(name)
+            params = repr(parameters)
+            if len(params) > SLOW_QUERY_PARAMS_CHARS:
+                params = params[:SLOW_QUERY_PARAMS_CHARS] + "..."
+            slow_query_logger.warning(
+                "%.1f ms on %s (%s): %s | params %s",
+                elapsed * 1000, name, stats.request if stats is not None else "no request",
+                " ".join(statement.split()), params
+            )
+
+
+def _render_pools() -> list[str]:
+    lines = ["# HELP db_pool_connections Pooled connections by state", "# TYPE db_pool_connections gauge"]
+    for name, engine in sorted(_engines.items()):
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        # QueuePool counts overflow from -size up, it is only real once positive
+        states = (
+            ("size", pool.size()), ("checked_in", pool.checkedin()),
+            ("checked_out", pool.checkedout()), ("overflow", max(pool.overflow(), 0)),
+        )
+        for state, value in states:
+            lines.append(f"db_pool_connections{_labels(('engine', 'state'), (name, state))} {value}")
+    return lines
+
+
+# components
+
+_components: dict[str, Callable[[], dict]] = {}
+
+
+def register_component(name: str, read_stats: Callable[[], dict]):
+    """read_stats() -> {stat: number}, read on every scrape; non-numeric values are skipped"""
+    _components[name] = read_stats
+
+
+def _render_components() -> list[str]:
+    lines = ["# HELP app_component_stat Internal counters of caches, pools and background workers",
+             "# TYPE app_component_stat gauge"]
+    for name, read_stats in sorted(_components.items()):
+        for stat, value in sorted(read_stats().items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"app_component_stat{_labels(('component', 'stat'), (name, stat))} {_number(value)}")
+    return lines
+
+
+def render() -> bytes:
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += _render_pools()
+    lines += _render_components()
+    return ("\n".join(lines) + "\n").encode()
+
+
+# requests
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope and scope.get("root_path"):
+        # mounts (static files, covers) only leave their prefix behind
+        return scope["root_path"] + "/{path}"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(f"{scope['method']} {scope['path']}")
+        token = _request.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request.reset(token)
+            elapsed = time.perf_counter() - started
+            labels = (scope["method"], _route_label(scope))
+            http_requests.inc(*labels, status_code)
+            http_request_duration.observe(elapsed, *labels)
+            http_request_queries.observe(stats.queries, *labels)
+            http_request_db_time.observe(stats.db_seconds, *labels)
+            http_request_pool_wait.observe(stats.pool_wait_seconds, *labels)
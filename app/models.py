@@ -1,8 +1,9 @@
 from __future__ import annotations
 from typing import Annotated
 from datetime import date
-from sqlalchemy import String, Integer, ForeignKey, DateTime, Date, Enum as SQLEnum, func, MetaData, text
+from sqlalchemy import String, Integer, ForeignKey, DateTime, Date, Enum as SQLEnum, func, MetaData, text, Index, Sequence, DDL, event, JSON
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.dialects.postgresql import JSONB
 import enum
 
 convention = {
@@ -22,6 +23,10 @@ class Base(DeclarativeBase):
     metadata = MetaData(naming_convention=convention)
 
 
+# bumped by writers outside the API process (scripts/dataset.py) so servers drop cached catalog data
+catalog_version = Sequence("catalog_version", metadata=Base.metadata)
+
+
 class ReservationStatus(enum.Enum):
     """Reservation Status"""
     active = "active"
@@ -29,6 +34,13 @@ class ReservationStatus(enum.Enum):
     overdue = "overdue"
 
 
+class StatKind(enum.Enum):
+    """What a user_stat_buckets counter counts"""
+    search_genre = "search_genre"
+    search_author = "search_author"
+    read_genre = "read_genre"
+
+
 class Role(Base):
     """User roles: admin, user etc."""
     __tablename__ = "roles"
@@ -49,6 +61,8 @@ class User(Base):
     phone: Mapped[str] = mapped_column(String(255), nullable=True)
     password_hash: Mapped[str] = mapped_column(String(255), nullable=False)
     role_id: Mapped[int] = mapped_column(ForeignKey("roles.id", ondelete="RESTRICT"))
+    # bumped to revoke every access token issued so far
+    token_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
 
     role: Mapped[Role] = relationship(back_populates="users")
     reservations: Mapped[list["Reservation"]] = relationship(back_populates="user")
@@ -89,6 +103,8 @@ class Book(Base):
     published_year: Mapped[int | None] = mapped_column(Integer, nullable=True)
     
     cover_path: Mapped[str | None] = mapped_column(String(300), nullable=True)
+    # resized copies of cover_path made by scripts/covers.py, {size: {format: file name}}
+    cover_variants: Mapped[dict | None] = mapped_column(JSON().with_variant(JSONB, "postgresql"), nullable=True)
 
     author_id: Mapped[int] = mapped_column(ForeignKey("authors.id", ondelete="CASCADE"))
     genre_id: Mapped[int] = mapped_column(ForeignKey("genres.id", ondelete="SET NULL"), nullable=True)
@@ -99,6 +115,13 @@ class Book(Base):
     genre: Mapped[Genre | None] = relationship(back_populates="books")
     reservations: Mapped[list["Reservation"]] = relationship(back_populates="book")
 
+    __table_args__ = (
+        # title sort and (title, id) keyset paging, unfiltered and per genre/author filter
+        Index("ix_books_title_id", "title", "id"),
+        Index("ix_books_genre_id_title_id", "genre_id", "title", "id"),
+        Index("ix_books_author_id_title_id", "author_id", "title", "id"),
+    )
+
 
 class Reservation(Base):
     """Book reservations"""
@@ -119,17 +142,79 @@ class Reservation(Base):
     book: Mapped[Book] = relationship(back_populates="reservations")
     user: Mapped[User] = relationship(back_populates="reservations")
 
+    __table_args__ = (
+        # at most one open reservation per user and book, the race guard behind crud.create_reservation
+        Index(
+            "uq_reservations_open_user_book", "user_id", "book_id",
+            unique=True, postgresql_where=text("status <> 'returned'")
+        ),
+        # history and the per-user statistics
+        Index("ix_reservations_user_id_reserve_date", "user_id", "reserve_date"),
+        # active loans by due date, the predicate matches crud.get_user_reservations
+        Index(
+            "ix_reservations_open_user_id_return_date", "user_id", "return_date",
+            postgresql_where=text("status IN ('active', 'overdue')")
+        ),
+        # crud.mark_overdue_reservations
+        Index("ix_reservations_active_return_date", "return_date", postgresql_where=text("status = 'active'")),
+    )
+
 class SearchEvents(Base):
-    "History logging for stats"
+    "History logging for stats, range-partitioned by month on created_at (see app.partitions)"
     __tablename__ = "search_events"
 
-    id: Mapped[intpk]
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
     genre_id: Mapped[int] = mapped_column(ForeignKey("genres.id", ondelete="SET NULL"), nullable=True)
     author_id: Mapped[int] = mapped_column(ForeignKey("authors.id", ondelete="CASCADE"), nullable=True)
     query_text: Mapped[str | None] = mapped_column(String(511), nullable=True)
-    created_at: Mapped[date] = mapped_column(Date, nullable=False, server_default=text("TIMEZONE('utc', now())"))
+    # part of the primary key because Postgres requires the partition key in unique constraints
+    created_at: Mapped[date] = mapped_column(
+        Date, primary_key=True, nullable=False, server_default=text("TIMEZONE('utc', now())"))
 
     user: Mapped[User] = relationship(back_populates="search_events")
     genre: Mapped[Genre | None] = relationship(back_populates="search_events")
-    author: Mapped[Author | None] = relationship(back_populates="search_events")
\ No newline at end of file
+    author: Mapped[Author | None] = relationship(back_populates="search_events")
+
+    __table_args__ = (
+        Index("ix_search_events_user_id_created_at", "user_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+# catches rows for months without a partition yet; app.partitions moves them out
+event.listen(
+    SearchEvents.__table__, "after_create",
+    DDL("CREATE TABLE search_events_default PARTITION OF search_events DEFAULT").execute_if(dialect="postgresql")
+)
+
+
+class SearchEventDay(Base):
+    "Per-user daily search counts of search_events partitions past retention"
+    __tablename__ = "search_event_days"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    queries: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
+
+class UserStats(Base):
+    "Per-user analytics totals, kept up to date by crud on every event/reservation change"
+    __tablename__ = "user_stats"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    total_queries: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    total_read: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    on_hand: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
+
+class UserStatBucket(Base):
+    "Per-user daily counters by genre/author, summed over a window for the analytics dashboard"
+    __tablename__ = "user_stat_buckets"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    kind: Mapped[StatKind] = mapped_column(SQLEnum(StatKind, native_enum=False), primary_key=True)
+    # genres.id or authors.id depending on kind
+    ref_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
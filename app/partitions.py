@@ -0,0 +1,190 @@
+"""
+Monthly partitions of search_events.
+
+search_events is range-partitioned on created_at, one partition per month named
+search_events_YYYY_MM, plus search_events_default for rows whose month has no partition yet.
+maintain_search_events (a periodic task, see app.tasks) keeps that layout:
+
+- retires partitions that ended more than SEARCH_EVENTS_RETENTION_MONTHS months ago: their
+  events are compacted into per-user/per-day counts in search_event_days, then the partition
+  is dropped or, with SEARCH_EVENTS_RETENTION_ACTION=detach, detached and left as a plain
+  table for archiving, without foreign keys or id default. Per-day genre/author counts
+  already live in user_stat_buckets;
+- creates the partitions of the current month and SEARCH_EVENTS_PARTITIONS_AHEAD months
+  ahead, and of any month that landed in the default partition, moving those rows over.
+
+Every step is its own transaction under an advisory lock, so several API processes can run
+the task without racing each other. The DDL needs a role that owns search_events.
+"""
+import os
+import re
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# months of raw events kept besides the current one, 0 keeps everything
+SEARCH_EVENTS_RETENTION_MONTHS = int(os.getenv("SEARCH_EVENTS_RETENTION_MONTHS", "12"))
+# "drop" or "detach"
+SEARCH_EVENTS_RETENTION_ACTION = os.getenv("SEARCH_EVENTS_RETENTION_ACTION", "drop").lower()
+SEARCH_EVENTS_PARTITIONS_AHEAD = int(os.getenv("SEARCH_EVENTS_PARTITIONS_AHEAD", "2"))
+
+if SEARCH_EVENTS_RETENTION_ACTION not in ("drop", "detach"):
+    raise RuntimeError("SEARCH_EVENTS_RETENTION_ACTION must be drop or detach")
+
+PARENT = "search_events"
+DEFAULT_PARTITION = "search_events_default"
+# pg_try_advisory_xact_lock key, arbitrary but fixed
+MAINTENANCE_LOCK = 0x5E4C4E7
+
+_BOUNDS = re.compile(r"FOR VALUES FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+PARTITIONS_QUERY = text("""
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = CAST(:parent AS regclass)
+    ORDER BY c.relname
+""")
+
+# returns the events compacted; ON CONFLICT adds up because stragglers from the default
+# partition can be compacted into a day that already has a row
+COMPACT = """
+    WITH retired AS ({source}),
+    per_day AS (
+        SELECT user_id, created_at AS day, count(*) AS queries FROM retired GROUP BY user_id, created_at
+    ),
+    stored AS (
+        INSERT INTO search_event_days (user_id, day, queries)
+        SELECT user_id, day, queries FROM per_day
+        ON CONFLICT (user_id, day) DO UPDATE SET queries = search_event_days.queries + excluded.queries
+    )
+    SELECT COALESCE(sum(queries), 0) FROM per_day
+"""
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_{month:%Y_%m}"
+
+
+def list_partitions(db: Session) -> list[tuple[str, date, date]]:
+    """(name, from, to) of the monthly partitions, the default partition excluded"""
+    partitions = []
+    for name, bound in db.execute(PARTITIONS_QUERY, {"parent": PARENT}):
+        match = _BOUNDS.search(bound or "")
+        if match:
+            partitions.append((name, date.fromisoformat(match[1]), date.fromisoformat(match[2])))
+    return partitions
+
+
+def retention_cutoff(today: date) -> date | None:
+    """Events before this day are compacted, None when retention is off"""
+    if SEARCH_EVENTS_RETENTION_MONTHS <= 0:
+        return None
+    return add_months(month_start(today), -SEARCH_EVENTS_RETENTION_MONTHS)
+
+
+def _locked(db: Session) -> bool:
+    return db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK}).scalar()
+
+
+def _make_plain(db: Session, name: str):
+    """
+    A detached partition keeps the parent's id default and foreign keys, which tie the archive
+    to search_events_id_seq, users, genres and authors and would block dropping any of them
+    """
+    db.execute(text(f'ALTER TABLE "{name}" ALTER COLUMN id DROP DEFAULT'))
+    constraints = db.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:name AS regclass) AND contype = 'f'"
+    ), {"name": f'"{name}"'}).scalars().all()
+    for constraint in constraints:
+        db.execute(text(f'ALTER TABLE "{name}" DROP CONSTRAINT "{constraint}"'))
+
+
+def retire_partitions(db: Session, today: date) -> int:
+    """Compacts and drops/detaches partitions past retention, returns the events compacted"""
+    cutoff = retention_cutoff(today)
+    if cutoff is None:
+        return 0
+
+    compacted = 0
+    if _locked(db):
+        # stragglers for months that are already gone
+        compacted += db.execute(text(COMPACT.format(
+            source=f"DELETE FROM {DEFAULT_PARTITION} WHERE created_at < :cutoff RETURNING user_id, created_at"
+        )), {"cutoff": cutoff}).scalar()
+    db.commit()
+
+    for name, _, upper in list_partitions(db):
+        if upper > cutoff:
+            continue
+        if not _locked(db):
+            db.rollback()
+            break
+        compacted += db.execute(text(COMPACT.format(source=f'SELECT user_id, created_at FROM "{name}"'))).scalar()
+        if SEARCH_EVENTS_RETENTION_ACTION == "detach":
+            db.execute(text(f'ALTER TABLE {PARENT} DETACH PARTITION "{name}"'))
+            _make_plain(db, name)
+        else:
+            db.execute(text(f'DROP TABLE "{name}"'))
+        db.commit()
+    return compacted
+
+
+def ensure_partitions(db: Session, today: date) -> int:
+    """
+    Creates missing partitions for the coming months and for months found in the default
+    partition, returns how many were created
+    """
+    current = month_start(today)
+    months = {add_months(current, n) for n in range(SEARCH_EVENTS_PARTITIONS_AHEAD + 1)}
+    months |= set(db.execute(text(
+        f"SELECT DISTINCT CAST(date_trunc('month', created_at) AS date) FROM {DEFAULT_PARTITION}"
+    )).scalars())
+    cutoff = retention_cutoff(today)
+    if cutoff is not None:
+        months = {month for month in months if month >= cutoff}
+    existing = {lower for _, lower, _ in list_partitions(db)}
+    db.rollback()
+
+    created = 0
+    for month in sorted(months - existing):
+        if not _locked(db):
+            db.rollback()
+            break
+        name, lower, upper = partition_name(month), month, add_months(month, 1)
+        if db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+            # another process got there first, or a detached table still has the name
+            db.rollback()
+            continue
+        # created standalone and attached, so rows that went to the default partition can move first
+        db.execute(text(f'CREATE TABLE "{name}" (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+        db.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :lower AND created_at < :upper RETURNING *
+            )
+            INSERT INTO "{name}" SELECT * FROM moved
+        """), {"lower": lower, "upper": upper})
+        db.execute(text(
+            f"ALTER TABLE {PARENT} ATTACH PARTITION \"{name}\" FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        ))
+        db.commit()
+        created += 1
+    return created
+
+
+def maintain_search_events(db: Session) -> int:
+    """Periodic job: retention first, then partitions ahead; returns the events compacted"""
+    today = date.today()
+    compacted = retire_partitions(db, today)
+    ensure_partitions(db, today)
+    return compacted
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 from datetime import date
+from .covers import variant_urls
 
 class Role(BaseModel):
     name: str
@@ -37,17 +38,44 @@ class Book(BaseModel):
     isbn: str
     count: int
     cover_path: str | None = None
+    cover_variants: dict[str, dict[str, str]] | None = Field(default=None, exclude=True)
     author: Author | None = None
     genre: Genre | None = None
 
+    @computed_field
+    @property
+    def covers(self) -> dict[str, dict[str, str]] | None:
+        """Resized cover URLs, {"thumb" | "detail": {"avif" | "webp": url}}"""
+        return variant_urls(self.cover_variants)
+
     class Config:
         from_attributes = True
 
+class FacetCount(BaseModel):
+    id: int
+    name: str
+    count: int
+
+class Facets(BaseModel):
+    genres: list[FacetCount]
+    authors: list[FacetCount]
+
+class Suggestion(BaseModel):
+    # "title" (id is a book id) or "author" (an author id)
+    kind: str
+    id: int
+    text: str
+
 class BookPage(BaseModel):
     items: list[Book]
-    total_items: int
+    total_items: int | None = None
+    # False when total_items is the planner's estimate (total=estimate), None without a total
+    total_exact: bool | None = None
     skip: int
     limit: int
+    next_cursor: str | None = None
+    # top genres/authors with their book counts, only with facets=N
+    facets: Facets | None = None
 
     class Config:
         from_attributes = True
@@ -88,6 +116,33 @@ class ReservationCreate(BaseModel):
     class Config:
         from_attributes = True
 
+# books or reservations per batch request
+RESERVATION_BATCH_MAX = 50
+
+class ReservationBatchCreate(BaseModel):
+    user_id: int
+    book_ids: list[int] = Field(..., min_length=1, max_length=RESERVATION_BATCH_MAX)
+    return_date: date
+
+class ReservationBatchReturn(BaseModel):
+    reservation_ids: list[int] = Field(..., min_length=1, max_length=RESERVATION_BATCH_MAX)
+
+class ReservationBatchItem(BaseModel):
+    # the requested id, book_id for reservations and reservation_id for returns
+    book_id: int | None = None
+    reservation_id: int | None = None
+    ok: bool
+    error: str | None = None
+    reservation: Reservation | None = None
+
+    class Config:
+        from_attributes = True
+
+class ReservationBatch(BaseModel):
+    items: list[ReservationBatchItem]
+    succeeded: int
+    failed: int
+
 class Statistics(BaseModel):
     top_author: str
     top_genre: str
@@ -0,0 +1,238 @@
+"""
+Catalog text search.
+
+Two interchangeable backends sit behind the `search` filter of `crud.get_books`:
+
+- PostgresSearch: prefix full-text match (tsvector) OR typo-tolerant trigram match over
+  book title and author name, served by the GIN indexes from migration 5c1e7a2b9f40.
+- MemorySearch: in-process inverted index for deployments without Postgres/pg_trgm. It is
+  built by a background task at startup (app.tasks) and rebuilt when an import moves
+  catalog_version (crud.sync_catalog_version); until the first build is done searches fall
+  back to a plain ILIKE match.
+
+The backend is chosen from SEARCH_BACKEND ("postgres" / "memory") or, if unset, from the
+database dialect.
+"""
+import os
+import re
+import abc
+import bisect
+import threading
+
+from sqlalchemy import select, or_, func, case, false, literal_column
+from sqlalchemy.orm import Session, Query
+
+from . import models
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND")
+MEMORY_SEARCH_LIMIT = int(os.getenv("MEMORY_SEARCH_LIMIT", "1000"))
+
+# must match the expression indexes literally, a bound parameter would not use them
+TS_CONFIG = literal_column("'simple'::regconfig")
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def ilike_filter(query: Query, search: str) -> Query:
+    """Plain substring match, used when the search string has no word characters"""
+    search_pattern = f"%{search}%"
+    return query.filter(
+        or_(
+            models.Book.title.ilike(search_pattern),
+            models.Book.author.has(models.Author.name.ilike(search_pattern))
+        )
+    )
+
+
+class SearchBackend(abc.ABC):
+    """Applies a search string to a Book query"""
+    name = "base"
+
+    @abc.abstractmethod
+    def apply(self, db: Session, query: Query, search: str, ranked: bool = False) -> Query:
+        """Filters `query` to matching books; with ranked=True also orders by relevance"""
+
+
+class PostgresSearch(SearchBackend):
+    name = "postgres"
+
+    def apply(self, db, query, search, ranked=False):
+        tokens = tokenize(search)
+        if not tokens:
+            return ilike_filter(query, search)
+
+        tsquery = func.to_tsquery(TS_CONFIG, " & ".join(f"{t}:*" for t in tokens))
+        title_vector = func.to_tsvector(TS_CONFIG, models.Book.title)
+
+        matching_authors = select(models.Author.id).where(
+            or_(
+                func.to_tsvector(TS_CONFIG, models.Author.name).op("@@")(tsquery),
+                models.Author.name.op("%>")(search)
+            )
+        )
+        query = query.filter(
+            or_(
+                title_vector.op("@@")(tsquery),
+                models.Book.title.op("%>")(search),
+                models.Book.author_id.in_(matching_authors)
+            )
+        )
+
+        if ranked:
+            author_name = (
+                select(models.Author.name)
+                .where(models.Author.id == models.Book.author_id)
+                .scalar_subquery()
+            )
+            rank = (
+                func.ts_rank_cd(title_vector, tsquery)
+                + func.word_similarity(search, models.Book.title)
+                + 0.5 * func.word_similarity(search, author_name)
+            )
+            query = query.order_by(rank.desc(), models.Book.id.asc())
+        return query
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+class InvertedIndex:
+    """
+    token -> {book_id: weight} postings plus a sorted term list for prefix lookups.
+    Title tokens weigh more than author tokens. Structures are rebuilt off to the side
+    and swapped in, so readers never see a half-built index.
+    """
+    EXACT, PREFIX, FUZZY = 1.0, 0.8, 0.6
+    TITLE_WEIGHT, AUTHOR_WEIGHT = 2.0, 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: dict[str, dict[int, float]] = {}
+        self._terms: list[str] = []
+        self.built = False
+
+    def build(self, db: Session) -> int:
+        """Indexes every book, returns how many"""
+        rows = db.execute(
+            select(models.Book.id, models.Book.title, models.Author.name)
+            .join(models.Author, models.Book.author_id == models.Author.id, isouter=True)
+        ).all()
+        db.rollback()
+
+        postings: dict[str, dict[int, float]] = {}
+        for book_id, title, author_name in rows:
+            self._index_doc(postings, book_id, title, author_name)
+
+        with self._lock:
+            self._postings = postings
+            self._terms = sorted(postings)
+            self.built = True
+        return len(rows)
+
+    def _index_doc(self, postings, book_id, title, author_name):
+        weights: dict[str, float] = {}
+        for token in tokenize(author_name or ""):
+            weights[token] = self.AUTHOR_WEIGHT
+        for token in tokenize(title or ""):
+            weights[token] = self.TITLE_WEIGHT
+        for token, weight in weights.items():
+            postings.setdefault(token, {})[book_id] = weight
+
+    def _candidate_terms(self, token: str) -> list[tuple[str, float]]:
+        terms = self._terms
+        found = {}
+
+        lo = bisect.bisect_left(terms, token)
+        hi = bisect.bisect_right(terms, token + "\uffff")
+        for term in terms[lo:hi]:
+            found[term] = self.EXACT if term == token else self.PREFIX
+
+        if len(token) >= 4:
+            # typos rarely hit the first letter, so only look inside its block
+            lo = bisect.bisect_left(terms, token[0])
+            hi = bisect.bisect_right(terms, token[0] + "\uffff")
+            for term in terms[lo:hi]:
+                if term not in found and _within_one_edit(token, term):
+                    found[term] = self.FUZZY
+        return list(found.items())
+
+    def search(self, text: str, limit: int = MEMORY_SEARCH_LIMIT) -> list[int]:
+        """Book ids matching every query token, best first"""
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+
+        with self._lock:
+            scores: dict[int, float] | None = None
+            for token in tokens:
+                token_scores: dict[int, float] = {}
+                for term, quality in self._candidate_terms(token):
+                    for book_id, weight in self._postings[term].items():
+                        score = weight * quality
+                        if score > token_scores.get(book_id, 0.0):
+                            token_scores[book_id] = score
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {b: s + token_scores[b] for b, s in scores.items() if b in token_scores}
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [book_id for book_id, _ in ranked[:limit]]
+
+
+class MemorySearch(SearchBackend):
+    name = "memory"
+
+    def __init__(self):
+        self.index = InvertedIndex()
+
+    def apply(self, db, query, search, ranked=False):
+        # the index is built by a background task, never on the request path
+        if not tokenize(search) or not self.index.built:
+            return ilike_filter(query, search)
+
+        book_ids = self.index.search(search)
+        if not book_ids:
+            return query.filter(false())
+
+        query = query.filter(models.Book.id.in_(book_ids))
+        if ranked:
+            position = case({book_id: i for i, book_id in enumerate(book_ids)}, value=models.Book.id)
+            query = query.order_by(position)
+        return query
+
+
+postgres_search = PostgresSearch()
+memory_search = MemorySearch()
+
+
+def get_backend(db: Session) -> SearchBackend:
+    if SEARCH_BACKEND == "memory":
+        return memory_search
+    if SEARCH_BACKEND == "postgres":
+        return postgres_search
+    return postgres_search if db.get_bind().dialect.name == "postgresql" else memory_search
+
+
+def build_memory_index(db: Session) -> int:
+    """(Re)builds the in-memory index if it serves this deployment's searches, returns the books indexed"""
+    if get_backend(db) is not memory_search:
+        return 0
+    return memory_search.index.build(db)
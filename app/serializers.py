@@ -0,0 +1,90 @@
+"""
+Column-projection serializers.
+
+With SERIALIZATION_MODE=projection the catalog and reservation endpoints select only the
+columns their response schemas expose and turn each result row straight into the schema's
+JSON shape, instead of hydrating Book/Author/Genre objects through joinedload and validating
+them again with from_attributes. "orm" keeps the schema-validated path.
+
+The row builders mirror schemas.Book and schemas.Reservation field for field (same keys, same
+order, covers computed the same way), bench/serialization.py checks both modes return
+identical bodies.
+"""
+import os
+
+import pydantic_core
+from fastapi.responses import JSONResponse
+
+from . import models
+from .covers import variant_urls
+
+SERIALIZATION_MODE = os.getenv("SERIALIZATION_MODE", "projection")
+PROJECTION = SERIALIZATION_MODE == "projection"
+
+# order matters, book_row unpacks by position
+BOOK_COLUMNS = (
+    models.Book.id,
+    models.Book.title,
+    models.Book.isbn,
+    models.Book.count,
+    models.Book.cover_path,
+    models.Book.cover_variants,
+    models.Author.id.label("author_id"),
+    models.Author.name.label("author_name"),
+    models.Genre.id.label("genre_id"),
+    models.Genre.name.label("genre_name"),
+)
+
+# followed by the effective status and BOOK_COLUMNS, see reservation_row
+RESERVATION_COLUMNS = (
+    models.Reservation.id.label("reservation_id"),
+    models.Reservation.reserve_date,
+    models.Reservation.return_date,
+)
+
+
+def join_book_refs(query):
+    """Joins the author and genre of models.Book for BOOK_COLUMNS"""
+    return query.join(
+        models.Author, models.Book.author_id == models.Author.id
+    ).outerjoin(
+        models.Genre, models.Book.genre_id == models.Genre.id
+    )
+
+
+def book_row(row) -> dict:
+    """BOOK_COLUMNS row -> schemas.Book output"""
+    id_, title, isbn, count, cover_path, cover_variants, author_id, author_name, genre_id, genre_name = row
+    return {
+        "id": id_,
+        "title": title,
+        "isbn": isbn,
+        "count": count,
+        "cover_path": cover_path,
+        "author": {"id": author_id, "name": author_name},
+        "genre": None if genre_id is None else {"id": genre_id, "name": genre_name},
+        "covers": variant_urls(cover_variants),
+    }
+
+
+def reservation_row(row) -> dict:
+    """(*RESERVATION_COLUMNS, status, *BOOK_COLUMNS) row -> schemas.Reservation output"""
+    return {
+        "id": row[0],
+        "reserve_date": row[1],
+        "return_date": row[2],
+        "status": row[3],
+        "book": book_row(row[4:]),
+    }
+
+
+def to_json(content) -> bytes:
+    # dates as ISO strings, enums as their values, same compact output as the schema path
+    return pydantic_core.to_json(content)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response for already shaped dicts/lists, rendered by pydantic-core in one pass"""
+
+    def render(self, content) -> bytes:
+        return to_json(content)
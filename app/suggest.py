@@ -0,0 +1,312 @@
+"""
+Typeahead suggestions for the catalog search box (/api/suggest).
+
+An in-memory prefix index over book titles and author names. Every word start of the
+normalized text (lowercase words joined by single spaces) is a key, so "hob" finds
+"The Hobbit". The index keeps no per-key strings: the normalized texts are concatenated into
+one str, the keys are word-start offsets into it, sorted by the text that follows, and a
+prefix lookup is two binary searches over that array. A max segment tree over the popularity
+at each sorted key then yields the most popular entries of the matching range in
+O(limit * log n), whether the prefix matches ten keys or half the catalog.
+
+Popularity is the number of reservations of a book, and of all books of an author.
+The index is built by a background task when the server starts and rebuilt periodically
+(see app.tasks), which refreshes popularity and titles changed by a re-import. Books and
+authors imported in between are added by the catalog_version poll (crud.sync_catalog_version)
+to a short side list that lookups scan until the next rebuild.
+"""
+import os
+import time
+import bisect
+import heapq
+import threading
+from array import array
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from . import models
+from .search import tokenize
+
+SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", "8"))
+SUGGEST_MAX_LIMIT = 20
+# imported entries kept in the side list, more trigger a rebuild
+SUGGEST_RECENT_MAX = int(os.getenv("SUGGEST_RECENT_MAX", "5000"))
+# leading characters of a key that take part in the sort; longer queries are looked up by
+# their first KEY_CHARS characters and the matches checked against the whole query
+KEY_CHARS = 32
+
+TITLE, AUTHOR = 0, 1
+KINDS = ("title", "author")
+
+
+def normalize(text: str) -> str:
+    return " ".join(tokenize(text))
+
+
+class _MaxTree:
+    """Segment tree over positions: the position of the highest score in a range"""
+
+    def __init__(self, scores: array):
+        size = 1
+        while size < len(scores):
+            size *= 2
+        level = list(range(len(scores))) + [-1] * (size - len(scores))
+        levels = [level]
+        while len(level) > 1:
+            # a left child always holds the lower position, so it wins ties
+            level = [
+                a if b < 0 or (a >= 0 and scores[a] >= scores[b]) else b
+                for a, b in zip(level[0::2], level[1::2])
+            ]
+            levels.append(level)
+        # heap layout: root at 1, children of node n at 2n and 2n + 1
+        tree = array("i", [-1])
+        for level in reversed(levels):
+            tree.extend(level)
+        self.size = size
+        self.tree = tree
+        self.scores = scores
+
+    @staticmethod
+    def _better(scores, a: int, b: int) -> int:
+        # ties go to the lower position, i.e. alphabetical order
+        if a < 0:
+            return b
+        if b < 0:
+            return a
+        return a if scores[a] > scores[b] or (scores[a] == scores[b] and a < b) else b
+
+    def argmax(self, lo: int, hi: int) -> int:
+        best = -1
+        tree, scores, better = self.tree, self.scores, self._better
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                best = better(scores, best, tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = better(scores, best, tree[hi])
+            lo >>= 1
+            hi >>= 1
+        return best
+
+    def ranked(self, lo: int, hi: int):
+        """Positions in [lo, hi), most popular first, produced lazily"""
+        heap = []
+
+        def push(a, b):
+            if a < b:
+                position = self.argmax(a, b)
+                heapq.heappush(heap, (-self.scores[position], position, a, b))
+
+        push(lo, hi)
+        while heap:
+            _, position, a, b = heapq.heappop(heap)
+            yield position
+            push(a, position)
+            push(position + 1, b)
+
+
+class _Snapshot:
+    """The immutable, sorted part of the index"""
+
+    def __init__(self, entries):
+        """entries: (kind, ref_id, display text, popularity)"""
+        normalized, displays = [], []
+        self.kinds = array("b")
+        self.ref_ids = array("i")
+        self.popularity = array("I")
+        self.display_starts = array("I")
+        offsets, owners = array("I"), array("I")
+
+        offset = display_offset = 0
+        for kind, ref_id, display, popularity in entries:
+            text = normalize(display)
+            if not text:
+                continue
+            entry = len(self.kinds)
+            self.kinds.append(kind)
+            self.ref_ids.append(ref_id)
+            self.popularity.append(popularity)
+            self.display_starts.append(display_offset)
+            displays.append(display)
+            display_offset += len(display) + 1
+
+            start = 0
+            while True:
+                offsets.append(offset + start)
+                owners.append(entry)
+                start = text.find(" ", start) + 1
+                if not start:
+                    break
+            normalized.append(text)
+            offset += len(text) + 1
+        self.display_starts.append(display_offset)
+
+        # "\n" ends every entry, so a key never matches across two of them
+        self.text = "\n".join(normalized) + "\n"
+        self.displays = "\n".join(displays) + "\n"
+
+        text = self.text
+        order = sorted(range(len(offsets)), key=lambda i: text[offsets[i]:offsets[i] + KEY_CHARS])
+        self.keys = array("I", (offsets[i] for i in order))
+        self.owners = array("I", (owners[i] for i in order))
+        self.tree = _MaxTree(array("I", (self.popularity[owner] for owner in self.owners)))
+
+    def display(self, entry: int) -> str:
+        return self.displays[self.display_starts[entry]:self.display_starts[entry + 1] - 1]
+
+    def lookup(self, query: str, limit: int) -> list[tuple[int, int, int, str]]:
+        """(popularity, kind, ref_id, display) of the most popular entries with a word starting with query"""
+        text, keys = self.text, self.keys
+        prefix = query[:KEY_CHARS]
+        size = len(prefix)
+        lo = bisect.bisect_left(keys, prefix, key=lambda offset: text[offset:offset + size])
+        hi = bisect.bisect_right(keys, prefix, lo=lo, key=lambda offset: text[offset:offset + size])
+
+        found, seen = [], set()
+        for position in self.tree.ranked(lo, hi):
+            if len(query) > KEY_CHARS and not text.startswith(query, keys[position]):
+                continue
+            entry = self.owners[position]
+            display = self.display(entry)
+            # an entry matching at two word starts, or several editions of one title
+            key = (self.kinds[entry], display.lower())
+            if key in seen:
+                continue
+            seen.add(key)
+            found.append((self.popularity[entry], self.kinds[entry], self.ref_ids[entry], display))
+            if len(found) == limit:
+                break
+        return found
+
+    def memory_bytes(self) -> int:
+        arrays = (self.kinds, self.ref_ids, self.popularity, self.display_starts, self.keys, self.owners, self.tree.tree)
+        return len(self.text) + len(self.displays) + sum(a.itemsize * len(a) for a in arrays)
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._snapshot: _Snapshot | None = None
+        # (normalized, kind, ref_id, display) imported since the last build, popularity 0
+        self._recent: list[tuple[str, int, int, str]] = []
+        self._max_book_id = 0
+        self._max_author_id = 0
+        # build and catch_up run on different task threads and take turns; lookups read the
+        # snapshot and the side list without it, both are replaced, never changed in place
+        self._lock = threading.RLock()
+
+        self.stats = {
+            "entries": 0,
+            "keys": 0,
+            "recent": 0,
+            "memory_bytes": 0,
+            "builds": 0,
+            "last_build_seconds": 0.0,
+            "lookups": 0,
+        }
+
+    @property
+    def built(self) -> bool:
+        return self._snapshot is not None
+
+    def build(self, db: Session) -> int:
+        """Rebuilds the index from the database, returns the number of entries"""
+        with self._lock:
+            return self._build(db)
+
+    def _build(self, db: Session) -> int:
+        started = time.monotonic()
+        reservations = (
+            select(models.Reservation.book_id, func.count().label("reservations"))
+            .group_by(models.Reservation.book_id)
+            .subquery()
+        )
+        books = db.execute(
+            select(
+                models.Book.id, models.Book.title, models.Book.author_id,
+                func.coalesce(reservations.c.reservations, 0)
+            ).outerjoin(reservations, reservations.c.book_id == models.Book.id)
+        ).all()
+        authors = db.execute(select(models.Author.id, models.Author.name)).all()
+        db.rollback()
+
+        author_popularity: dict[int, int] = {}
+        for _, _, author_id, popularity in books:
+            author_popularity[author_id] = author_popularity.get(author_id, 0) + popularity
+        entries = [(TITLE, book_id, title, popularity) for book_id, title, _, popularity in books]
+        entries += [(AUTHOR, author_id, name, author_popularity.get(author_id, 0)) for author_id, name in authors]
+        snapshot = _Snapshot(entries)
+
+        self._snapshot = snapshot
+        self._recent = []
+        self._max_book_id = max((row.id for row in books), default=0)
+        self._max_author_id = max((row.id for row in authors), default=0)
+        self.stats.update(
+            entries=len(snapshot.kinds), keys=len(snapshot.keys), recent=0,
+            memory_bytes=snapshot.memory_bytes(), last_build_seconds=time.monotonic() - started
+        )
+        self.stats["builds"] += 1
+        return len(snapshot.kinds)
+
+    def catch_up(self, db: Session) -> int:
+        """
+        Adds books and authors with ids above the ones seen so far, returns how many; rows of an
+        import transaction that commits out of id order wait for the next rebuild
+        """
+        with self._lock:
+            if not self.built:
+                return 0
+            return self._catch_up(db)
+
+    def _catch_up(self, db: Session) -> int:
+        books = db.execute(
+            select(models.Book.id, models.Book.title).where(models.Book.id > self._max_book_id)
+        ).all()
+        authors = db.execute(
+            select(models.Author.id, models.Author.name).where(models.Author.id > self._max_author_id)
+        ).all()
+        db.rollback()
+        if len(self._recent) + len(books) + len(authors) > SUGGEST_RECENT_MAX:
+            return self._build(db)
+
+        added = [(normalize(title), TITLE, book_id, title) for book_id, title in books]
+        added += [(normalize(name), AUTHOR, author_id, name) for author_id, name in authors]
+        self._recent = self._recent + [item for item in added if item[0]]
+        self._max_book_id = max([self._max_book_id] + [row.id for row in books])
+        self._max_author_id = max([self._max_author_id] + [row.id for row in authors])
+        self.stats["recent"] = len(self._recent)
+        return len(added)
+
+    def suggest(self, query: str, limit: int = SUGGEST_LIMIT) -> list[dict]:
+        """[{kind, id, text}] for the words starting with query, most popular first"""
+        query = normalize(query)
+        snapshot, recent = self._snapshot, self._recent
+        if not query or snapshot is None:
+            return []
+        self.stats["lookups"] += 1
+
+        found = snapshot.lookup(query, limit)
+        if recent:
+            found += [
+                (0, kind, ref_id, display) for normalized, kind, ref_id, display in recent
+                if normalized.startswith(query) or " " + query in normalized
+            ]
+            found.sort(key=lambda item: -item[0])
+
+        suggestions, seen = [], set()
+        for _, kind, ref_id, display in found:
+            key = (kind, display.lower())
+            if key in seen:
+                continue
+            seen.add(key)
+            suggestions.append({"kind": KINDS[kind], "id": ref_id, "text": display})
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+
+suggestions = SuggestIndex()
@@ -0,0 +1,110 @@
+"""
+Scheduled background jobs.
+
+Each PeriodicTask runs its job on a daemon thread every `interval` seconds with its own
+session and keeps run metrics in `stats`. Tasks are started and stopped by the app lifespan.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from . import crud, partitions, search
+from .suggest import suggestions
+
+logger = logging.getLogger(__name__)
+
+OVERDUE_SWEEP_INTERVAL = float(os.getenv("OVERDUE_SWEEP_INTERVAL", "300"))
+CATALOG_VERSION_POLL_INTERVAL = float(os.getenv("CATALOG_VERSION_POLL_INTERVAL", "10"))
+# search_events partition upkeep (retention, compaction, partitions ahead), 0 disables it
+SEARCH_EVENTS_MAINTENANCE_INTERVAL = float(os.getenv("SEARCH_EVENTS_MAINTENANCE_INTERVAL", "3600"))
+# in-memory search index rebuild (SEARCH_BACKEND=memory), also picks up catalog edits made
+# outside the importer; the first run builds it at startup, until then searches use ILIKE
+MEMORY_SEARCH_REBUILD_INTERVAL = float(os.getenv("MEMORY_SEARCH_REBUILD_INTERVAL", "3600"))
+# /api/suggest index rebuild (popularity, re-imported titles); the first run builds it at
+# startup, 0 turns suggestions off
+SUGGEST_REBUILD_INTERVAL = float(os.getenv("SUGGEST_REBUILD_INTERVAL", "3600"))
+
+
+class PeriodicTask:
+    def __init__(self, name: str, job: Callable[[Session], int], interval: float, session_factory=SessionLocal):
+        self.name = name
+        self.job = job
+        self.interval = interval
+        self.session_factory = session_factory
+
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self.stats = {
+            "runs": 0,
+            "failures": 0,
+            "rows_last_run": 0,
+            "rows_total": 0,
+            "last_run_seconds": 0.0,
+            "last_run_at": None,
+        }
+
+    def run_once(self) -> int:
+        started = time.monotonic()
+        db = self.session_factory()
+        try:
+            rows = self.job(db) or 0
+        except Exception:
+            db.rollback()
+            self.stats["failures"] += 1
+            logger.exception("Task %s failed", self.name)
+            return 0
+        finally:
+            db.close()
+
+        self.stats["runs"] += 1
+        self.stats["rows_last_run"] = rows
+        self.stats["rows_total"] += rows
+        self.stats["last_run_seconds"] = time.monotonic() - started
+        self.stats["last_run_at"] = time.time()
+        return rows
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        # first sweep right away so a fresh process starts from a consistent state
+        while True:
+            self.run_once()
+            if self._stopping.wait(self.interval):
+                break
+
+
+overdue_sweeper = PeriodicTask("overdue-sweeper", crud.mark_overdue_reservations, OVERDUE_SWEEP_INTERVAL)
+# picks up imports done by scripts/dataset.py, rows = 1 when the caches were dropped
+catalog_version_poll = PeriodicTask("catalog-version-poll", crud.sync_catalog_version, CATALOG_VERSION_POLL_INTERVAL)
+
+# rows = events compacted out of partitions past retention
+search_events_maintenance = PeriodicTask(
+    "search-events-maintenance", partitions.maintain_search_events, SEARCH_EVENTS_MAINTENANCE_INTERVAL)
+
+# rows = books in the rebuilt index, 0 with the Postgres backend
+search_index_rebuild = PeriodicTask("search-index-rebuild", search.build_memory_index, MEMORY_SEARCH_REBUILD_INTERVAL)
+
+# rows = entries in the rebuilt index
+suggest_rebuild = PeriodicTask("suggest-rebuild", suggestions.build, SUGGEST_REBUILD_INTERVAL)
+
+tasks = [
+    overdue_sweeper, catalog_version_poll, search_events_maintenance, search_index_rebuild, suggest_rebuild
+]
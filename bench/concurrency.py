@@ -0,0 +1,129 @@
+"""
+Sync vs async request path under concurrent load.
+
+    python -m bench.concurrency --concurrency 64 --duration 20
+
+Starts `uvicorn main:app` once per mode (DB_ASYNC=0 and DB_ASYNC=1) with the environment of
+this shell, registers a throwaway user, and keeps `--concurrency` clients busy for
+`--duration` seconds with a read mix: catalog pages, active reservations, history and
+analytics. Reports throughput and latency percentiles per mode. Needs httpx
+(bench/requirements.txt).
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+
+import httpx
+
+from bench.common import summarize
+
+
+def start_server(mode: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ, DB_ASYNC="1" if mode == "async" else "0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/api/genres/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit("Server did not start")
+
+
+async def login(client: httpx.AsyncClient) -> tuple[int, dict]:
+    email = f"bench-{int(time.time() * 1000)}@example.invalid"
+    password = "bench-password"
+    await client.post("/api/register", json={"name": "bench", "email": email, "password": password})
+    token = (await client.post("/token", data={"username": email, "password": password})).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = (await client.get("/api/me", headers=headers)).json()["id"]
+    return user_id, headers
+
+
+async def run_mode(mode: str, args) -> dict:
+    server = start_server(mode, args.port)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+            await wait_ready(client)
+            user_id, headers = await login(client)
+            paths = [
+                lambda rng: f"/api/books/?skip={rng.randint(0, 400) * 8}&limit=8",
+                lambda rng: f"/api/books/?limit=8&sort={rng.choice(['asc', 'desc'])}",
+                lambda rng: f"/api/users/{user_id}/reservations/",
+                lambda rng: f"/api/users/{user_id}/history/",
+                lambda rng: f"/api/users/{user_id}/analytics/",
+            ]
+
+            latencies: list[float] = []
+            errors = 0
+            deadline = time.monotonic() + args.duration
+
+            async def worker(seed: int):
+                nonlocal errors
+                rng = random.Random(seed)
+                while time.monotonic() < deadline:
+                    path = rng.choice(paths)(rng)
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(path, headers=headers)
+                        ok = response.status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    if not ok:
+                        errors += 1
+
+            started = time.monotonic()
+            await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+            elapsed = time.monotonic() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return {
+        "mode": mode,
+        "concurrency": args.concurrency,
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "errors": errors,
+        **summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="sync,async")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = [asyncio.run(run_mode(mode, args)) for mode in args.modes.split(",")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<6} {'req/s':>8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for r in results:
+        print(
+            f"{r['mode']:<6} {r['requests_per_second']:8.1f} {r['mean_ms']:9.2f} {r['p50_ms']:9.2f} "
+            f"{r['p95_ms']:9.2f} {r['p99_ms']:9.2f} {r['errors']:7d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
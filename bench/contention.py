@@ -0,0 +1,222 @@
+"""
+Hot-book contention: many users reserving the last copies of one title at once.
+
+    python -m bench.contention --stock 50 --users 400 --workers 32
+
+Creates a bench book with `--stock` copies and `--users` bench users, then lets `--workers`
+threads reserve it concurrently (every user tries twice, so duplicate requests race too)
+and finally returns everything concurrently. Variants:
+
+- before: the original create/return, separate existence checks and `book.count -= 1` in Python
+- atomic: crud.create_reservation / crud.return_reservation, one conditional statement each
+
+After each phase the book count is checked against the reservations that exist: a variant
+oversells when more reservations succeed than there were copies. Runs against DATABASE_URL /
+APP_DATABASE_URL like the app.
+"""
+import time
+import argparse
+import threading
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select, func, delete, exists
+from sqlalchemy.exc import DBAPIError
+
+from app.db import SessionLocal
+from app import crud, models, schemas
+
+BENCH_EMAIL = "bench-contention-{}@example.invalid"
+BENCH_ISBN = "bench-contention"
+
+
+def create_before(db, reservation_data):
+    """The original crud.create_reservation"""
+    available = db.execute(select(exists().where(
+        models.Book.id == reservation_data.book_id,
+        models.Book.count > 0
+    ))).scalar()
+    if not available:
+        return False
+
+    same = db.execute(select(exists().where(
+        models.Reservation.book_id == reservation_data.book_id,
+        models.Reservation.user_id == reservation_data.user_id
+    ))).scalar()
+    if same:
+        return False
+
+    db.add(models.Reservation(
+        book_id=reservation_data.book_id,
+        user_id=reservation_data.user_id,
+        return_date=reservation_data.return_date
+    ))
+    book = db.query(models.Book).filter(models.Book.id == reservation_data.book_id).first()
+    if book:
+        book.count -= 1
+    db.commit()
+    return True
+
+
+def return_before(db, reservation_id: int):
+    """The original crud.return_reservation"""
+    reservation = db.query(models.Reservation).filter(
+        models.Reservation.id == reservation_id,
+        models.Reservation.status != "returned"
+    ).first()
+    if not reservation:
+        return None
+
+    reservation.status = "returned"
+    book = db.query(models.Book).filter(models.Book.id == reservation.book_id).first()
+    if book:
+        book.count += 1
+    db.commit()
+    return True
+
+
+VARIANTS = {
+    "before": (create_before, return_before),
+    "atomic": (crud.create_reservation, crud.return_reservation),
+}
+
+
+def setup(db, stock: int, users: int) -> tuple[int, list[int]]:
+    cleanup(db)
+    author = db.execute(select(models.Author).limit(1)).scalar()
+    if author is None:
+        author = models.Author(name="Bench Author")
+        db.add(author)
+    role = db.execute(select(models.Role).where(models.Role.name == "user")).scalar()
+    if role is None:
+        role = models.Role(name="user")
+        db.add(role)
+    db.flush()
+
+    book = models.Book(title="Bench hot title", isbn=BENCH_ISBN, author_id=author.id, count=stock)
+    db.add(book)
+    user_rows = [
+        models.User(name=f"bench {n}", email=BENCH_EMAIL.format(n), password_hash="!", role_id=role.id)
+        for n in range(users)
+    ]
+    db.add_all(user_rows)
+    db.commit()
+    return book.id, [user.id for user in user_rows]
+
+
+def cleanup(db):
+    db.execute(delete(models.User).where(models.User.email.like(BENCH_EMAIL.format("%"))))
+    db.execute(delete(models.Book).where(models.Book.isbn == BENCH_ISBN))
+    db.commit()
+
+
+def run_phase(workers: int, jobs: list, fn) -> tuple[int, int, float]:
+    """Runs fn(db, job) for every job on `workers` threads, one session per thread"""
+    local = threading.local()
+    sessions = []
+    lock = threading.Lock()
+
+    def call(job):
+        if not hasattr(local, "db"):
+            local.db = SessionLocal()
+            with lock:
+                sessions.append(local.db)
+        try:
+            return bool(fn(local.db, job))
+        except DBAPIError:
+            local.db.rollback()
+            return None
+        except Exception:
+            # never leave a transaction (and its row locks) open behind a failed call
+            local.db.rollback()
+            raise
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(call, jobs))
+    elapsed = time.perf_counter() - started
+    for db in sessions:
+        db.close()
+    return results.count(True), results.count(None), elapsed
+
+
+def check(db, book_id: int) -> tuple[int, int, int]:
+    """(book count, open reservations, users holding more than one open reservation)"""
+    count = db.execute(select(models.Book.count).where(models.Book.id == book_id)).scalar()
+    open_rows = select(models.Reservation.user_id).where(
+        models.Reservation.book_id == book_id,
+        models.Reservation.status != models.ReservationStatus.returned
+    )
+    open_count = db.execute(select(func.count()).select_from(open_rows.subquery())).scalar()
+    duplicates = db.execute(
+        select(func.count()).select_from(
+            open_rows.group_by(models.Reservation.user_id).having(func.count() > 1).subquery()
+        )
+    ).scalar()
+    db.rollback()
+    return count, open_count, duplicates
+
+
+def run_variant(name: str, args) -> dict:
+    create, return_ = VARIANTS[name]
+    db = SessionLocal()
+    try:
+        book_id, user_ids = setup(db, args.stock, args.users)
+        return_date = date.today() + timedelta(days=14)
+        jobs = [
+            schemas.ReservationCreate(book_id=book_id, user_id=user_id, return_date=return_date)
+            for user_id in user_ids for _ in range(2)
+        ]
+
+        reserved, reserve_errors, reserve_elapsed = run_phase(args.workers, jobs, create)
+        count, open_count, duplicates = check(db, book_id)
+        oversold = max(open_count - args.stock, 0)
+        consistent = count == args.stock - open_count and count >= 0
+
+        reservation_ids = db.execute(
+            select(models.Reservation.id).where(models.Reservation.book_id == book_id)
+        ).scalars().all()
+        db.rollback()
+        # every reservation is returned twice to race double returns as well
+        returned, return_errors, return_elapsed = run_phase(args.workers, reservation_ids * 2, return_)
+        final_count, _, _ = check(db, book_id)
+
+        return {
+            "variant": name,
+            "reserved": reserved,
+            "oversold": oversold,
+            "duplicates": duplicates,
+            "count_consistent": consistent and final_count == args.stock,
+            "errors": reserve_errors + return_errors,
+            "reserve_ops_per_second": round(len(jobs) / reserve_elapsed, 1),
+            "return_ops_per_second": round(len(reservation_ids) * 2 / return_elapsed, 1),
+            "returned": returned,
+        }
+    finally:
+        cleanup(db)
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", default="before,atomic")
+    parser.add_argument("--stock", type=int, default=50, help="copies of the hot book")
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"{args.users} users x 2 requests for {args.stock} copies on {args.workers} threads")
+    print(
+        f"{'variant':<8} {'reserved':>9} {'oversold':>9} {'dupes':>6} {'errors':>7} "
+        f"{'consistent':>11} {'reserve/s':>10} {'return/s':>9}"
+    )
+    for name in args.variants.split(","):
+        r = run_variant(name, args)
+        print(
+            f"{r['variant']:<8} {r['reserved']:9d} {r['oversold']:9d} {r['duplicates']:6d} {r['errors']:7d} "
+            f"{str(r['count_consistent']):>11} {r['reserve_ops_per_second']:10.1f} {r['return_ops_per_second']:9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
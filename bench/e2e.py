@@ -0,0 +1,408 @@
+"""
+End-to-end load benchmark over every API endpoint.
+
+    python -m bench.synthetic --reset                       # deterministic data set, once
+    python -m bench.e2e --concurrency 32 --duration 60 --output baseline.json
+    python -m bench.e2e --concurrency 32 --duration 60 --baseline baseline.json
+
+Starts `uvicorn bench.querycount:app` with the environment of this shell (so DB_ASYNC,
+SERIALIZATION_MODE, SEARCH_BACKEND... apply; --url targets a running server instead, without
+query counts unless it sends x-query-count). Every client logs in as its own synthetic user
+and then runs a weighted mix of operations until --duration is over: catalog pages with
+every filter, sort and paging mode, reference lists, profile, reservations, history,
+analytics, reserve + return, logins, registrations. The first --warmup seconds are not
+recorded.
+
+Reports per endpoint and overall: throughput, p50/p95/p99 latency, errors and SQL
+statements per request. --output writes the report as JSON; --baseline compares against
+such a file and exits with status 1 if an endpoint's p95 grew by more than --tolerance
+(and --min-delta-ms), its statements per request went up, new errors appeared, or overall
+throughput dropped by more than --tolerance. Needs httpx (bench/requirements.txt) and the
+database the server uses, to read the data set's id ranges.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime, timezone, timedelta
+
+import httpx
+from sqlalchemy import select, func, delete
+
+from app.db import SessionLocal
+from app import models
+from bench.common import summarize
+from bench.concurrency import wait_ready
+from bench.synthetic import SYNTHETIC_EMAIL, SYNTHETIC_PASSWORD
+
+REGISTER_EMAIL = "bench-e2e-{}@example.invalid"
+QUERY_COUNT_HEADER = "x-query-count"
+ENV_KEYS = ("DB_ASYNC", "SERIALIZATION_MODE", "SEARCH_BACKEND", "AUTH_MODE", "USER_STATS_SOURCE")
+
+
+def load_scale(db) -> dict:
+    """Ids and words the operations draw from"""
+    users = db.execute(
+        select(func.count()).select_from(models.User).where(models.User.email.like(SYNTHETIC_EMAIL.format("%")))
+    ).scalar()
+    if not users:
+        raise SystemExit("No synthetic users, load a data set with `python -m bench.synthetic` first")
+    books, max_book_id = db.execute(select(func.count(), func.max(models.Book.id))).one()
+    genre_ids = db.execute(select(models.Genre.id).order_by(models.Genre.id)).scalars().all()
+    author_ids = db.execute(
+        select(models.Book.author_id).distinct().order_by(models.Book.author_id).limit(2000)
+    ).scalars().all()
+    titles = db.execute(select(models.Book.title).where(models.Book.id % 97 == 0).limit(500)).scalars().all()
+    words = sorted({word for title in titles for word in title.lower().split() if len(word) > 2})
+    db.rollback()
+    return {
+        "books": books, "max_book_id": max_book_id, "users": users,
+        "genre_ids": genre_ids, "author_ids": author_ids, "words": words,
+    }
+
+
+class Recorder:
+    def __init__(self, warmup_until: float):
+        self.warmup_until = warmup_until
+        self.samples: dict[str, dict] = {}
+
+    def add(self, label: str, started: float, latency_ms: float, ok: bool, rejected: bool, queries: int | None):
+        if started < self.warmup_until:
+            return
+        sample = self.samples.setdefault(label, {"latencies": [], "errors": 0, "rejected": 0, "queries": []})
+        sample["latencies"].append(latency_ms)
+        sample["errors"] += not ok
+        sample["rejected"] += rejected
+        if queries is not None:
+            sample["queries"].append(queries)
+
+
+class Client:
+    """One simulated user"""
+
+    def __init__(self, http: httpx.AsyncClient, recorder: Recorder, scale: dict, rng: random.Random):
+        self.http = http
+        self.recorder = recorder
+        self.scale = scale
+        self.rng = rng
+        self.headers = {}
+        self.user_id = None
+        self.email = None
+
+    async def call(self, label: str, method: str, url: str, expected=(200,), rejected=(), **kwargs):
+        started = time.monotonic()
+        perf_started = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.add(label, started, (time.perf_counter() - perf_started) * 1000, False, False, None)
+            return None
+        latency = (time.perf_counter() - perf_started) * 1000
+        queries = response.headers.get(QUERY_COUNT_HEADER)
+        self.recorder.add(
+            label, started, latency,
+            ok=response.status_code in expected or response.status_code in rejected,
+            rejected=response.status_code in rejected,
+            queries=int(queries) if queries is not None else None,
+        )
+        return response
+
+    async def login(self, number: int | None = None):
+        if number is None:
+            number = self.rng.randint(1, self.scale["users"])
+        self.email = SYNTHETIC_EMAIL.format(number)
+        self.headers = {}
+        response = await self.call("POST /token", "POST", "/token", data={"username": self.email, "password": SYNTHETIC_PASSWORD})
+        if response is None or response.status_code != 200:
+            raise SystemExit(f"Cannot log in as {self.email}")
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        self.user_id = (await self.call("GET /api/me", "GET", "/api/me")).json()["id"]
+
+    # operations, see OPERATIONS for their weights
+
+    async def books(self):
+        await self.call("GET /api/books/", "GET", f"/api/books/?skip={self.rng.randint(0, 50) * 8}&limit=8")
+
+    async def books_genre(self):
+        genre_id = self.rng.choice(self.scale["genre_ids"])
+        await self.call("GET /api/books/ genre", "GET", f"/api/books/?genre_id={genre_id}&skip={self.rng.randint(0, 5) * 8}")
+
+    async def books_author(self):
+        await self.call("GET /api/books/ author", "GET", f"/api/books/?author_id={self.rng.choice(self.scale['author_ids'])}")
+
+    async def books_search(self):
+        words = " ".join(self.rng.sample(self.scale["words"], self.rng.choice((1, 1, 2))))
+        await self.call("GET /api/books/ search", "GET", "/api/books/", params={"search": words})
+
+    async def books_sort(self):
+        sort = self.rng.choice(("asc", "desc"))
+        await self.call("GET /api/books/ sort", "GET", f"/api/books/?sort={sort}&skip={self.rng.randint(0, 20) * 8}")
+
+    async def books_cursor(self):
+        params = {"paging": "cursor", "limit": 8, "total": "none", "sort": self.rng.choice(("asc", "desc"))}
+        # a few pages deep, each page a request of its own
+        for _ in range(self.rng.randint(1, 3)):
+            response = await self.call("GET /api/books/ cursor", "GET", "/api/books/", params=params)
+            if response is None or response.status_code != 200 or not response.json()["next_cursor"]:
+                break
+            params["cursor"] = response.json()["next_cursor"]
+
+    async def books_estimate(self):
+        params = {"search": self.rng.choice(self.scale["words"]), "total": "estimate"}
+        if self.rng.random() < 0.5:
+            params["genre_id"] = self.rng.choice(self.scale["genre_ids"])
+        await self.call("GET /api/books/ estimate", "GET", "/api/books/", params=params)
+
+    async def genres(self):
+        await self.call("GET /api/genres/", "GET", "/api/genres/")
+
+    async def authors(self):
+        await self.call("GET /api/authors/", "GET", "/api/authors/")
+
+    async def me(self):
+        await self.call("GET /api/me", "GET", "/api/me")
+
+    async def user(self):
+        await self.call("GET /api/users/{id}", "GET", f"/api/users/{self.user_id}")
+
+    async def reservations(self):
+        await self.call("GET /api/users/{id}/reservations/", "GET", f"/api/users/{self.user_id}/reservations/")
+
+    async def history(self):
+        await self.call("GET /api/users/{id}/history/", "GET", f"/api/users/{self.user_id}/history/")
+
+    async def analytics(self):
+        await self.call("GET /api/users/{id}/analytics/", "GET", f"/api/users/{self.user_id}/analytics/")
+
+    async def reserve_and_return(self):
+        book_id = self.rng.randint(1, self.scale["max_book_id"])
+        return_date = (datetime.now(timezone.utc).date() + timedelta(days=14)).isoformat()
+        # out of stock or borrowed by this user before: a 400 is a normal answer
+        response = await self.call(
+            "POST /api/reservations/", "POST", "/api/reservations/", rejected=(400,),
+            json={"book_id": book_id, "user_id": self.user_id, "return_date": return_date},
+        )
+        if response is not None and response.status_code == 200:
+            await self.call(
+                "PATCH /api/reservations/{id}/return", "PATCH", f"/api/reservations/{response.json()['id']}/return"
+            )
+
+    async def relogin(self):
+        await self.login()
+
+    async def register(self):
+        email = REGISTER_EMAIL.format(f"{time.time_ns()}-{self.rng.getrandbits(32)}")
+        await self.call(
+            "POST /api/register", "POST", "/api/register",
+            json={"name": "bench", "email": email, "password": "bench-password"},
+        )
+
+    async def index(self):
+        await self.call("GET /", "GET", "/")
+
+
+# operation -> relative weight, roughly what the SPA does per session
+OPERATIONS = {
+    Client.books: 20,
+    Client.books_genre: 8,
+    Client.books_author: 4,
+    Client.books_search: 8,
+    Client.books_sort: 4,
+    Client.books_cursor: 4,
+    Client.books_estimate: 2,
+    Client.genres: 4,
+    Client.authors: 2,
+    Client.me: 4,
+    Client.user: 2,
+    Client.reservations: 8,
+    Client.history: 6,
+    Client.analytics: 6,
+    Client.reserve_and_return: 6,
+    Client.relogin: 1,
+    Client.register: 0.5,
+    Client.index: 1,
+}
+
+
+def start_server(port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bench.querycount:app", "--port", str(port), "--log-level", "warning"],
+        env=dict(os.environ),
+    )
+
+
+def report_section(sample: dict, elapsed: float) -> dict:
+    return {
+        "requests": len(sample["latencies"]),
+        "requests_per_second": round(len(sample["latencies"]) / elapsed, 1),
+        "errors": sample["errors"],
+        "rejected": sample["rejected"],
+        **summarize(sample["latencies"]),
+        "queries_per_request": (
+            round(sum(sample["queries"]) / len(sample["queries"]), 2) if sample["queries"] else None
+        ),
+    }
+
+
+async def run(args, scale: dict) -> dict:
+    server = None if args.url else start_server(args.port)
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    operations, weights = zip(*OPERATIONS.items())
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+            await wait_ready(http)
+
+            recorder = Recorder(warmup_until=float("inf"))
+            clients = [
+                Client(http, recorder, scale, random.Random(args.seed * 1000 + n)) for n in range(args.concurrency)
+            ]
+            # distinct users as long as there are enough, so reservations do not collide
+            await asyncio.gather(*(
+                client.login(n % scale["users"] + 1) for n, client in enumerate(clients)
+            ))
+
+            started = time.monotonic()
+            recorder.warmup_until = started + args.warmup
+            deadline = recorder.warmup_until + args.duration
+
+            async def worker(client: Client):
+                while time.monotonic() < deadline:
+                    operation = client.rng.choices(operations, weights)[0]
+                    await operation(client)
+
+            await asyncio.gather(*(worker(client) for client in clients))
+            elapsed = time.monotonic() - recorder.warmup_until
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    overall = {"latencies": [], "errors": 0, "rejected": 0, "queries": []}
+    for sample in recorder.samples.values():
+        for key in overall:
+            overall[key] += sample[key]
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "env": {key: os.environ.get(key) for key in ENV_KEYS},
+            "scale": {key: scale[key] for key in ("books", "users")} | {"genres": len(scale["genre_ids"])},
+        },
+        "overall": report_section(overall, elapsed),
+        "endpoints": {
+            label: report_section(sample, elapsed) for label, sample in sorted(recorder.samples.items())
+        },
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list[str]:
+    """Regressions of `current` against `baseline`, empty if there are none"""
+    regressions = []
+    for label, now in current["endpoints"].items():
+        before = baseline["endpoints"].get(label)
+        if before is None:
+            continue
+        if now["p95_ms"] > before["p95_ms"] * (1 + tolerance) and now["p95_ms"] - before["p95_ms"] > min_delta_ms:
+            regressions.append(f"{label}: p95 {before['p95_ms']:.2f} -> {now['p95_ms']:.2f} ms")
+        if None not in (now["queries_per_request"], before["queries_per_request"]) \
+                and now["queries_per_request"] > before["queries_per_request"] + 0.05:
+            regressions.append(
+                f"{label}: queries/request {before['queries_per_request']:.2f} -> {now['queries_per_request']:.2f}"
+            )
+        if now["errors"] and not before["errors"]:
+            regressions.append(f"{label}: {now['errors']} errors, none in the baseline")
+
+    before_rps, now_rps = baseline["overall"]["requests_per_second"], current["overall"]["requests_per_second"]
+    if now_rps < before_rps * (1 - tolerance):
+        regressions.append(f"overall: throughput {before_rps:.1f} -> {now_rps:.1f} req/s")
+    return regressions
+
+
+def print_report(report: dict, baseline: dict | None):
+    print(
+        f"{'endpoint':<36} {'req':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'q/req':>6} {'errors':>7}" + (f" {'Δp95':>8}" if baseline else "")
+    )
+    rows = list(report["endpoints"].items()) + [("overall", report["overall"])]
+    for label, r in rows:
+        line = (
+            f"{label:<36} {r['requests']:7d} {r['requests_per_second']:8.1f} {r['p50_ms']:8.2f} "
+            f"{r['p95_ms']:8.2f} {r['p99_ms']:8.2f} "
+            f"{'-' if r['queries_per_request'] is None else format(r['queries_per_request'], '.2f'):>6} {r['errors']:7d}"
+        )
+        if baseline:
+            before = baseline["overall"] if label == "overall" else baseline["endpoints"].get(label)
+            line += f" {format((r['p95_ms'] / before['p95_ms'] - 1) * 100, '+.0f') + '%' if before and before['p95_ms'] else '':>8}"
+        print(line)
+
+
+def cleanup(db):
+    db.execute(delete(models.User).where(models.User.email.like(REGISTER_EMAIL.format("%"))))
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds, after the warmup")
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--url", default=None, help="benchmark a running server instead of starting one")
+    parser.add_argument("--output", default=None, help="write the report to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative p95 growth / throughput drop")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="ignore p95 changes smaller than this")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    db = SessionLocal()
+    try:
+        scale = load_scale(db)
+        report = asyncio.run(run(args, scale))
+    finally:
+        cleanup(db)
+        db.close()
+
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
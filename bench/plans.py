@@ -0,0 +1,227 @@
+"""
+Query plan regression check for the crud queries.
+
+    python -m bench.plans
+    python -m bench.plans --verbose
+
+Calls the crud functions behind every endpoint and background job against a seeded database
+(python -m bench.synthetic), records each statement they send, and EXPLAINs it with the same
+parameters. Writes happen inside a transaction that is rolled back at the end.
+
+The statements are planned with enable_seqscan and enable_sort off, so the planner takes an
+index whenever one can serve the query, whatever the table sizes. A Seq Scan or Sort left in
+such a plan means no index fits: the check fails, exit code 1. Sorts of aggregated rows (top
+genre by count) cannot come from an index and are not reported; a few cases allow more, with
+the reason next to them.
+"""
+import json
+import argparse
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Callable
+
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import Session
+
+from app.db import engine
+from app import crud, models, schemas, search
+from app.serializers import PROJECTION
+
+SORT_NODES = ("Sort", "Incremental Sort")
+SORT_KEY_CHARS = 60
+DML = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+@dataclass
+class Case:
+    name: str
+    run: Callable[[Session, dict], object]
+    # finding prefix -> why it is acceptable
+    allow: dict[str, str] = field(default_factory=dict)
+
+
+# top-N per grouping set: the window ranks aggregated counts, which no index holds
+RANKED_GROUPS = {
+    "Sort": "ranks genre/author groups by their book count",
+    "Incremental Sort": "orders the top-N rows of each facet",
+}
+
+CASES = [
+    Case("catalog first page", lambda db, s: crud.get_books(db, limit=8, projection=PROJECTION)),
+    Case("catalog by genre, title asc", lambda db, s: crud.get_books(
+        db, limit=8, genre_id=s["genre_id"], sort="asc", projection=PROJECTION)),
+    Case("catalog by author, title desc", lambda db, s: crud.get_books(
+        db, limit=8, author_id=s["author_id"], sort="desc", projection=PROJECTION)),
+    Case("catalog title asc, deep offset", lambda db, s: crud.get_books(
+        db, skip=400, limit=8, sort="asc", total="none", projection=PROJECTION)),
+    Case("catalog cursor, title asc", lambda db, s: crud.get_books(
+        db, limit=8, sort="asc", paging="cursor", cursor=s["title_cursor"], total="none", projection=PROJECTION)),
+    Case("catalog cursor by genre, title desc", lambda db, s: crud.get_books(
+        db, limit=8, genre_id=s["genre_id"], sort="desc", paging="cursor", cursor=s["genre_cursor"],
+        total="none", projection=PROJECTION)),
+    Case("catalog cursor by author, id", lambda db, s: crud.get_books(
+        db, limit=8, author_id=s["author_id"], paging="cursor", total="none", projection=PROJECTION)),
+    Case("catalog estimated totals", lambda db, s: crud.get_books(
+        db, limit=8, genre_id=s["genre_id"], total="estimate", projection=PROJECTION)),
+    Case("catalog search, ranked", lambda db, s: crud.get_books(
+        db, limit=8, search=s["word"], projection=PROJECTION),
+        allow={"Sort": "relevance is computed per matching row"}),
+    Case("catalog facets, search and genre", lambda db, s: crud.get_facets(db, s["genre_id"], None, s["word"], 10),
+         allow=RANKED_GROUPS),
+    Case("catalog facets, unfiltered", lambda db, s: crud.get_facets(db, None, None, None, 10),
+         allow=RANKED_GROUPS),
+    Case("token version", lambda db, s: crud.get_token_version(db, s["user_id"])),
+    Case("user by id", lambda db, s: crud.get_user(db, s["user_id"])),
+    Case("user by email", lambda db, s: crud.get_user_by_email(db, s["email"])),
+    Case("active reservations", lambda db, s: crud.get_user_reservations(db, s["user_id"], projection=PROJECTION)),
+    Case("history", lambda db, s: crud.get_user_history(db, s["user_id"], projection=PROJECTION),
+         allow={"Sort": "ordered by the status as of today, which no index can hold; one user's rows"}),
+    Case("stats rollup", lambda db, s: crud.get_user_stats_rollup(db, s["user_id"])),
+    Case("stats live", lambda db, s: crud.get_user_stats_live(db, s["user_id"])),
+    Case("reserve", lambda db, s: crud.create_reservation(db, schemas.ReservationCreate(
+        user_id=s["user_id"], book_id=s["free_book_id"], return_date=date.today() + timedelta(days=14)))),
+    Case("return", lambda db, s: crud.return_reservation(db, s["open_reservation_id"])),
+    Case("reserve batch", lambda db, s: crud.create_reservations(
+        db, s["user_id"], s["free_book_ids"] + [s["open_book_id"]], date.today() + timedelta(days=14))),
+    Case("return batch", lambda db, s: crud.return_reservations(db, s["user_id"], s["open_reservation_ids"])),
+    Case("overdue sweep", lambda db, s: crud.mark_overdue_reservations(db)),
+]
+
+
+def sample(db: Session) -> dict:
+    """Realistic parameters: the busiest genre, author and reader of the loaded data"""
+    genre_id = db.execute(
+        select(models.Book.genre_id).where(models.Book.genre_id.isnot(None))
+        .group_by(models.Book.genre_id).order_by(func.count().desc()).limit(1)
+    ).scalar()
+    author_id = db.execute(
+        select(models.Book.author_id).group_by(models.Book.author_id).order_by(func.count().desc()).limit(1)
+    ).scalar()
+    user_id = db.execute(
+        select(models.Reservation.user_id).group_by(models.Reservation.user_id)
+        .order_by(func.count().desc()).limit(1)
+    ).scalar()
+    if genre_id is None or user_id is None:
+        raise SystemExit("Needs books and reservations, load data with python -m bench.synthetic first")
+
+    reserved = select(models.Reservation.book_id).where(models.Reservation.user_id == user_id)
+    open_reservations = db.execute(
+        select(models.Reservation.id, models.Reservation.book_id)
+        .where(models.Reservation.user_id == user_id, models.Reservation.status != models.ReservationStatus.returned)
+        .limit(5)
+    ).all()
+    free_book_ids = list(db.execute(
+        select(models.Book.id).where(models.Book.count > 0, models.Book.id.not_in(reserved)).limit(5)
+    ).scalars())
+    middle = db.execute(select(models.Book).order_by(models.Book.title, models.Book.id).offset(1000).limit(1)).scalar()
+    in_genre = db.execute(
+        select(models.Book).where(models.Book.genre_id == genre_id)
+        .order_by(models.Book.title.desc(), models.Book.id.desc()).offset(50).limit(1)
+    ).scalar()
+    return {
+        "genre_id": genre_id,
+        "author_id": author_id,
+        "user_id": user_id,
+        "email": db.get(models.User, user_id).email,
+        "title_cursor": crud.encode_cursor("asc", middle),
+        "genre_cursor": crud.encode_cursor("desc", in_genre),
+        "word": middle.title.split()[0],
+        "free_book_id": free_book_ids[0],
+        "free_book_ids": free_book_ids,
+        "open_reservation_id": open_reservations[0].id,
+        "open_reservation_ids": [row.id for row in open_reservations],
+        # fails in a batch as already reserved
+        "open_book_id": open_reservations[0].book_id,
+    }
+
+
+def findings(node: dict) -> list[str]:
+    """Seq Scans and row Sorts anywhere in a JSON plan node"""
+    found = []
+    children = node.get("Plans", [])
+    if node["Node Type"] == "Seq Scan":
+        found.append(f"Seq Scan on {node['Relation Name']}")
+    elif node["Node Type"] in SORT_NODES:
+        ranks_groups = bool(children) and children[0]["Node Type"] == "Aggregate"
+        if not ranks_groups:
+            keys = [key if len(key) <= SORT_KEY_CHARS else key[:SORT_KEY_CHARS] + "..." for key in node.get("Sort Key", [])]
+            found.append(f"{node['Node Type']} by {', '.join(keys)}")
+    for child in children:
+        found += findings(child)
+    return found
+
+
+def check(conn, db: Session, case: Case, params: dict, verbose: bool) -> dict:
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().split(None, 1)[0].upper() in DML:
+            statements.append((statement, parameters))
+
+    crud.catalog_counts.clear()
+    crud.catalog_facets.clear()
+    crud.token_versions.clear()
+    event.listen(conn, "before_cursor_execute", record)
+    try:
+        case.run(db, params)
+    finally:
+        event.remove(conn, "before_cursor_execute", record)
+    db.rollback()
+
+    failures, allowed = [], []
+    for statement, parameters in statements:
+        plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+        for finding in findings(plan[0]["Plan"]):
+            reason = next((why for prefix, why in case.allow.items() if finding.startswith(prefix)), None)
+            if reason is None:
+                failures.append(finding)
+                if verbose:
+                    print(f"--- {case.name}: {finding}\n{statement}")
+                    for line in conn.exec_driver_sql("EXPLAIN " + statement, parameters).scalars():
+                        print(line)
+            else:
+                allowed.append(f"{finding} ({reason})")
+    return {"case": case.name, "statements": len(statements), "failures": failures, "allowed": allowed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verbose", action="store_true", help="print the statement and plan of every failure")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with engine.connect() as conn:
+        outer = conn.begin()
+        try:
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            conn.exec_driver_sql("SET LOCAL enable_sort = off")
+            # crud commits become savepoint releases, everything is rolled back below
+            db = Session(bind=conn, join_transaction_mode="create_savepoint")
+            params = sample(db)
+            # the server builds it in a background task; without it searches take the ILIKE fallback
+            search.build_memory_index(db)
+            db.rollback()
+            for case in CASES:
+                results.append(check(conn, db, case, params, args.verbose))
+            db.close()
+        finally:
+            outer.rollback()
+
+    failed = [r for r in results if r["failures"]]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'case':<38} {'stmts':>5}  result")
+        for r in results:
+            status = "FAIL " + "; ".join(r["failures"]) if r["failures"] else "ok"
+            print(f"{r['case']:<38} {r['statements']:5d}  {status}")
+            for note in r["allowed"]:
+                print(f"{'':<46}allowed: {note}")
+        print(f"\n{len(results) - len(failed)}/{len(results)} cases use indexes only")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
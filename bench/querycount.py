@@ -0,0 +1,54 @@
+"""
+main.app with a per-request SQL statement counter, served by bench.e2e.
+
+    uvicorn bench.querycount:app
+
+Every HTTP response carries `x-query-count`: the statements the request executed on the
+app's engines (sync and, with DB_ASYNC=1, async; with READ_DATABASE_URL the replica ones
+too). The counter lives in a context variable, which Starlette's threadpool and
+AsyncSession's greenlets both inherit; work done outside a request (event flushes, periodic
+tasks) is not counted.
+"""
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+import main
+from app.db import engine, async_engine, read_engine, async_read_engine
+
+QUERY_COUNT_HEADER = b"x-query-count"
+
+_queries: ContextVar[list[int] | None] = ContextVar("queries", default=None)
+
+
+def _count(conn, cursor, statement, parameters, context, executemany):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+_engines = {engine, read_engine}
+for _async_engine in (async_engine, async_read_engine):
+    if _async_engine is not None:
+        _engines.add(_async_engine.sync_engine)
+for _engine in _engines:
+    event.listen(_engine, "before_cursor_execute", _count)
+
+
+async def app(scope, receive, send):
+    if scope["type"] != "http":
+        await main.app(scope, receive, send)
+        return
+
+    counter = [0]
+    token = _queries.set(counter)
+
+    async def send_with_count(message):
+        if message["type"] == "http.response.start":
+            message = {**message, "headers": [*message.get("headers", []), (QUERY_COUNT_HEADER, str(counter[0]).encode())]}
+        await send(message)
+
+    try:
+        await main.app(scope, receive, send_with_count)
+    finally:
+        _queries.reset(token)
@@ -0,0 +1,172 @@
+"""
+Per-item cost of the catalog and reservation responses, ORM vs column projection.
+
+    python -m bench.serialization --repeat 200
+
+Runs in-process against DATABASE_URL / APP_DATABASE_URL, no HTTP. For every endpoint the
+crud call and the serialization are timed separately:
+
+- orm: joinedload query, then what FastAPI does with response_model (validate the objects
+  with from_attributes, dump in JSON mode, json.dumps via JSONResponse)
+- projection: column query, app.serializers row builders, FastJSONResponse rendering
+
+A bench user with --history reservations is created for the reservation endpoints and
+removed afterwards. Before timing, both modes' bodies are compared and must be identical.
+"""
+import json
+import time
+import argparse
+from datetime import date, timedelta
+
+from pydantic import TypeAdapter
+from sqlalchemy import select, delete, insert
+from starlette.responses import JSONResponse
+
+from app.db import SessionLocal
+from app import crud, models, schemas, serializers
+
+BENCH_EMAIL = "bench-serialization@example.invalid"
+
+RESERVATION_LIST = TypeAdapter(list[schemas.Reservation])
+BOOK_LIST = TypeAdapter(list[schemas.Book])
+
+
+def setup(db, history: int) -> int:
+    cleanup(db)
+    role = db.execute(select(models.Role).where(models.Role.name == "user")).scalar()
+    if role is None:
+        role = models.Role(name="user")
+        db.add(role)
+        db.flush()
+    user = models.User(name="bench", email=BENCH_EMAIL, password_hash="!", role_id=role.id)
+    db.add(user)
+    db.flush()
+
+    book_ids = db.execute(select(models.Book.id).order_by(models.Book.id).limit(history)).scalars().all()
+    if len(book_ids) < history:
+        raise SystemExit(f"Needs at least {history} books, import a catalog first")
+    today = date.today()
+    statuses = [models.ReservationStatus.active, models.ReservationStatus.overdue, models.ReservationStatus.returned]
+    db.execute(insert(models.Reservation), [
+        {
+            "book_id": book_id,
+            "user_id": user.id,
+            "reserve_date": today - timedelta(days=n),
+            "return_date": today + timedelta(days=14 - n % 20),
+            "status": statuses[n % 3],
+        }
+        for n, book_id in enumerate(book_ids)
+    ])
+    db.commit()
+    return user.id
+
+
+def cleanup(db):
+    db.execute(delete(models.User).where(models.User.email == BENCH_EMAIL))
+    db.commit()
+
+
+def render_orm(adapter: TypeAdapter, content) -> bytes:
+    value = adapter.validate_python(content, from_attributes=True)
+    return JSONResponse(adapter.dump_python(value, mode="json")).body
+
+
+def render_projection(content) -> bytes:
+    return serializers.FastJSONResponse(content).body
+
+
+def endpoints(user_id: int, page_size: int, history: int) -> dict:
+    """name -> (load(db, projection), schema adapter)"""
+    def books(db, projection):
+        return crud.get_books(db, limit=page_size, total="none", projection=projection)[0]
+
+    def books_cursor(db, projection):
+        return crud.get_books(db, limit=page_size, paging="cursor", total="none", projection=projection)[0]
+
+    def reservations(db, projection):
+        return crud.get_user_reservations(db, user_id, limit=page_size, projection=projection)
+
+    def user_history(db, projection):
+        return crud.get_user_history(db, user_id, limit=history, projection=projection)
+
+    return {
+        f"books (limit {page_size})": (books, BOOK_LIST),
+        f"books cursor (limit {page_size})": (books_cursor, BOOK_LIST),
+        f"reservations (limit {page_size})": (reservations, RESERVATION_LIST),
+        f"history (limit {history})": (user_history, RESERVATION_LIST),
+    }
+
+
+def measure(db, load, render, projection: bool, repeat: int) -> tuple[float, float, int]:
+    """(query µs, serialization µs, items), medians over `repeat` runs"""
+    query_times, render_times = [], []
+    items = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        content = load(db, projection)
+        loaded = time.perf_counter()
+        render(content)
+        query_times.append(loaded - started)
+        render_times.append(time.perf_counter() - loaded)
+        items = len(content)
+        # fresh identity map every run, like one session per request
+        db.rollback()
+        db.expunge_all()
+    query_times.sort()
+    render_times.sort()
+    return query_times[repeat // 2] * 1e6, render_times[repeat // 2] * 1e6, items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--history", type=int, default=100, help="reservations of the bench user")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    results = []
+    try:
+        user_id = setup(db, args.history)
+        for name, (load, adapter) in endpoints(user_id, args.page_size, args.history).items():
+            orm_body = render_orm(adapter, load(db, False))
+            projection_body = render_projection(load(db, True))
+            db.rollback()
+            db.expunge_all()
+            # ties in the ORDER BY may come back in another order, compare the items as a set
+            same = sorted(map(json.dumps, json.loads(orm_body))) == sorted(map(json.dumps, json.loads(projection_body)))
+            if not same:
+                raise SystemExit(f"{name}: projection body differs from the schema body")
+
+            for mode, projection, render in (
+                ("orm", False, lambda content: render_orm(adapter, content)),
+                ("projection", True, render_projection),
+            ):
+                query_us, render_us, items = measure(db, load, render, projection, args.repeat)
+                results.append({
+                    "endpoint": name,
+                    "mode": mode,
+                    "items": items,
+                    "query_us": round(query_us, 1),
+                    "serialize_us": round(render_us, 1),
+                    "total_us": round(query_us + render_us, 1),
+                    "per_item_us": round((query_us + render_us) / max(items, 1), 2),
+                })
+    finally:
+        cleanup(db)
+        db.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'endpoint':<28} {'mode':<11} {'items':>6} {'query µs':>10} {'serialize µs':>13} {'total µs':>10} {'µs/item':>8}")
+    for r in results:
+        print(
+            f"{r['endpoint']:<28} {r['mode']:<11} {r['items']:6d} {r['query_us']:10.1f} "
+            f"{r['serialize_us']:13.1f} {r['total_us']:10.1f} {r['per_item_us']:8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Before/after latency of the statistics behind /api/users/{id}/analytics/.
+
+    python -m bench.stats --seed --users 20 --iterations 200
+
+- before: the original get_user_stats, six separate aggregate queries
+- live:   crud.get_user_stats_live, one statement with CTEs and FILTER aggregates
+- rollup: crud.get_user_stats_rollup, user_stats/user_stat_buckets lookup
+
+Runs against DATABASE_URL / APP_DATABASE_URL like the app. --seed adds search events and
+returned/active reservations for a few bench users on top of whatever catalog is loaded,
+so the numbers reflect users with a real history. Live results are checked against "before".
+"""
+import argparse
+import random
+import statistics
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import select, func, delete
+
+from app.db import SessionLocal
+from app import crud, models
+from bench.common import percentile
+
+BENCH_EMAIL = "bench-stats-{}@example.invalid"
+
+
+def stats_before(db, user_id: int, period_days: int = 30):
+    cutoff = date.today() - timedelta(days=period_days)
+
+    top_genre = db.execute(
+        select(models.Genre.name)
+        .select_from(models.SearchEvents)
+        .join(models.Genre, models.SearchEvents.genre_id == models.Genre.id)
+        .where(
+            models.SearchEvents.user_id == user_id,
+            models.SearchEvents.created_at >= cutoff,
+            models.SearchEvents.genre_id.isnot(None),
+        )
+        .group_by(models.Genre.name)
+        .order_by(func.count().desc())
+        .limit(1)
+    ).scalar()
+
+    top_author = db.execute(
+        select(models.Author.name)
+        .select_from(models.SearchEvents)
+        .join(models.Author, models.SearchEvents.author_id == models.Author.id)
+        .where(
+            models.SearchEvents.user_id == user_id,
+            models.SearchEvents.created_at >= cutoff,
+            models.SearchEvents.author_id.isnot(None),
+        )
+        .group_by(models.Author.name)
+        .order_by(func.count().desc())
+        .limit(1)
+    ).scalar()
+
+    total_queries = db.execute(
+        select(func.count()).select_from(models.SearchEvents).where(models.SearchEvents.user_id == user_id)
+    ).scalar() or 0
+
+    total_read = db.execute(
+        select(func.count())
+        .select_from(models.Reservation)
+        .where(
+            models.Reservation.user_id == user_id,
+            models.Reservation.status == models.ReservationStatus.returned,
+        )
+    ).scalar() or 0
+
+    on_hand = db.execute(
+        select(func.count())
+        .select_from(models.Reservation)
+        .where(
+            models.Reservation.user_id == user_id,
+            models.Reservation.status.in_(['active', 'overdue']),
+        )
+    ).scalar() or 0
+
+    fav_genre = db.execute(
+        select(models.Genre.name)
+        .select_from(models.Reservation)
+        .join(models.Book, models.Reservation.book_id == models.Book.id)
+        .join(models.Genre, models.Book.genre_id == models.Genre.id)
+        .where(
+            models.Reservation.user_id == user_id,
+            models.Reservation.status == models.ReservationStatus.returned,
+        )
+        .group_by(models.Genre.name)
+        .order_by(func.count().desc())
+        .limit(1)
+    ).scalar()
+
+    return {
+        "top_author": top_author or "N/A",
+        "top_genre": top_genre or "N/A",
+        "total_queries": int(total_queries),
+        "total_read": int(total_read),
+        "on_hand": int(on_hand),
+        "fav_genre": fav_genre or "N/A",
+    }
+
+
+VARIANTS = {
+    "before": stats_before,
+    "live": crud.get_user_stats_live,
+    "rollup": crud.get_user_stats_rollup,
+}
+
+
+def seed(db, users: int, events_per_user: int, loans_per_user: int, rng: random.Random) -> list[int]:
+    """Creates bench users with search and loan history, returns their ids"""
+    books = db.execute(select(models.Book.id, models.Book.genre_id, models.Book.author_id).limit(5000)).all()
+    if not books:
+        raise SystemExit("No books in the database, import a catalog first")
+
+    role = db.execute(select(models.Role).where(models.Role.name == "user")).scalar()
+    if role is None:
+        role = models.Role(name="user")
+        db.add(role)
+        db.flush()
+
+    user_ids = []
+    for n in range(users):
+        user = models.User(name=f"bench {n}", email=BENCH_EMAIL.format(n), password_hash="!", role_id=role.id)
+        db.add(user)
+        db.flush()
+        user_ids.append(user.id)
+
+        events = []
+        for _ in range(events_per_user):
+            _, genre_id, author_id = rng.choice(books)
+            events.append({
+                "user_id": user.id,
+                "genre_id": genre_id if rng.random() < 0.6 else None,
+                "author_id": author_id if rng.random() < 0.4 else None,
+                "query_text": None,
+                "created_at": date.today() - timedelta(days=rng.randint(0, 365)),
+            })
+        # goes through the same path as the app so the rollups are populated too
+        crud.record_search_events(db, events)
+
+        for book_id, genre_id, _ in rng.sample(books, min(loans_per_user, len(books))):
+            returned = rng.random() < 0.8
+            reserve_date = date.today() - timedelta(days=rng.randint(10, 365))
+            db.add(models.Reservation(
+                book_id=book_id, user_id=user.id, reserve_date=reserve_date,
+                return_date=reserve_date + timedelta(days=14),
+                status=models.ReservationStatus.returned if returned else models.ReservationStatus.active
+            ))
+            crud._bump_user_stats(db, {user.id: {"total_read": 1} if returned else {"on_hand": 1}})
+            if returned and genre_id is not None:
+                crud._bump_stat_buckets(db, Counter({
+                    (user.id, reserve_date + timedelta(days=14), models.StatKind.read_genre, genre_id): 1
+                }))
+        db.commit()
+    return user_ids
+
+
+def cleanup(db):
+    db.execute(delete(models.User).where(models.User.email.like(BENCH_EMAIL.format("%"))))
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", action="store_true", help="create bench users with history first")
+    parser.add_argument("--keep", action="store_true", help="keep seeded users afterwards")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--events", type=int, default=2000, help="search events per seeded user")
+    parser.add_argument("--loans", type=int, default=100, help="reservations per seeded user")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--period-days", type=int, default=30)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    db = SessionLocal()
+    try:
+        if args.seed:
+            cleanup(db)
+            user_ids = seed(db, args.users, args.events, args.loans, rng)
+        else:
+            user_ids = db.execute(
+                select(models.SearchEvents.user_id)
+                .group_by(models.SearchEvents.user_id)
+                .order_by(func.count().desc())
+                .limit(args.users)
+            ).scalars().all()
+        if not user_ids:
+            raise SystemExit("No users with search history, run with --seed")
+
+        mismatches = 0
+        for user_id in user_ids:
+            if stats_before(db, user_id, args.period_days) != crud.get_user_stats_live(db, user_id, args.period_days):
+                mismatches += 1
+
+        print(f"{len(user_ids)} users, {args.iterations} calls per variant, live/before mismatches: {mismatches} (ties in top genre/author may pick either)")
+        print(f"{'variant':<8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, fn in VARIANTS.items():
+            samples = []
+            for i in range(args.iterations):
+                user_id = user_ids[i % len(user_ids)]
+                started = time.perf_counter()
+                fn(db, user_id, args.period_days)
+                samples.append((time.perf_counter() - started) * 1000)
+                db.rollback()
+            print(
+                f"{name:<8} {statistics.fmean(samples):9.2f} {percentile(samples, 50):9.2f} "
+                f"{percentile(samples, 95):9.2f} {percentile(samples, 99):9.2f}"
+            )
+    finally:
+        if args.seed and not args.keep:
+            cleanup(db)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
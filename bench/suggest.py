@@ -0,0 +1,96 @@
+"""
+Typeahead lookup latency of the in-memory suggestion index (app.suggest).
+
+    python -m bench.suggest --queries 2000
+    python -m bench.suggest --compare 100    # also time the catalog search for the same prefixes
+
+Builds the index from DATABASE_URL / APP_DATABASE_URL in-process, reports build time and the
+index size, then times SuggestIndex.suggest for prefixes of every length from 1 to --max-length
+characters taken from random word starts of the indexed titles and authors. --compare N runs
+the first N of those prefixes through crud.get_books(search=...), the query a search box
+without /api/suggest would send on every keystroke. Exits non-zero if the p99 lookup of any
+prefix length exceeds --budget-us.
+"""
+import json
+import time
+import random
+import argparse
+
+from app.db import SessionLocal
+from app import crud
+from app.suggest import SuggestIndex
+
+
+def percentile(times: list[float], fraction: float) -> float:
+    return times[min(len(times) - 1, int(len(times) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=2000, help="prefixes per length")
+    parser.add_argument("--max-length", type=int, default=6)
+    parser.add_argument("--limit", type=int, default=8)
+    parser.add_argument("--compare", type=int, default=0, help="prefixes per length also timed through crud.get_books")
+    parser.add_argument("--budget-us", type=float, default=1000.0, help="p99 lookup budget")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    index = SuggestIndex()
+    with SessionLocal() as db:
+        index.build(db)
+    if not index.stats["entries"]:
+        raise SystemExit("Nothing to index, import a catalog or load python -m bench.synthetic first")
+    snapshot = index._snapshot
+    rng = random.Random(args.seed)
+    starts = [snapshot.keys[rng.randrange(len(snapshot.keys))] for _ in range(args.queries)]
+
+    results = []
+    for length in range(1, args.max_length + 1):
+        prefixes = [snapshot.text[start:start + length] for start in starts]
+        times, matched = [], 0
+        for prefix in prefixes:
+            started = time.perf_counter()
+            found = index.suggest(prefix, args.limit)
+            times.append(time.perf_counter() - started)
+            matched += len(found)
+        times.sort()
+        result = {
+            "length": length,
+            "p50_us": round(percentile(times, 0.5) * 1e6, 1),
+            "p99_us": round(percentile(times, 0.99) * 1e6, 1),
+            "max_us": round(times[-1] * 1e6, 1),
+            "avg_results": round(matched / len(prefixes), 2),
+        }
+        if args.compare:
+            search_times = []
+            with SessionLocal() as db:
+                for prefix in prefixes[:args.compare]:
+                    started = time.perf_counter()
+                    crud.get_books(db, limit=args.limit, search=prefix, total="none", projection=True)
+                    search_times.append(time.perf_counter() - started)
+                    db.rollback()
+            search_times.sort()
+            result["search_p50_us"] = round(percentile(search_times, 0.5) * 1e6, 1)
+        results.append(result)
+
+    over_budget = [r for r in results if r["p99_us"] > args.budget_us]
+    if args.json:
+        print(json.dumps({"index": index.stats, "lookups": results}, indent=2))
+    else:
+        stats = index.stats
+        print(
+            f"{stats['entries']:,} entries, {stats['keys']:,} keys, {stats['memory_bytes'] / 1e6:.1f} MB, "
+            f"built in {stats['last_build_seconds']:.2f}s\n"
+        )
+        header = f"{'prefix':>6} {'p50 µs':>9} {'p99 µs':>9} {'max µs':>9} {'results':>8}"
+        print(header + (f" {'search p50 µs':>14}" if args.compare else ""))
+        for r in results:
+            line = f"{r['length']:6d} {r['p50_us']:9.1f} {r['p99_us']:9.1f} {r['max_us']:9.1f} {r['avg_results']:8.2f}"
+            print(line + (f" {r['search_p50_us']:14.1f}" if args.compare else ""))
+    if over_budget:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Deterministic synthetic dataset for benchmarks, no network or Kaggle account needed.
+
+    python -m bench.synthetic --reset --books 100000 --users 1000 --seed 42
+
+Loads genres, authors, books, users, reservations and search events into DATABASE_URL /
+APP_DATABASE_URL with COPY, then fills the analytics rollups like the backfill of migration
+b7d24e0c6a13, moves search events into monthly partitions (app.partitions, retention
+included), bumps catalog_version and runs ANALYZE. The same arguments always produce the
+same rows (dates relative to the day of the run), so runs on different machines or commits
+are comparable.
+
+- titles and names are built from a fixed pseudo-word vocabulary, drawn with a Zipf-like
+  skew so search terms have realistic selectivity;
+- reservations favour popular books and heavy readers, loans older than their due date are
+  mostly returned, the rest overdue; at most one reservation per user and book, like the API;
+- every user's password is SYNTHETIC_PASSWORD and their e-mail SYNTHETIC_EMAIL.format(n)
+  for n = 1..--users, which is how bench.e2e logs in.
+
+The target must be empty; --reset truncates users, catalog and history first (roles stay).
+"""
+import time
+import random
+import argparse
+from bisect import bisect
+from datetime import date, timedelta
+from itertools import accumulate
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from app.db import engine
+from app.models import Role, catalog_version
+from app.partitions import maintain_search_events
+from app.hashing import password_hash
+
+SYNTHETIC_EMAIL = "synthetic-{}@example.invalid"
+SYNTHETIC_PASSWORD = "synthetic-password"
+
+TABLES = ("genres", "authors", "books", "users", "reservations", "search_events")
+ROLLUP_TABLES = ("user_stats", "user_stat_buckets", "search_event_days")
+
+GENRES = [
+    "Fantasy", "Science Fiction", "Mystery", "Thriller", "Romance", "Historical Fiction",
+    "Horror", "Biography", "History", "Poetry", "Drama", "Philosophy", "Psychology",
+    "Economics", "Politics", "Travel", "Cooking", "Art", "Music", "Religion", "Science",
+    "Mathematics", "Computers", "Medicine", "Law", "Education", "Children's Books",
+    "Young Adult", "Comics", "Sports",
+]
+
+SYLLABLES = [
+    "ka", "lo", "mi", "ren", "sa", "tor", "vel", "an", "dra", "el", "fin", "gar", "hal",
+    "is", "jo", "kel", "lum", "mor", "nia", "or", "pe", "quin", "ra", "sil", "ta", "ul",
+    "ve", "wyn", "xa", "yor", "zed", "bri", "cor", "dun", "est", "fal",
+]
+
+# the backfill of migration b7d24e0c6a13, user_stats grouped in one pass instead of
+# correlated counts per user
+ROLLUP_BACKFILL = [
+    """
+    INSERT INTO user_stats (user_id, total_queries, total_read, on_hand)
+    SELECT u.id, COALESCE(e.total_queries, 0), COALESCE(r.total_read, 0), COALESCE(r.on_hand, 0)
+    FROM users u
+    LEFT JOIN (
+        SELECT user_id, count(*) AS total_queries FROM search_events GROUP BY user_id
+    ) e ON e.user_id = u.id
+    LEFT JOIN (
+        SELECT user_id,
+               count(*) FILTER (WHERE status = 'returned') AS total_read,
+               count(*) FILTER (WHERE status IN ('active', 'overdue')) AS on_hand
+        FROM reservations GROUP BY user_id
+    ) r ON r.user_id = u.id
+    """,
+    """
+    INSERT INTO user_stat_buckets (user_id, day, kind, ref_id, count)
+    SELECT user_id, created_at, 'search_genre', genre_id, count(*)
+    FROM search_events WHERE genre_id IS NOT NULL
+    GROUP BY user_id, created_at, genre_id
+    """,
+    """
+    INSERT INTO user_stat_buckets (user_id, day, kind, ref_id, count)
+    SELECT user_id, created_at, 'search_author', author_id, count(*)
+    FROM search_events WHERE author_id IS NOT NULL
+    GROUP BY user_id, created_at, author_id
+    """,
+    """
+    INSERT INTO user_stat_buckets (user_id, day, kind, ref_id, count)
+    SELECT r.user_id, COALESCE(r.return_date, r.reserve_date), 'read_genre', b.genre_id, count(*)
+    FROM reservations r JOIN books b ON b.id = r.book_id
+    WHERE r.status = 'returned' AND b.genre_id IS NOT NULL
+    GROUP BY r.user_id, COALESCE(r.return_date, r.reserve_date), b.genre_id
+    """,
+]
+
+
+class Skewed:
+    """Draws ids 1..n with weight 1 / rank**exponent, ranks shuffled so popularity is not id order"""
+
+    def __init__(self, rng: random.Random, n: int, exponent: float = 0.8):
+        ranks = list(range(1, n + 1))
+        rng.shuffle(ranks)
+        self.rng = rng
+        self.cum_weights = list(accumulate(1 / rank ** exponent for rank in ranks))
+
+    def draw(self) -> int:
+        return bisect(self.cum_weights, self.rng.random() * self.cum_weights[-1]) + 1
+
+
+def make_vocabulary(rng: random.Random, size: int) -> list[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))))
+    return sorted(words)
+
+
+class Generator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.today = date.today()
+        self.words = make_vocabulary(self.rng, 3000)
+        self.word_pick = Skewed(self.rng, len(self.words), exponent=1.0)
+
+    def word(self) -> str:
+        return self.words[self.word_pick.draw() - 1]
+
+    def genres(self):
+        for n in range(1, self.args.genres + 1):
+            base = GENRES[(n - 1) % len(GENRES)]
+            yield n, base if n <= len(GENRES) else f"{base} {n // len(GENRES) + 1}"
+
+    def authors(self):
+        for n in range(1, self.args.authors + 1):
+            yield n, f"{self.word().capitalize()} {self.word().capitalize()}"
+
+    def books(self):
+        author_pick = Skewed(self.rng, self.args.authors)
+        genre_pick = Skewed(self.rng, self.args.genres, exponent=0.6)
+        for n in range(1, self.args.books + 1):
+            title = " ".join(self.word() for _ in range(self.rng.randint(1, 5))).capitalize()
+            genre_id = genre_pick.draw() if self.rng.random() < 0.95 else None
+            yield n, title, f"978{n:010d}", author_pick.draw(), genre_id, self.rng.randint(0, 10)
+
+    def users(self, role_id: int, hashed: str):
+        for n in range(1, self.args.users + 1):
+            yield n, f"Reader {n}", SYNTHETIC_EMAIL.format(n), hashed, role_id
+
+    def reservations(self):
+        book_pick = Skewed(self.rng, self.args.books)
+        user_pick = Skewed(self.rng, self.args.users, exponent=0.5)
+        # every user can hold each book once, never ask for more pairs than exist
+        target = min(self.args.reservations, self.args.users * self.args.books // 2)
+        seen = set()
+        n = 0
+        while n < target:
+            pair = user_pick.draw(), book_pick.draw()
+            if pair in seen:
+                continue
+            seen.add(pair)
+            n += 1
+
+            reserve_date = self.today - timedelta(days=self.rng.randint(0, self.args.days))
+            return_date = reserve_date + timedelta(days=self.rng.choice((7, 14, 14, 30)))
+            if return_date >= self.today:
+                status = "active"
+            else:
+                status = "returned" if self.rng.random() < 0.9 else "overdue"
+            yield n, pair[1], pair[0], reserve_date, return_date, status
+
+    def search_events(self):
+        user_pick = Skewed(self.rng, self.args.users, exponent=0.5)
+        author_pick = Skewed(self.rng, self.args.authors)
+        genre_pick = Skewed(self.rng, self.args.genres, exponent=0.6)
+        for n in range(1, self.args.search_events + 1):
+            kind = self.rng.random()
+            genre_id = genre_pick.draw() if kind < 0.5 else None
+            author_id = author_pick.draw() if 0.4 < kind < 0.7 else None
+            query_text = " ".join(self.word() for _ in range(self.rng.randint(1, 2))) if kind >= 0.7 else None
+            created_at = self.today - timedelta(days=self.rng.randint(0, self.args.days))
+            yield n, user_pick.draw(), genre_id, author_id, query_text, created_at
+
+
+def copy_rows(conn, table: str, columns: tuple[str, ...], rows) -> int:
+    cursor = conn.connection.driver_connection.cursor()
+    count = 0
+    with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--authors", type=int, default=20_000)
+    parser.add_argument("--genres", type=int, default=30)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--reservations", type=int, default=200_000)
+    parser.add_argument("--search-events", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=365, help="history spans this many days back from today")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="truncate users, catalog and history first")
+    args = parser.parse_args()
+    if min(args.books, args.authors, args.genres, args.users) < 1:
+        raise SystemExit("--books, --authors, --genres and --users must be at least 1")
+
+    generator = Generator(args)
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        with conn.begin():
+            if args.reset:
+                conn.exec_driver_sql(f"TRUNCATE {', '.join(TABLES + ROLLUP_TABLES)} RESTART IDENTITY CASCADE")
+            elif conn.exec_driver_sql("SELECT EXISTS (SELECT 1 FROM books) OR EXISTS (SELECT 1 FROM users)").scalar():
+                raise SystemExit("The database already has books or users, pass --reset to replace them")
+
+            role_id = conn.execute(select(Role.id).where(Role.name == "user")).scalar()
+            if role_id is None:
+                role_id = conn.execute(text("INSERT INTO roles (name) VALUES ('user') RETURNING id")).scalar()
+            # one hash for everybody, argon2 per user would dominate the load time
+            hashed = password_hash.hash(SYNTHETIC_PASSWORD)
+
+            loads = [
+                ("genres", ("id", "name"), generator.genres()),
+                ("authors", ("id", "name"), generator.authors()),
+                ("books", ("id", "title", "isbn", "author_id", "genre_id", "count"), generator.books()),
+                ("users", ("id", "name", "email", "password_hash", "role_id"), generator.users(role_id, hashed)),
+                ("reservations", ("id", "book_id", "user_id", "reserve_date", "return_date", "status"),
+                 generator.reservations()),
+                ("search_events", ("id", "user_id", "genre_id", "author_id", "query_text", "created_at"),
+                 generator.search_events()),
+            ]
+            for table, columns, rows in loads:
+                table_started = time.perf_counter()
+                count = copy_rows(conn, table, columns, rows)
+                # ids were given explicitly, move the serial past them
+                conn.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST((SELECT max(id) FROM {table}), 1))"
+                )
+                print(f"{table}: {count:,} rows in {time.perf_counter() - table_started:.1f}s")
+
+            for statement in ROLLUP_BACKFILL:
+                conn.exec_driver_sql(statement)
+            conn.execute(select(catalog_version.next_value()))
+
+        # the events went to the default partition, split them by month like the server task would
+        with Session(bind=conn) as db:
+            compacted = maintain_search_events(db)
+        print(f"search_events: partitioned, {compacted:,} events past retention compacted")
+
+        with conn.begin():
+            conn.exec_driver_sql(f"ANALYZE {', '.join(TABLES + ROLLUP_TABLES)}")
+
+    print(f"Done in {time.perf_counter() - started:.1f}s (seed {args.seed}), log in as "
+          f"{SYNTHETIC_EMAIL.format(1)} .. {SYNTHETIC_EMAIL.format(args.users)} / {SYNTHETIC_PASSWORD}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,32 @@
-from typing import Annotated
+from typing import Annotated, Literal
+from contextlib import asynccontextmanager
 from datetime import timedelta
 
 import jwt
 from jwt.exceptions import InvalidTokenError
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import FileResponse
-from datetime import timedelta, timezone, datetime
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from datetime import timedelta
 
 from sqlalchemy.orm import Session
-from app import crud, models, schemas
-from app.db import SessionLocal, engine
+from app import crud, acrud, models, schemas
+from app.db import (
+    SessionLocal, AsyncSessionLocal, ReadSessionLocal, AsyncReadSessionLocal, DB_ASYNC,
+    engine, async_engine, async_read_engine, note_write, reads_from_primary
+)
+from app.events import search_events
+from app.cache import CachedBody, etag_matches
+from app.hashing import hasher, HashPoolBusy
+from app.tasks import tasks
+from app.covers import CoverFiles, COVER_VARIANTS_DIR, COVER_URL_PREFIX
+from app.serializers import FastJSONResponse, PROJECTION, to_json
+from app.availability import hub as availability, AVAILABILITY_MAX_BOOKS, AVAILABILITY_HEARTBEAT
+from app.suggest import suggestions, SUGGEST_LIMIT, SUGGEST_MAX_LIMIT
+from app import metrics
 
 import os
 from dotenv import load_dotenv
@@ -21,17 +35,81 @@ load_dotenv()
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 SECRET_KEY = os.getenv("SECRET_KEY", "secret")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
+# "claims" builds the current user from the token, "db" loads it on every request
+AUTH_MODE = os.getenv("AUTH_MODE", "claims")
+CLAIM_FIELDS = {"name", "email", "role"}
+# browser cache lifetime for /api/genres/ and /api/authors/, revalidated with the ETag afterwards
+REFERENCE_MAX_AGE = int(os.getenv("REFERENCE_MAX_AGE", "60"))
+BOOKS_PAGE_SIZE = 8
+# build the first catalog pages (every sort, every genre) before serving traffic
+CATALOG_CACHE_WARM = os.getenv("CATALOG_CACHE_WARM", "0").lower() in ("1", "true", "yes")
 
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+
+def warm_catalog_cache():
+    db = SessionLocal()
+    try:
+        crud.warm_catalog_pages(db, limit=BOOKS_PAGE_SIZE)
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if CATALOG_CACHE_WARM:
+        await run_in_threadpool(warm_catalog_cache)
+    hasher.start()
+    search_events.start()
+    for task in tasks:
+        task.start()
+    yield
+    for task in tasks:
+        task.stop()
+    search_events.stop()
+    hasher.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+    if async_read_engine is not None and async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.register_component("genres_cache", lambda: crud.genres_cache.stats)
+    metrics.register_component("authors_cache", lambda: crud.authors_cache.stats)
+    metrics.register_component("catalog_pages", lambda: {
+        **crud.catalog_pages.stats, "hit_rate": crud.catalog_pages.hit_rate(), "entries": len(crud.catalog_pages)})
+    metrics.register_component("catalog_counts", lambda: {
+        **crud.catalog_counts.stats, "entries": len(crud.catalog_counts)})
+    metrics.register_component("token_versions", lambda: {
+        **crud.token_versions.stats, "entries": len(crud.token_versions)})
+    metrics.register_component("password_hasher", lambda: {
+        **hasher.stats, "queue_depth": hasher.queue_depth(), "in_flight": hasher.in_flight()})
+    metrics.register_component("search_events", lambda: {
+        **search_events.stats, "queue_depth": search_events.queue_depth()})
+    metrics.register_component("availability", lambda: {
+        **availability.stats, "subscribers": availability.subscribers()})
+    metrics.register_component("suggest", lambda: suggestions.stats)
+    for task in tasks:
+        metrics.register_component(f"task_{task.name}", lambda task=task: task.stats)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+hash_pool_busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many login attempts in progress, try again shortly",
+    headers={"Retry-After": "1"},
+)
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
+# resized, content-hashed covers from scripts/covers.py; the directory may not exist before the first run
+app.mount(COVER_URL_PREFIX, CoverFiles(directory=COVER_VARIANTS_DIR, check_dir=False), name="covers")
 # app.mount("/dataset", StaticFiles(directory="data/dataset"), name="dataset")
 
-def get_db():
+def get_sync_db():
     db = SessionLocal()
     try:
         yield db
@@ -39,6 +117,31 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+get_db = get_async_db if DB_ASYNC else get_sync_db
+
+
+def get_sync_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+# READ_DATABASE_URL when set, otherwise the same sessions as get_db
+get_read_db = get_async_read_db if DB_ASYNC else get_sync_read_db
+
+
 async def get_current_user(
         token: Annotated[str, Depends(oauth2_scheme)],
         db: Session = Depends(get_db)
@@ -59,15 +162,46 @@ async def get_current_user(
         token_data = schemas.TokenData(user_id=user_id_from_token)
     except InvalidTokenError as e:
         raise credentials_exception
+
+    if "ver" in payload:
+        # revoked tokens fail here; the version is cached, so this is usually not a query
+        if await acrud.get_token_version(db, token_data.user_id) != payload["ver"]:
+            raise credentials_exception
+
+        if AUTH_MODE == "claims" and CLAIM_FIELDS <= payload.keys():
+            return schemas.User(
+                id=token_data.user_id,
+                name=payload["name"],
+                email=payload["email"],
+                role=schemas.Role(name=payload["role"])
+            )
     
-    user = crud.get_user(db, user_id=token_data.user_id)
+    user = await acrud.get_user(db, user_id=token_data.user_id)
     if user is None:
         raise credentials_exception
     return user
 
 
+def get_sync_user_read_db(current_user: Annotated[schemas.User, Depends(get_current_user)]):
+    db = SessionLocal() if reads_from_primary(current_user.id) else ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_user_read_db(current_user: Annotated[schemas.User, Depends(get_current_user)]):
+    session_factory = AsyncSessionLocal if reads_from_primary(current_user.id) else AsyncReadSessionLocal
+    async with session_factory() as db:
+        yield db
+
+
+# like get_read_db, but a user who just reserved or returned a book reads from the primary
+get_user_read_db = get_async_user_read_db if DB_ASYNC else get_sync_user_read_db
+
+
 @app.get("/api/users/{user_id}", response_model=schemas.User)
-def read_user(
+async def read_user(
     user_id: int,
     current_user: Annotated[schemas.User, Depends(get_current_user)],
     db: Session = Depends(get_db)
@@ -75,64 +209,148 @@ def read_user(
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    db_user = crud.get_user(db, user_id=user_id)
+    db_user = await acrud.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 
 @app.get("/api/books/", response_model=schemas.BookPage)
-def read_books(
+async def read_books(
+    request: Request,
     current_user: Annotated[schemas.User, Depends(get_current_user)],
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_user_read_db),
     skip: int = 0,
-    limit: int = 8,
+    limit: int = BOOKS_PAGE_SIZE,
     genre_id: int | None = None,
     author_id: int | None = None,
     search: str | None = None,
-    sort: str | None = None
+    sort: str | None = None,
+    paging: Literal["offset", "cursor"] = "offset",
+    cursor: str | None = None,
+    total: Literal["exact", "estimate", "none"] = "exact",
+    facets: Annotated[int, Query(ge=0, le=crud.CATALOG_FACETS_MAX)] = 0
     ):
 
-    books, total_items = crud.get_books(
-        db, skip=skip, limit=limit, genre_id=genre_id,
-        author_id=author_id, search=search, sort=sort)
-    
     if genre_id or author_id or search:
-        analytics = models.SearchEvents(
+        await search_events.add_async(
             user_id=current_user.id,
             genre_id=genre_id,
             author_id=author_id,
-            query_text=search,
-            created_at=datetime.now(timezone.utc)
+            query_text=search
         )
-        db.add(analytics)
-        db.commit()
 
-    return {"items": books, "total_items": total_items, "skip": skip, "limit": limit}
+    if paging == "offset":
+        # stock counts change on every reservation, so browsers must revalidate each time
+        page = await acrud.get_book_page(
+            db, skip=skip, limit=limit, genre_id=genre_id,
+            author_id=author_id, search=search, sort=sort, total=total, facets=facets)
+        return cached_json_response(request, page, cache_control="private, no-cache")
+
+    try:
+        books, total_items, total_exact, next_cursor = await acrud.get_books(
+            db, skip=skip, limit=limit, genre_id=genre_id,
+            author_id=author_id, search=search, sort=sort,
+            paging=paging, cursor=cursor, total=total, projection=PROJECTION)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    page = {
+        "items": books, "total_items": total_items, "total_exact": total_exact, "skip": skip,
+        "limit": limit, "next_cursor": next_cursor,
+        "facets": await acrud.get_facets(db, genre_id, author_id, search, facets) if facets else None
+    }
+    if PROJECTION:
+        return FastJSONResponse(page)
+    return page
+
+
+@app.get("/api/suggest", response_model=list[schemas.Suggestion])
+async def suggest(
+    current_user: Annotated[schemas.User, Depends(get_current_user)],
+    q: Annotated[str, Query(max_length=100)],
+    limit: Annotated[int, Query(ge=1, le=SUGGEST_MAX_LIMIT)] = SUGGEST_LIMIT
+):
+    """Titles and authors with a word starting with q, most borrowed first; answered from memory on the event loop"""
+    return FastJSONResponse(suggestions.suggest(q, limit))
+
+
+def sse_message(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + to_json(data) + b"\n\n"
+
+
+@app.get("/api/books/availability/stream")
+async def stream_availability(
+    current_user: Annotated[schemas.User, Depends(get_current_user)],
+    ids: Annotated[list[int], Query()],
+    db: Session = Depends(get_user_read_db)
+):
+    """
+    Server-sent events with the stock of the given books: a "snapshot" of their counts, then
+    an "availability" message with [{book_id, count, delta}] whenever reservations change them
+    """
+    book_ids = list(dict.fromkeys(ids))
+    if len(book_ids) > AVAILABILITY_MAX_BOOKS:
+        raise HTTPException(status_code=400, detail=f"At most {AVAILABILITY_MAX_BOOKS} books per stream")
+
+    # subscribed before the snapshot is read, so no change falls between the two
+    subscription = availability.subscribe(book_ids)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many availability streams", headers={"Retry-After": "5"})
+    try:
+        counts = await acrud.get_book_counts(db, book_ids)
+    except BaseException:
+        availability.unsubscribe(subscription)
+        raise
+
+    async def messages():
+        try:
+            yield sse_message("snapshot", [{"book_id": book_id, "count": count} for book_id, count in counts.items()])
+            while True:
+                changes = await subscription.changes(AVAILABILITY_HEARTBEAT)
+                yield sse_message("availability", changes) if changes else b": keep-alive\n\n"
+        finally:
+            # also runs when Starlette cancels the stream because the client went away
+            availability.unsubscribe(subscription)
+
+    return StreamingResponse(
+        messages(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/api/users/{user_id}/reservations/", response_model=list[schemas.Reservation])
-def read_user_reservations(
+async def read_user_reservations(
     user_id: int,
     current_user: Annotated[schemas.User, Depends(get_current_user)],
     db: Session = Depends(get_db)
 ):
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Access denied")
-    reservations = crud.get_user_reservations(db, user_id=user_id)
+    reservations = await acrud.get_user_reservations(db, user_id=user_id, projection=PROJECTION)
+    if PROJECTION:
+        return FastJSONResponse(reservations)
     return reservations
 
 
+def cached_json_response(request: Request, entry: CachedBody, cache_control: str | None = None) -> Response:
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": cache_control or f"public, max-age={REFERENCE_MAX_AGE}, must-revalidate",
+    }
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
 @app.get("/api/genres/", response_model=list[schemas.Genre])
-def read_genres(db: Session = Depends(get_db)):
-    genres = crud.get_genres(db)
-    return genres
+async def read_genres(request: Request, db: Session = Depends(get_read_db)):
+    return cached_json_response(request, await acrud.get_cached(crud.genres_cache, db))
 
 
 @app.get("/api/authors/", response_model=list[schemas.Author])
-def read_authors(db: Session = Depends(get_db)):
-    authors = crud.get_authors(db)
-    return authors
+async def read_authors(request: Request, db: Session = Depends(get_read_db)):
+    return cached_json_response(request, await acrud.get_cached(crud.authors_cache, db))
 
 
 @app.get("/api/me", response_model=schemas.User)
@@ -141,11 +359,14 @@ def read_users_me(current_user: Annotated[schemas.User, Depends(get_current_user
 
 
 @app.post("/token", response_model=schemas.Token)
-def login(
+async def login(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     db: Session = Depends(get_db)
     ) -> schemas.Token:
-    user = crud.authenticate_user(db, form_data.username, form_data.password)
+    try:
+        user = await acrud.authenticate_user(db, form_data.username, form_data.password)
+    except HashPoolBusy:
+        raise hash_pool_busy_exception
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -154,17 +375,30 @@ def login(
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = crud.create_access_token(
-        data={"sub": user.id}, expires_delta=access_token_expires
+        data=crud.user_claims(user), expires_delta=access_token_expires
     )
     return schemas.Token(access_token=access_token, token_type="bearer")
 
 
+@app.post("/api/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    current_user: Annotated[schemas.User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+    ):
+    """Signs the user out on every device: bumps token_version, so all issued tokens fail"""
+    await acrud.revoke_user_tokens(db, current_user.id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
 @app.post("/api/register", response_model=schemas.User)
-def register(user_data: schemas.UserRegister, db: Session = Depends(get_db)):
-    existing_user = crud.get_user_by_email(db, user_data.email)
+async def register(user_data: schemas.UserRegister, db: Session = Depends(get_db)):
+    existing_user = await acrud.get_user_by_email(db, user_data.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = crud.create_user(db, user_data)
+    try:
+        user = await acrud.create_user(db, user_data)
+    except HashPoolBusy:
+        raise hash_pool_busy_exception
     return user
 
 
@@ -173,13 +407,19 @@ def index():
     return FileResponse(path="static/index.html")
 
 
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def read_metrics():
+        return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # @app.get("/login")
 # def login_page():
 #     return FileResponse(path="static/login.html")
 
 
 @app.post("/api/reservations/", response_model=schemas.Reservation)
-def create_loan(
+async def create_loan(
     reservation: schemas.ReservationCreate,
     current_user: Annotated[schemas.User, Depends(get_current_user)],
     db: Session = Depends(get_db)
@@ -187,54 +427,99 @@ def create_loan(
     if current_user.id != reservation.user_id:
         raise HTTPException(status_code=403, detail="Cannot reserve for another user")
     
-    new_reservation = crud.create_reservation(db, reservation_data=reservation)
+    new_reservation = await acrud.create_reservation(db, reservation_data=reservation)
     if not new_reservation:
         raise HTTPException(status_code=400, detail="Cannot create reservation")
+    note_write(current_user.id)
     return new_reservation
 
 
 @app.patch("/api/reservations/{reservation_id}/return", response_model=schemas.Reservation)
-def return_loan(
+async def return_loan(
     reservation_id: int,
     current_user: Annotated[schemas.User, Depends(get_current_user)],
     db: Session = Depends(get_db)
 ):
-    reservation = db.query(models.Reservation).filter(models.Reservation.id == reservation_id).first()
+    reservation = await acrud.get_reservation(db, reservation_id)
     if not reservation:
         raise HTTPException(status_code=404, detail="Reservation not found")
     if reservation.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Cannot return another user's reservation")
 
-    result = crud.return_reservation(db, reservation_id)
+    result = await acrud.return_reservation(db, reservation_id)
     if not result:
         raise HTTPException(status_code=400, detail="Cannot return this reservation")
+    note_write(current_user.id)
+    return result
+
+
+def batch_response(items: list[dict]) -> schemas.ReservationBatch:
+    succeeded = sum(item["ok"] for item in items)
+    return schemas.ReservationBatch(
+        items=[schemas.ReservationBatchItem.model_validate(item) for item in items],
+        succeeded=succeeded,
+        failed=len(items) - succeeded
+    )
+
+
+@app.post("/api/reservations/batch", response_model=schemas.ReservationBatch)
+async def create_loans(
+    batch: schemas.ReservationBatchCreate,
+    current_user: Annotated[schemas.User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    """Reserves every available book of the list in one transaction, the rest fail per item"""
+    if current_user.id != batch.user_id:
+        raise HTTPException(status_code=403, detail="Cannot reserve for another user")
+
+    items = await acrud.create_reservations(db, batch.user_id, batch.book_ids, batch.return_date)
+    result = batch_response(items)
+    if result.succeeded:
+        note_write(current_user.id)
+    return result
+
+
+@app.post("/api/reservations/batch/return", response_model=schemas.ReservationBatch)
+async def return_loans(
+    batch: schemas.ReservationBatchReturn,
+    current_user: Annotated[schemas.User, Depends(get_current_user)],
+    db: Session = Depends(get_db)
+):
+    """Returns the user's reservations of the list in one transaction, the rest fail per item"""
+    items = await acrud.return_reservations(db, current_user.id, batch.reservation_ids)
+    result = batch_response(items)
+    if result.succeeded:
+        note_write(current_user.id)
     return result
 
 
 @app.get("/api/users/{user_id}/history/", response_model=list[schemas.Reservation])
-def read_user_history(
+async def read_user_history(
     user_id: int,
     current_user: Annotated[schemas.User, Depends(get_current_user)],
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_user_read_db)
 ):
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    result = crud.get_user_history(db, user_id)
+    result = await acrud.get_user_history(db, user_id, projection=PROJECTION)
     if result is None:
         raise HTTPException(status_code=400, detail="Cannot return this user history")
+    if PROJECTION:
+        return FastJSONResponse(result)
     return result
 
 @app.get("/api/users/{user_id}/analytics/", response_model=schemas.Statistics)
-def read_user_stats(
+async def read_user_stats(
     user_id: int,
     current_user: Annotated[schemas.User, Depends(get_current_user)],
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    period_days: int = 30
 ):
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    result = crud.get_user_stats(db, user_id)
+    result = await acrud.get_user_stats(db, user_id, period_days=period_days)
     if not result:
         raise HTTPException(status_code=400, detail="Cannot return this user history")
     return result
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Renders resized cover variants for the catalog.
+
+    python -m scripts.covers --source static/covers --workers 4
+
+For every book with a cover_path and no cover_variants yet, the original is scaled down to
+each of app.covers.COVER_SIZES and encoded in each of COVER_FORMATS (AVIF is skipped if this
+Pillow build cannot write it). Files are named after the SHA-256 of their bytes, sharded
+by the first two hex digits (`ab/ab12....webp`), so identical renders are stored once and
+a published name never changes. The names are saved in Book.cover_variants per batch, a
+rerun continues with the books still missing. Books whose original cannot be read get an
+empty mapping so they are not retried, --force re-renders everything.
+
+Needs Pillow (scripts/requirements.txt).
+"""
+import os
+import io
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, features
+from sqlalchemy import select, update
+
+from app.db import SessionLocal
+from app.models import Book
+from app.covers import COVER_VARIANTS_DIR, COVER_SIZES, COVER_FORMATS
+
+ENCODER_OPTIONS = {
+    "avif": {"quality": 55, "speed": 6},
+    "webp": {"quality": 80, "method": 4},
+}
+
+
+def store(data: bytes, fmt: str, output: str) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:24]
+    name = f"{digest[:2]}/{digest}.{fmt}"
+    path = os.path.join(output, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return name
+
+
+def render(book_id: int, original: str, output: str, formats: tuple[str, ...]) -> tuple[int, dict, str | None]:
+    """(book id, {size: {format: name}}, error)"""
+    try:
+        with Image.open(original) as image:
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+            variants = {}
+            for size, box in COVER_SIZES.items():
+                resized = image.copy()
+                # never upscales, small originals are only re-encoded
+                resized.thumbnail(box, Image.Resampling.LANCZOS)
+                variants[size] = {}
+                for fmt in formats:
+                    buffer = io.BytesIO()
+                    resized.save(buffer, format=fmt.upper(), **ENCODER_OPTIONS[fmt])
+                    variants[size][fmt] = store(buffer.getvalue(), fmt, output)
+        return book_id, variants, None
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return book_id, {}, f"{type(e).__name__}: {e}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=os.path.join("static", "covers"), help="directory cover_path is relative to")
+    parser.add_argument("--output", default=COVER_VARIANTS_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many books")
+    parser.add_argument("--force", action="store_true", help="re-render books that already have variants")
+    args = parser.parse_args()
+
+    formats = tuple(fmt for fmt in COVER_FORMATS if features.check(fmt))
+    skipped_formats = set(COVER_FORMATS) - set(formats)
+    if skipped_formats:
+        print(f"This Pillow build cannot write {', '.join(sorted(skipped_formats))}, skipping")
+    if not formats:
+        raise SystemExit("No usable output format")
+
+    db = SessionLocal()
+    last_id, rendered, failed = 0, 0, 0
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            while args.limit is None or rendered + failed < args.limit:
+                size = args.batch_size if args.limit is None else min(args.batch_size, args.limit - rendered - failed)
+                query = select(Book.id, Book.cover_path).where(Book.cover_path.isnot(None), Book.id > last_id)
+                if not args.force:
+                    query = query.where(Book.cover_variants.is_(None))
+                batch = db.execute(query.order_by(Book.id).limit(size)).all()
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                results = list(pool.map(
+                    render,
+                    [book.id for book in batch],
+                    [os.path.join(args.source, book.cover_path) for book in batch],
+                    [args.output] * len(batch),
+                    [formats] * len(batch),
+                ))
+                for book_id, _, error in results:
+                    if error:
+                        failed += 1
+                        print(f"  book {book_id}: {error}")
+                rendered += sum(1 for *_, error in results if error is None)
+
+                db.execute(update(Book), [{"id": book_id, "cover_variants": variants} for book_id, variants, _ in results])
+                db.commit()
+
+                elapsed = time.perf_counter() - started
+                print(f"{rendered:,} rendered, {failed:,} failed, up to book {last_id} ({(rendered + failed) / elapsed:,.1f} books/s)")
+    finally:
+        db.close()
+
+    print(f"Done in {time.perf_counter() - started:.1f}s: {rendered:,} books rendered, {failed:,} without a readable original")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,292 @@
-import kagglehub
-import pandas as pd
-from app.db import SessionLocal, engine
-from app.models import Book, Author, Genre
+"""
+Streaming catalog import (Kaggle "book covers" dataset layout).
+
+    python -m scripts.dataset --csv data/main_dataset.csv
+    python -m scripts.dataset --download        # fetch the dataset with kagglehub first
+
+The CSV is read in chunks of --chunk-size rows and every chunk is its own transaction:
+
+- author and genre names resolve through in-memory name -> id maps loaded once at start,
+  only names not seen before are inserted (one multi-row INSERT ... RETURNING per chunk);
+- books are COPY'd into a temporary staging table and merged with one
+  INSERT ... SELECT ... ON CONFLICT (isbn) DO UPDATE, so a re-import refreshes
+  title/author/genre/cover and keeps the stock count.
+
+A chunk the database rejects is split in halves and retried until the bad rows are isolated,
+those are reported and skipped.
+After every committed chunk the number of consumed CSV rows goes to the checkpoint file and
+a rerun continues from there (--restart ignores it). Chunks are idempotent, a crash between
+commit and checkpoint repeats one chunk at most.
+"""
+import os
+import csv
+import json
+import time
 import random
+import argparse
+from itertools import islice
+
+from sqlalchemy import select, insert, text, func
+
+from app.db import engine
+from app.models import Author, Genre, catalog_version
+
+NOT_SPECIFIED = "Not specified"
+DEFAULT_CSV = os.path.join("data", "main_dataset.csv")
+
+STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS import_books (
+        isbn varchar(255) NOT NULL,
+        title varchar(255) NOT NULL,
+        author_id integer NOT NULL,
+        genre_id integer,
+        cover_path varchar(300),
+        count integer NOT NULL
+    ) ON COMMIT DELETE ROWS
+"""
+
+MERGE_BOOKS = text("""
+    INSERT INTO books (isbn, title, author_id, genre_id, cover_path, count)
+    SELECT isbn, title, author_id, genre_id, cover_path, count FROM import_books
+    ON CONFLICT (isbn) DO UPDATE SET
+        title = EXCLUDED.title,
+        author_id = EXCLUDED.author_id,
+        genre_id = EXCLUDED.genre_id,
+        cover_path = EXCLUDED.cover_path,
+        -- a changed cover needs new variants, scripts/covers.py only renders rows without them
+        cover_variants = CASE
+            WHEN EXCLUDED.cover_path IS DISTINCT FROM books.cover_path THEN NULL
+            ELSE books.cover_variants
+        END
+    RETURNING (xmax = 0) AS inserted
+""")
+
+
+def clean(value, size: int) -> str | None:
+    value = (value or "").strip()
+    if not value or value.lower() == "nan":
+        return None
+    return value[:size]
+
+
+def parse_row(row: dict) -> dict | None:
+    """CSV row -> book fields with names instead of ids, None if the row is unusable"""
+    isbn = clean(row.get("isbn"), 255)
+    title = clean(row.get("name"), 255)
+    if isbn is None or title is None:
+        return None
+    return {
+        "isbn": isbn,
+        "title": title,
+        "author": clean(row.get("author"), 255) or NOT_SPECIFIED,
+        "genre": clean(row.get("category"), 255),
+        "cover_path": clean(row.get("img_paths"), 300),
+    }
+
+
+class NameMap:
+    """name -> id for a reference table, inserting names it has not seen yet"""
+
+    def __init__(self, conn, model):
+        self.model = model
+        # authors.name is not unique, the oldest row wins like the old per-row lookup did
+        self.ids = dict(conn.execute(
+            select(model.name, func.min(model.id)).group_by(model.name)
+        ).all())
+
+    def resolve(self, conn, names) -> int:
+        missing = sorted({name for name in names if name is not None and name not in self.ids})
+        if missing:
+            rows = conn.execute(
+                insert(self.model).values([{"name": name} for name in missing]).returning(self.model.id, self.model.name)
+            ).all()
+            self.ids.update((name, id_) for id_, name in rows)
+        return len(missing)
+
+    def get(self, name):
+        return None if name is None else self.ids[name]
+
+
+class Checkpoint:
+    def __init__(self, path: str, csv_path: str):
+        self.path = path
+        self.source = {"csv": os.path.abspath(csv_path), "size": os.path.getsize(csv_path)}
+
+    def load(self) -> int:
+        """CSV rows already imported from this very file, 0 if there is no matching checkpoint"""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if {k: state.get(k) for k in self.source} != self.source:
+            print(f"Checkpoint {self.path} belongs to another file, starting over")
+            return 0
+        return int(state.get("rows", 0))
+
+    def save(self, rows: int):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({**self.source, "rows": rows}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Importer:
+    def __init__(self, conn, rng: random.Random):
+        self.conn = conn
+        self.rng = rng
+        with conn.begin():
+            conn.exec_driver_sql(STAGING_DDL)
+        self._load_names()
+
+    def _load_names(self):
+        # also after a rollback, the maps may hold ids of names that were never committed
+        with self.conn.begin():
+            self.authors = NameMap(self.conn, Author)
+            self.genres = NameMap(self.conn, Genre)
+
+    def import_chunk(self, books: list[dict], depth: int = 0) -> dict:
+        """
+        Imports `books` in one transaction. If the database rejects it, the halves are
+        retried separately until the bad rows are isolated and skipped.
+        """
+        try:
+            with self.conn.begin():
+                return self._bulk(books)
+        except Exception as e:
+            reason = str(e).splitlines()[0]
+        self._load_names()
+
+        if len(books) == 1:
+            print(f"  skipped ISBN {books[0]['isbn']}: {reason}")
+            return {"inserted": 0, "updated": 0, "skipped": 1, "names": 0}
+        if depth == 0:
+            print(f"  chunk rejected ({reason}), bisecting")
+        middle = len(books) // 2
+        left = self.import_chunk(books[:middle], depth + 1)
+        right = self.import_chunk(books[middle:], depth + 1)
+        return {key: left[key] + right[key] for key in left}
+
+    def bump_version(self):
+        """Tells running servers (they poll catalog_version) to drop their cached catalog pages"""
+        with self.conn.begin():
+            self.conn.execute(select(catalog_version.next_value()))
+
+    def _resolve_names(self, books: list[dict]) -> int:
+        new = self.authors.resolve(self.conn, (book["author"] for book in books))
+        new += self.genres.resolve(self.conn, (book["genre"] for book in books))
+        return new
+
+    def _record(self, book: dict) -> tuple:
+        return (
+            book["isbn"], book["title"],
+            self.authors.get(book["author"]), self.genres.get(book["genre"]),
+            book["cover_path"], self.rng.randint(1, 10)
+        )
+
+    def _bulk(self, books: list[dict]) -> dict:
+        new_names = self._resolve_names(books)
+
+        cursor = self.conn.connection.driver_connection.cursor()
+        with cursor.copy("COPY import_books (isbn, title, author_id, genre_id, cover_path, count) FROM STDIN") as copy:
+            for book in books:
+                copy.write_row(self._record(book))
+
+        inserted = self.conn.execute(MERGE_BOOKS).scalars().all()
+        return {"inserted": sum(inserted), "updated": len(inserted) - sum(inserted), "skipped": 0, "names": new_names}
+
+
+def chunks(reader, size: int):
+    while True:
+        rows = list(islice(reader, size))
+        if not rows:
+            return
+        yield rows
+
+
+def download() -> str:
+    import kagglehub
+
+    path = kagglehub.dataset_download("lukaanicin/book-covers-dataset")
+    print("Path to dataset files:", path)
+    return os.path.join(path, "main_dataset.csv")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=None, help=f"dataset CSV (default: {DEFAULT_CSV})")
+    parser.add_argument("--download", action="store_true", help="download the Kaggle dataset and import its CSV")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: <csv>.checkpoint.json)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many CSV rows")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random stock counts")
+    args = parser.parse_args()
+
+    csv_path = args.csv or (download() if args.download else DEFAULT_CSV)
+    checkpoint = Checkpoint(args.checkpoint or csv_path + ".checkpoint.json", csv_path)
+    done = 0 if args.restart else checkpoint.load()
+    if done:
+        print(f"Resuming after {done:,} rows ({checkpoint.path})")
+
+    totals = {"inserted": 0, "updated": 0, "skipped": 0, "names": 0}
+    processed = 0
+    started = time.perf_counter()
+
+    with open(csv_path, newline="", encoding="utf-8") as f, engine.connect() as conn:
+        reader = csv.DictReader(f)
+        if done:
+            for _ in islice(reader, done):
+                pass
+        if args.limit is not None:
+            reader = islice(reader, max(args.limit - done, 0))
+
+        importer = Importer(conn, random.Random(args.seed))
+        for number, rows in enumerate(chunks(reader, args.chunk_size), start=1):
+            chunk_started = time.perf_counter()
+
+            books = {}
+            for row in rows:
+                book = parse_row(row)
+                if book is not None:
+                    # ON CONFLICT cannot touch the same row twice in one statement, first one wins
+                    books.setdefault(book["isbn"], book)
+
+            result = importer.import_chunk(list(books.values())) if books else dict.fromkeys(totals, 0)
+            importer.bump_version()
+            # unusable rows and ISBNs repeated inside the chunk
+            result["skipped"] += len(rows) - len(books)
+            for key in totals:
+                totals[key] += result[key]
+
+            done += len(rows)
+            processed += len(rows)
+            checkpoint.save(done)
+
+            chunk_elapsed = time.perf_counter() - chunk_started
+            elapsed = time.perf_counter() - started
+            print(
+                f"chunk {number}: {len(rows):,} rows in {chunk_elapsed:.2f}s ({len(rows) / chunk_elapsed:,.0f} rows/s), "
+                f"{result['inserted']:,} new, {result['updated']:,} updated, {result['skipped']:,} skipped | "
+                f"{done:,} rows total, {processed / elapsed:,.0f} rows/s"
+            )
+
+        with conn.begin():
+            conn.exec_driver_sql("ANALYZE authors, genres, books")
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Imported {processed:,} rows in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):,.0f} rows/s): "
+        f"{totals['inserted']:,} new books, {totals['updated']:,} updated, {totals['skipped']:,} skipped, "
+        f"{totals['names']:,} new authors/genres"
+    )
+    if args.limit is None:
+        checkpoint.clear()
+
 
-path = kagglehub.dataset_download("lukaanicin/book-covers-dataset")
-print("Path to dataset files:", path)
-
-df = pd.read_csv('data\main_dataset.csv')
-session = SessionLocal()
-
-processed_isbn = set()
-
-for idx, row in df.iterrows():
-    try:
-        if idx % 100 == 0:
-            print(f'{idx} of {len(df)} records processed. Book: {row['name']}')
-
-        isbn = str(row['isbn'])
-        if isbn in processed_isbn:
-            continue
-        processed_isbn.add(isbn)
-
-        if row['author'] is not None:     
-            author_name = str(row['author'])
-        else:
-            author_name = 'Not specified'
-        
-        author_obj = session.query(Author).filter(Author.name == author_name).first()
-        if not author_obj:
-            author_obj = Author(name=author_name)
-            session.add(author_obj)
-            session.flush()
-
-        genre_name = str(row['category'])
-        genre_obj = session.query(Genre).filter(Genre.name == genre_name).first()
-        if not genre_obj:
-            genre_obj = Genre(name=genre_name)
-            session.add(genre_obj)
-            session.flush()
-
-        session.add(Book(
-            title=row['name'],
-            isbn=isbn,
-            author_id=author_obj.id,
-            genre_id=genre_obj.id,
-            count=random.randint(1, 10),
-            cover_path=row['img_paths']
-            ))
-    except Exception as e:
-        print(f"Ошибка при обработке строки {idx} (ISBN: {row['isbn']}): {e}")
-        session.rollback()
-    
-
-session.commit()
-session.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()